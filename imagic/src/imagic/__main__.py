@@ -1,4 +1,22 @@
-from imagic.app import main
+import sys
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # Headless mode: keep toga out of the process
+        from imagic.batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        from imagic.bench import main as bench_main
+        sys.exit(bench_main(sys.argv[2:]))
+
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        from imagic.server import main as serve_main
+        sys.exit(serve_main(sys.argv[2:]))
+
+    if len(sys.argv) > 1 and sys.argv[1] == "importtime":
+        from imagic.startup import main as importtime_main
+        sys.exit(importtime_main(sys.argv[2:]))
+
+    from imagic.app import main
     main().main_loop()
@@ -0,0 +1,126 @@
+##=============================================================================
+# Animated images
+#
+# Runs a recipe on every frame of an animated GIF (or APNG / WebP) and
+# re-encodes the result with the original frame durations and loop count.
+# Frames are decoded lazily and processed on a pool of threads, a few ahead
+# of the one being written, so memory grows with the number of workers and
+# not the number of frames (except for WebP output, which Pillow encodes
+# from a list of every frame). A frame identical to a recent one (common in
+# looping and hold frames) reuses that frame's result instead of being
+# processed again.
+#
+#   IMAGIC_FRAME_THREADS   frames processed at once (default: CPU count)
+##=============================================================================
+import hashlib
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageSequence
+
+from imagic.encoding import save_animation
+from imagic.instrument import span
+from imagic.pipeline import Recipe, run_recipe
+from imagic.scheduler import Job, checkpoint, current_job, run_job
+
+
+def frame_workers():
+    """Frames processed at once, from IMAGIC_FRAME_THREADS"""
+    value = os.environ.get('IMAGIC_FRAME_THREADS')
+    return max(1, int(value)) if value else os.cpu_count() or 1
+
+
+def is_animated(input_path) -> bool:
+    """Whether an image file has more than one frame (reads only the headers)"""
+    with Image.open(input_path) as img:
+        return getattr(img, 'is_animated', False)
+
+
+def iter_frames(img: Image.Image):
+    """
+    Lazily yield (frame, duration_ms) for every frame of an opened image.
+    Each frame is a complete RGB or RGBA picture of its own.
+    """
+    for frame in ImageSequence.Iterator(img):
+        mode = 'RGBA' if 'A' in frame.mode or 'transparency' in frame.info else 'RGB'
+        yield frame.convert(mode), frame.info.get('duration', 0)
+
+
+def frame_digest(img: Image.Image):
+    return img.mode, img.size, hashlib.blake2b(img.tobytes(), digest_size=16).digest()
+
+
+def map_frames(func, frames, workers=None):
+    """
+    Yield (func(frame), duration) for each (frame, duration), in order.
+
+    Up to `workers` frames are processed at once and at most twice that many
+    are read ahead. A frame identical to one of the last few reuses its
+    result. Inside a scheduler job the frames stop when the job is cancelled.
+    """
+    workers = workers or frame_workers()
+    window = workers * 2
+
+    job = current_job()
+    if job is not None:
+        # Cancelled with the job; progress is reported per frame by the caller
+        frame_job = Job(job.id, job.loop)
+        frame_job.cancelled = job.cancelled
+        call = lambda frame: run_job(frame_job, func, frame)
+    else:
+        call = func
+
+    recent = OrderedDict()
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='imagic-frame') as executor:
+        try:
+            for frame, duration in frames:
+                digest = frame_digest(frame)
+                future = recent.get(digest)
+                if future is None:
+                    future = executor.submit(call, frame)
+                    recent[digest] = future
+                    if len(recent) > window:
+                        recent.popitem(last=False)
+                else:
+                    recent.move_to_end(digest)
+                pending.append((future, duration))
+                if len(pending) >= window:
+                    future, duration = pending.popleft()
+                    yield future.result(), duration
+            while pending:
+                future, duration = pending.popleft()
+                yield future.result(), duration
+        finally:
+            # Stopped early (an error or cancellation): drop the queued frames
+            for future, _ in pending:
+                future.cancel()
+
+
+def process_animation(input_path, recipe: Recipe, output_path, format='GIF', workers=None, **options):
+    """
+    Run a recipe on every frame of an animated image and save the result in
+    an animated format (GIF, PNG or WebP), keeping the frame durations and
+    loop count. `options` are the save_animation() quality settings.
+    Returns (frames, size).
+    """
+    with Image.open(input_path) as img:
+        total = img.n_frames
+        written = 0
+        loop = img.info.get('loop')
+        if img.format != 'GIF' and loop == 1:
+            # APNG and WebP count plays: once is a GIF without a loop count
+            loop = None
+
+        def progress(frames):
+            nonlocal written
+            for result, duration in frames:
+                written += 1
+                checkpoint(written / total, f'Frame {written} of {total} ...')
+                yield result, duration
+
+        with span('animation', img, frames=total, format=format):
+            frames = map_frames(lambda frame: run_recipe(frame, recipe), iter_frames(img), workers)
+            save_animation(progress(frames), output_path, format, loop=loop, count=total, **options)
+        return written, img.size
@@ -6,20 +6,20 @@
 # ----------|------------|-------------------------
 # 03/12/2024| TQ Ye      | First version
 ##=============================================================================
+# Only light modules are imported here. numpy, OpenCV, PIL, rembg and
+# tkinter are imported where they are first needed (see imagic.startup).
+from imagic.startup import report_startup, warm_up
+
 import toga
 from toga.style import Pack
 from toga.style.pack import COLUMN, ROW
-from rembg import remove
-from PIL import Image, ImageTk, ImageEnhance, ImageFilter, ImageOps
-import cv2  # For advanced image processing
-import numpy as np  # For array operations
-import tkinter as tk
-from tkinter import colorchooser
-
-import tempfile
-import asyncio
+
+from imagic import instrument
+from imagic.formats import ANIMATED_FORMATS, DEFAULT_COMPRESS_LEVEL, DEFAULT_QUALITY, FORMAT_EXTENSIONS, IMAGE_EXTENSIONS, save_format
+from imagic.scheduler import JobCancelled, ProcessingScheduler
+from imagic.sessions import DEFAULT_MODEL, MODELS
+
 import os
-import shutil
 
 class ImageMagic(toga.App):
     def startup(self):
@@ -33,10 +33,36 @@ class ImageMagic(toga.App):
         self.scroll_container = toga.ScrollContainer(style=Pack(flex=1))
         self.scroll_container.content = self.main_box
         
+        # Worker pool for processing jobs; a new job replaces the previous one
+        self.scheduler = ProcessingScheduler(on_progress=self.handle_progress)
+        # Saves run on their own, so editing a parameter while a save is in
+        # progress does not cancel it
+        self.save_scheduler = ProcessingScheduler(max_workers=1, on_progress=self.handle_progress)
+
+        # The current result, kept decoded in memory until it is saved
+        self.processed_image = None
+
+        # Steps added to the recipe so far, as (op, params); the operation
+        # being edited runs after them, except right after a recipe is
+        # loaded, when the loaded steps run as they are
+        self.recipe_steps = []
+        self.recipe_loaded = False
+
+        # Downscaled copies of the originals for fast previews, and display
+        # thumbnails; both created on first use
+        self.preview_cache = None
+        self.thumbnails = None
+
         # Setup components and window
         self.setup_ui_components()
         self.setup_window()
 
+        report_startup()
+
+        # Import the processing modules and load the default background
+        # removal model in the background, now that the window is up
+        warm_up(models=[DEFAULT_MODEL])
+
     def setup_ui_components(self):
         """Setup all UI components"""
         #self.create_title()
@@ -49,7 +75,10 @@ class ImageMagic(toga.App):
         self.main_box.add(self.upload_button)
         self.main_box.add(self.proc_option_box)
         self.main_box.add(self.params_box)
-        self.main_box.add(self.process_button)
+        self.main_box.add(self.process_row)
+        self.main_box.add(self.recipe_row)
+        self.main_box.add(self.progress_box)
+        self.main_box.add(self.breakdown_label)
         self.main_box.add(self.image_box)
 
     def create_title(self):
@@ -94,13 +123,47 @@ class ImageMagic(toga.App):
         self.proc_option_box.add(dropdown_label)
         self.proc_option_box.add(self.dropdown)
         
-        # Create process button
+        # Create process button and preview switch
+        self.process_row = toga.Box(style=Pack(direction=ROW))
         self.process_button = toga.Button(
             'Process Image',
             on_press=self.handle_processing,
             enabled=False,
             style=Pack(padding=6)
         )
+        self.preview_switch = toga.Switch(
+            'Fast Preview',
+            value=True,
+            style=Pack(padding=6)
+        )
+        self.process_row.add(self.process_button)
+        self.process_row.add(self.preview_switch)
+
+        # Recipe controls: chain operations, save and load them as JSON
+        self.recipe_row = toga.Box(style=Pack(direction=ROW))
+        self.recipe_row.add(toga.Button('Add Step', on_press=self.handle_add_step, style=Pack(padding=6)))
+        self.recipe_row.add(toga.Button('Clear Steps', on_press=self.handle_clear_steps, style=Pack(padding=6)))
+        self.recipe_row.add(toga.Button('Load Recipe', on_press=self.handle_load_recipe, style=Pack(padding=6)))
+        self.recipe_row.add(toga.Button('Save Recipe', on_press=self.handle_save_recipe, style=Pack(padding=6)))
+        self.recipe_label = toga.Label('', style=Pack(padding=(0, 8)))
+        self.recipe_row.add(self.recipe_label)
+
+        # Create progress bar, status and cancel button
+        self.progress_box = toga.Box(style=Pack(direction=ROW, padding=6))
+        self.progress_bar = toga.ProgressBar(max=1.0, style=Pack(flex=1, padding=(0, 8, 0, 0)))
+        self.status_label = toga.Label('', style=Pack(width=150, padding=(0, 8, 0, 0)))
+        self.cancel_button = toga.Button(
+            'Cancel',
+            on_press=self.handle_cancel,
+            enabled=False
+        )
+        self.progress_box.add(self.progress_bar)
+        self.progress_box.add(self.status_label)
+        self.progress_box.add(self.cancel_button)
+
+        # Per-stage timings of the last job, shown when tracing is enabled
+        # (IMAGIC_TRACE=1)
+        self.breakdown_label = toga.Label('', style=Pack(padding=(0, 6)))
 
     def create_image_display_section(self):
         """Create the image display section"""
@@ -143,15 +206,39 @@ class ImageMagic(toga.App):
             style=Pack(padding=8)
         )
         self.download_button.enabled = False
-        
-        # Add download button to image box
-        self.image_box.add(self.download_button)
+
+        # Encoding settings; the format comes from the file name chosen
+        self.quality_input = toga.NumberInput(
+            min_value=1,
+            max_value=100,
+            value=DEFAULT_QUALITY,
+            step=1,
+            style=Pack(width=70)
+        )
+        self.compress_level_input = toga.NumberInput(
+            min_value=0,
+            max_value=9,
+            value=DEFAULT_COMPRESS_LEVEL,
+            step=1,
+            style=Pack(width=70)
+        )
+        self.lossless_switch = toga.Switch('Lossless WebP', style=Pack(padding=(0, 8)))
+
+        # Add download button and settings to image box
+        save_row = toga.Box(style=Pack(direction=ROW, padding=(0, 5)))
+        save_row.add(self.download_button)
+        save_row.add(toga.Label('JPEG/WebP quality:', style=Pack(padding=(0, 6))))
+        save_row.add(self.quality_input)
+        save_row.add(toga.Label('PNG level:', style=Pack(padding=(0, 6))))
+        save_row.add(self.compress_level_input)
+        save_row.add(self.lossless_switch)
+        self.image_box.add(save_row)
 
     async def handle_download(self, widget):
         """Handle the download of processed image"""
         try:
-            # Get the processed image path
-            if not hasattr(self, 'processed_image_path'):
+            # Get the processed image
+            if self.processed_image is None:
                 print('No processed image available')
                 return
                 
@@ -159,14 +246,57 @@ class ImageMagic(toga.App):
             save_path = await self.main_window.save_file_dialog(
                 "Save processed image",
                 suggested_filename="processed_image.png",
-                file_types=['png']
+                file_types=['png', 'jpg', 'jpeg', 'webp', 'gif']
             )
             
             if save_path:
-                # Copy the processed image to the selected location
-                shutil.copy2(self.processed_image_path, save_path)
+                # Save in the format of the chosen extension, PNG if it has none
+                format = save_format(save_path, default=None)
+                if format is None:
+                    format = 'PNG'
+                    save_path = f'{save_path}{FORMAT_EXTENSIONS[format]}'
+
+                from imagic.animation import is_animated
+                if format in ANIMATED_FORMATS and is_animated(self.original_image_path):
+                    # Only the first frame is shown: process every frame now
+                    from imagic.animation import process_animation
+                    self.status_label.text = 'Processing frames ...'
+                    self.cancel_button.enabled = True
+                    try:
+                        await self.save_scheduler.run(
+                            process_animation, self.original_image_path, self.processed_recipe, save_path,
+                            **self.get_save_options(format)
+                        )
+                    finally:
+                        self.job_finished()
+                    self.status_label.text = ''
+                    print(f'Animation saved to: {save_path}')
+                    return
+
+                image = self.processed_image
+                if self.processed_is_preview:
+                    # Render the full resolution image with the same settings
+                    self.status_label.text = 'Rendering full resolution ...'
+                    image = await self.run_processing(self.processed_recipe, scheduler=self.save_scheduler)
+                    if image is None:
+                        return
+
+                # Encode the processed image to the selected location
+                from imagic.processing import save_image
+                self.status_label.text = 'Saving ...'
+                self.cancel_button.enabled = True
+                try:
+                    await self.save_scheduler.run(
+                        save_image, image, save_path, **self.get_save_options(format)
+                    )
+                finally:
+                    self.job_finished()
+                self.status_label.text = ''
                 print(f'Image saved to: {save_path}')
-                
+
+        except JobCancelled:
+            # The user pressed Cancel
+            print('Saving cancelled')
         except Exception as e:
             print(f'Error saving image: {e}')
             import traceback
@@ -182,20 +312,17 @@ class ImageMagic(toga.App):
             )
             if file_path:
                 if self.is_valid_image(file_path):
+                    # The running job belongs to the previous image; a save
+                    # in progress is left to finish
+                    self.scheduler.cancel()
+                    self.original_image_path = file_path
                     self.display_image(file_path, self.original_image_box)
                     self.process_button.enabled = True
                     
                     # Clear processed image and disable download button
                     self.processed_image_box.clear()
+                    self.processed_image = None
                     self.download_button.enabled = False
-                    
-                    # Clean up the previous processed image if it exists
-                    if hasattr(self, 'processed_image_path'):
-                        try:
-                            os.remove(self.processed_image_path)
-                            delattr(self, 'processed_image_path')
-                        except Exception as e:
-                            print(f'Error cleaning up temporary file: {e}')
                 else:
                     self.process_button.enabled = False
                     print('Invalid file type. Please upload an image file.')
@@ -204,18 +331,27 @@ class ImageMagic(toga.App):
 
     def is_valid_image(self, file_path):
         """Check if the file is a valid image"""
-        allowed_extensions = ['.png', '.jpg', '.jpeg', '.gif']
-        return any(str(file_path).lower().endswith(ext) for ext in allowed_extensions)
+        return str(file_path).lower().endswith(IMAGE_EXTENSIONS)
 
-    def display_image(self, file_path, container):
+    def display_image(self, source, container):
         """
-        Display an image in the specified container with max dimensions of 200x200
-        while maintaining aspect ratio
+        Display an image file or in-memory PIL image in the specified container
+        with max dimensions of 300x300 while maintaining aspect ratio.
+        Only a thumbnail is handed to the widget, never the full resolution image.
         """
+        from imagic.thumbnails import ThumbnailCache, make_thumbnail
+
+        if self.thumbnails is None:
+            self.thumbnails = ThumbnailCache()
+
         container.clear()
         
-        # Create the image and get its dimensions
-        image = toga.Image(file_path)
+        # Create the image from the thumbnail and get its dimensions
+        if isinstance(source, (str, os.PathLike)):
+            thumbnail = self.thumbnails.get(source)
+        else:
+            thumbnail = make_thumbnail(source)
+        image = toga.Image(thumbnail)
         width = image.width
         height = image.height
         
@@ -240,6 +376,9 @@ class ImageMagic(toga.App):
 
     def open_color_picker(self, widget):
         """Open a color picker dialog and store the selected color"""
+        import tkinter as tk
+        from tkinter import colorchooser
+
         # Initialize tkinter root
         root = tk.Tk()
         root.withdraw()  # Hide the root window
@@ -251,34 +390,6 @@ class ImageMagic(toga.App):
             self.selected_color = (r, g, b, 255)  # Add full opacity for alpha
             print(f'Selected color: {self.selected_color}')
 
-    def enhance_eyes(self, img: Image) -> Image:
-        '''
-        Enhance eyes by increasing local contrast and clarity.
-        Without AI-based facial detection, we'll need to use general image processing techniques 
-        that hopefully enhance the eye regions' contrast and clarity.
-        '''
-        # Convert to LAB color space for better control
-        from skimage import color
-        import numpy as np
-        
-        # Convert PIL to numpy array
-        img_np = np.array(img)
-        
-        # Convert to LAB color space
-        lab = color.rgb2lab(img_np / 255.0)
-        
-        # Increase lightness contrast
-        L = lab[:, :, 0]
-        L = np.clip(L * 1.2, 0, 100)  # Increase contrast of lightness channel
-        lab[:, :, 0] = L
-        
-        # Convert back to RGB
-        enhanced = color.lab2rgb(lab) * 255.0
-        enhanced = np.clip(enhanced, 0, 255).astype(np.uint8)
-        
-        # Convert back to PIL Image
-        return Image.fromarray(enhanced)
-
 #-------------------------------
 
     def handle_option_select(self, widget):
@@ -286,6 +397,7 @@ class ImageMagic(toga.App):
         Handle processing option selection
         """
         print(f'Selected option: {widget.value}')
+        self.edit_recipe()
 
         # Clear existing parameters
         self.params_box.clear()
@@ -310,11 +422,41 @@ class ImageMagic(toga.App):
                 self.color_button.enabled = switch.value
             
             self.checkbox.on_change = on_switch_change
+
+            # Refine the mask edges (hair, fur) with alpha matting
+            self.alpha_matting_switch = toga.Switch(
+                'Alpha Matting',
+                style=Pack(padding=(0, 8))
+            )
+
+            # Segment a reduced copy and upsample the mask
+            self.fast_mode_switch = toga.Switch(
+                'Fast Mode',
+                style=Pack(padding=(0, 8))
+            )
+
+            # Refit only the uncertain edge band; much faster than alpha matting
+            self.refine_edges_switch = toga.Switch(
+                'Refine Edges',
+                style=Pack(padding=(0, 8))
+            )
             
+            # Create a selection for the segmentation model
+            self.model_select = toga.Selection(
+                items=list(MODELS),
+                value=DEFAULT_MODEL,
+                style=Pack(padding=(0, 8), width=100)
+            )
+
             # Add the switch and color button to the parameters box
             self.params_box.add(toga.Label('Parameters:', style=Pack(padding=(0, 10))))
             self.params_box.add(self.checkbox)
             self.params_box.add(self.color_button)
+            self.params_box.add(self.alpha_matting_switch)
+            self.params_box.add(self.fast_mode_switch)
+            self.params_box.add(self.refine_edges_switch)
+            self.params_box.add(toga.Label('Model:', style=Pack(padding=(0, 4))))
+            self.params_box.add(self.model_select)
         elif widget.value == "Enhance Image":
             # Set params_box to use column direction
             self.params_box.style.update(direction=COLUMN)
@@ -324,6 +466,7 @@ class ImageMagic(toga.App):
             self.is_portrait = toga.Switch(
                 'Apply Portrait Enhancement',
                 value=False,
+                on_change=self.handle_param_change,
                 style=Pack(padding=(0, 6))
             )
             portrait_row.add(self.is_portrait)
@@ -340,6 +483,7 @@ class ImageMagic(toga.App):
                     max_value=2.0,
                     value=default_value1,
                     step=0.1,
+                    on_change=self.handle_param_change,
                     style=Pack(width=70)
                 )
                 label2 = toga.Label(label_text2, style=Pack(padding=(0, 6), width=100))
@@ -348,6 +492,7 @@ class ImageMagic(toga.App):
                     max_value=2.0,
                     value=default_value2,
                     step=0.1,
+                    on_change=self.handle_param_change,
                     style=Pack(width=70)
                 )
                 row.add(label1)
@@ -364,6 +509,8 @@ class ImageMagic(toga.App):
             self.params_box.add(row2)
             
         elif widget.value == "Artistic Filters":
+            from imagic.filters import FILTERS
+
             # Set params_box to use column direction
             self.params_box.style.update(direction=COLUMN)
             
@@ -371,7 +518,8 @@ class ImageMagic(toga.App):
             filter_row = toga.Box(style=Pack(direction=ROW, padding=(0, 5)))
             filter_label = toga.Label('Filter:', style=Pack(padding=(0, 8), width=100))
             self.filter_select = toga.Selection(
-                items=['Grayscale', 'Sepia', 'Blur', 'Emboss', 'Edge Enhance', 'Posterize', 'Negative'],
+                items=FILTERS,
+                on_change=self.handle_param_change,
                 style=Pack(width=150)
             )
             filter_row.add(filter_label)
@@ -385,6 +533,7 @@ class ImageMagic(toga.App):
                 max_value=2.0,
                 value=1.0,
                 step=0.1,
+                on_change=self.handle_param_change,
                 style=Pack(width=70)
             )
             intensity_row.add(intensity_label)
@@ -397,217 +546,242 @@ class ImageMagic(toga.App):
             pass
 
 #------------------------------------------------------------------------------
-    async def handle_processing(self, widget):
-        """Handle image processing"""
+    def get_current_step(self):
+        """The selected operation and its parameters, or None"""
         selected_option = self.dropdown.value
-        print(f'Processing image with option: {selected_option}')
-        
         if selected_option == "Remove Background":
-            await self.process_remove_background()
+            return self.get_remove_background_params()
         elif selected_option == "Enhance Image":
-            await self.process_enhance()
+            return self.get_enhance_params()
         elif selected_option == "Artistic Filters":
-            await self.process_artistic_filter()
+            return self.get_artistic_filter_params()
         # elif selected_option == "Object Removal":
-        #     await self.process_object_removal()
-        else:
-            print("Invalid option selected")
+        #     return self.get_object_removal_params()
+        return None
 
-    async def process_remove_background(self):
-        """Process image to remove background"""
+    def build_recipe(self):
+        """
+        The added steps followed by the operation being edited, or the
+        loaded recipe as it is until an operation or parameter is changed
+        """
+        from imagic.pipeline import Recipe
+
+        recipe = Recipe()
+        for op, params in self.recipe_steps:
+            recipe.add(op, params)
+        step = None if self.recipe_loaded else self.get_current_step()
+        if step is not None:
+            recipe.add(*step)
+        return recipe
+
+    async def handle_processing(self, widget):
+        """Handle image processing"""
+        print(f'Processing image with option: {self.dropdown.value}')
         try:
-            # Get original image path
-            original_image = self.original_image_box.children[0].image
-            input_path = original_image.path
-            
-            # Get background color settings
-            use_bgcolor = self.checkbox.value if hasattr(self, 'checkbox') else False
-            bgcolor = self.selected_color if (hasattr(self, 'selected_color') and use_bgcolor) else None
-
-            # Process image
-            with open(input_path, 'rb') as input_file:
-                input_data = input_file.read()
-                output_data = remove(input_data, bgcolor=bgcolor if use_bgcolor else None)
-            
-            # Save and display processed image
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-                temp_file.write(output_data)
-                output_path = temp_file.name
+            recipe = self.build_recipe()
+        except ValueError as e:
+            print(f'Invalid parameters: {e}')
+            return
+        if not len(recipe):
+            print("Invalid option selected")
+            return
 
-            # Wait a brief moment to ensure file is written
-            await asyncio.sleep(0.1)
+        await self.run_processing(recipe, preview=self.preview_switch.value)
 
-            self.display_image(output_path, self.processed_image_box)
-                
-            # Store the processed image path and enable download button
-            self.processed_image_path = output_path
-            self.download_button.enabled = True
+    def update_recipe_label(self):
+        ops = [op for op, _ in self.recipe_steps]
+        if not ops:
+            self.recipe_label.text = ''
+        elif self.recipe_loaded:
+            self.recipe_label.text = f'Recipe: {" → ".join(ops)}'
+        else:
+            self.recipe_label.text = f'Steps: {" → ".join(ops)} → …'
+
+    def edit_recipe(self):
+        """Run the operation being edited after the steps again"""
+        if self.recipe_loaded:
+            self.recipe_loaded = False
+            self.update_recipe_label()
+
+    def handle_add_step(self, widget):
+        """Append the operation being edited to the recipe"""
+        step = self.get_current_step()
+        if step is not None:
+            self.recipe_steps.append(step)
+            self.recipe_loaded = False
+            self.update_recipe_label()
+
+    def handle_clear_steps(self, widget):
+        self.recipe_steps = []
+        self.recipe_loaded = False
+        self.update_recipe_label()
+
+    async def handle_load_recipe(self, widget):
+        """Load the steps of a JSON recipe; Process runs them as saved"""
+        try:
+            path = await self.main_window.open_file_dialog(title="Load recipe", file_types=['json'])
+            if path:
+                from imagic.pipeline import Recipe
+                recipe = Recipe.load(path)
+                self.recipe_steps = [(step['op'], step['params']) for step in recipe.steps]
+                self.recipe_loaded = True
+                self.update_recipe_label()
+        except Exception as e:
+            print(f'Error loading recipe: {e}')
 
+    async def handle_save_recipe(self, widget):
+        """Save the recipe Process would run as JSON"""
+        try:
+            path = await self.main_window.save_file_dialog(
+                "Save recipe",
+                suggested_filename="recipe.json",
+                file_types=['json']
+            )
+            if path:
+                self.build_recipe().save(path)
+                print(f'Recipe saved to: {path}')
         except Exception as e:
-            print(f'Error processing image: {e}')
-            # Print more detailed error information
-            import traceback
-            traceback.print_exc()
+            print(f'Error saving recipe: {e}')
+
+    async def handle_param_change(self, widget):
+        """Re-apply the operation on the preview proxy when a parameter changes"""
+        self.edit_recipe()
+        if not self.preview_switch.value or not self.process_button.enabled:
+            return
+        await self.handle_processing(widget)
+
+    def get_remove_background_params(self):
+        """Read the background removal parameters from the widgets"""
+        use_bgcolor = self.checkbox.value if hasattr(self, 'checkbox') else False
+        bgcolor = self.selected_color if (hasattr(self, 'selected_color') and use_bgcolor) else None
+        model = self.model_select.value if hasattr(self, 'model_select') else DEFAULT_MODEL
+        alpha_matting = self.alpha_matting_switch.value if hasattr(self, 'alpha_matting_switch') else False
+        fast = self.fast_mode_switch.value if hasattr(self, 'fast_mode_switch') else False
+        refine_edges = self.refine_edges_switch.value if hasattr(self, 'refine_edges_switch') else False
+        return 'remove-bg', dict(bgcolor=bgcolor, model=model, alpha_matting=alpha_matting, fast=fast,
+                                 refine_edges=refine_edges)
+
+    def get_enhance_params(self):
+        """Read the enhancement parameters from the widgets"""
+        return 'enhance', dict(
+            color=float(self.color_input.value),
+            contrast=float(self.contrast_input.value),
+            brightness=float(self.brightness_input.value),
+            sharpness=float(self.sharpness_input.value),
+            portrait=self.is_portrait.value,
+        )
+
+    def get_save_options(self, format):
+        """Read the encoding settings from the widgets"""
+        return dict(
+            format=format,
+            quality=int(self.quality_input.value),
+            compress_level=int(self.compress_level_input.value),
+            lossless=self.lossless_switch.value,
+        )
+
+    def get_artistic_filter_params(self):
+        """Read the artistic filter parameters from the widgets"""
+        return 'filter', dict(
+            filter=self.filter_select.value,
+            intensity=float(self.intensity_input.value),
+        )
 
-    async def process_enhance(self):
+    async def run_processing(self, recipe, preview=False, scheduler=None):
         """
-        Process image enhancement
+        Run a recipe in the worker pool and display the result.
+        With preview=True the recipe runs on a downscaled proxy; the full
+        resolution result is rendered when it is saved. `scheduler` defaults
+        to the one whose jobs replace each other. A result for an image that
+        is no longer the open one is returned but not displayed.
+        Returns the result image, or None if the job failed or was cancelled.
         """
-        try:
-            # Get original image path
-            original_image = self.original_image_box.children[0].image
-            input_path = original_image.path
-            
-            # Open the image with PIL
-            img = Image.open(input_path)
-            
-            # Get enhancement parameters from number inputs
-            color_value = self.color_input.value
-            contrast_value = self.contrast_input.value
-            brightness_value = self.brightness_input.value
-            sharpness_value = self.sharpness_input.value
-            apply_portrait = self.is_portrait.value
-            
-            # Step 0: Noise Reduction (apply before enhancements)
-            img = img.filter(ImageFilter.MedianFilter(size=3))
-
-            # Step 1: Optional processes for portraits
-            if apply_portrait:
-                print("Smooth More ...")
-                # Selective smoothing
-                smooth_img = img.filter(ImageFilter.SMOOTH_MORE)
-                # Blend smoothed version with original to maintain some texture
-                img = Image.blend(img, smooth_img, 0.6)  # 60% smooth, 40% original
-
-                # Eye enhancement (if enabled)
-                print("Enhance Eyes ...")
-                # Create a copy for eye enhancement
-                eye_enhanced = self.enhance_eyes(img)
-                # Blend the eye-enhanced version with original
-                img = Image.blend(img, eye_enhanced, 0.25)
-
-            # Step 2: Color Enhancement
-            color_enhancer = ImageEnhance.Color(img)
-            img = color_enhancer.enhance(color_value)
-            
-            # Step 3: Brightness Enhancement
-            brightness_enhancer = ImageEnhance.Brightness(img)
-            img = brightness_enhancer.enhance(brightness_value)
-            
-            # Step 4: Contrast Enhancement
-            contrast_enhancer = ImageEnhance.Contrast(img)
-            img = contrast_enhancer.enhance(contrast_value)
-            
-            # Step 5: Sharpness Enhancement
-            #sharpness_enhancer = ImageEnhance.Sharpness(img)
-            #img = sharpness_enhancer.enhance(sharpness_value)
-
-            #Step 5: Smart Sharpening
-            if sharpness_value > 1.0:
-                # Use UnsharpMask for more controlled sharpening
-                img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
-                if sharpness_value > 1.5:
-                    # Additional edge enhancement for higher sharpness values
-                    img = img.filter(ImageFilter.EDGE_ENHANCE)
-
-            # Save the processed image to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-                output_path = temp_file.name
-                img.save(output_path, format='PNG')
-                
-            # Ensure file exists and is accessible
-            if os.path.exists(output_path):
-                # Wait a brief moment to ensure file is written
-                await asyncio.sleep(0.5)
-                
-                # Display the processed image
-                self.display_image(output_path, self.processed_image_box)
-                
-                # Store the processed image path and enable download button
-                self.processed_image_path = output_path
-                self.download_button.enabled = True
-            else:
-                raise Exception("Failed to save processed image")
-                
-        except Exception as e:
-            print(f'Error processing image: {e}')
-            import traceback
-            traceback.print_exc()
+        scheduler = scheduler or self.scheduler
+        # Get original image path
+        input_path = self.original_image_path
+
+        import functools
+        from imagic.cache import get_cache, get_stage_cache
+        from imagic.pipeline import process_recipe
+        from imagic.preview import ProxyCache, render_recipe_preview
+        from imagic.sources import get_sources
+
+        if self.preview_cache is None:
+            self.preview_cache = ProxyCache()
+
+        # Results are cached by input content and recipe, intermediate ones
+        # included, so repeating a request returns at once and changing a
+        # later step resumes from the earlier ones. The stages inside a step
+        # are cached too: changing Sharpness only re-runs the sharpening.
+        cache = get_cache()
+        stage_cache = get_stage_cache()
+        if preview:
+            compute = functools.partial(render_recipe_preview, self.preview_cache, input_path, recipe, cache, stage_cache)
+        else:
+            # The upload is decoded once, upright, and shared by every run
+            compute = functools.partial(
+                process_recipe, input_path, recipe, cache, stage_cache=stage_cache, sources=get_sources()
+            )
 
-    async def process_artistic_filter(self):
-        """Apply artistic filter to image"""
+        self.cancel_button.enabled = True
+        self.progress_bar.value = 0
         try:
-            # Get original image path
-            original_image = self.original_image_box.children[0].image
-            input_path = original_image.path
-            
-            # Open the image with PIL
-            img = Image.open(input_path)
-            
-            # Get filter parameters
-            filter_type = self.filter_select.value
-            intensity = self.intensity_input.value
-            
-            # Apply selected filter
-            if filter_type == 'Grayscale':
-                img = ImageOps.grayscale(img)
-                # Convert back to RGB mode for consistent handling
-                img = img.convert('RGB')
-                
-            elif filter_type == 'Sepia':
-                # Apply sepia filter
-                width, height = img.size
-                pixels = img.load()
-                for x in range(width):
-                    for y in range(height):
-                        r, g, b = pixels[x, y]
-                        tr = int(0.393 * r + 0.769 * g + 0.189 * b)
-                        tg = int(0.349 * r + 0.686 * g + 0.168 * b)
-                        tb = int(0.272 * r + 0.534 * g + 0.131 * b)
-                        pixels[x, y] = (min(tr, 255), min(tg, 255), min(tb, 255))
-                
-            elif filter_type == 'Blur':
-                # Apply Gaussian blur
-                img = img.filter(ImageFilter.GaussianBlur(radius=intensity * 2))
-                
-            elif filter_type == 'Emboss':
-                img = img.filter(ImageFilter.EMBOSS)
-                
-            elif filter_type == 'Edge Enhance':
-                img = img.filter(ImageFilter.EDGE_ENHANCE_MORE)
-                
-            elif filter_type == 'Posterize':
-                # Convert to RGB if not already
-                img = img.convert('RGB')
-                # Posterize effect (reduce number of colors)
-                img = ImageOps.posterize(img, int(8 - (intensity * 3)))
-                
-            elif filter_type == 'Negative':
-                img = ImageOps.invert(img)
-            
-            # Save the processed image
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-                output_path = temp_file.name
-                img.save(output_path, format='PNG')
-            
-            # Ensure file exists and is accessible
-            if os.path.exists(output_path):
-                # Wait a bit longer to ensure file is fully written
-                await asyncio.sleep(0.5)
-                
-                # Display the processed image
-                self.display_image(output_path, self.processed_image_box)
-                
-                # Store the processed image path and enable download button
-                self.processed_image_path = output_path
-                self.download_button.enabled = True
+            if instrument.enabled():
+                result, spans = await scheduler.run(instrument.collect_spans, compute)
             else:
-                raise Exception("Failed to save processed image")
-                
+                result = await scheduler.run(compute)
+        except JobCancelled:
+            # A newer job replaced this one, or the user pressed Cancel
+            print('Processing cancelled')
+            return None
         except Exception as e:
-            print(f'Error applying filter: {e}')
+            print(f'Error processing image: {e}')
+            # Print more detailed error information
             import traceback
             traceback.print_exc()
+            return None
+        finally:
+            self.job_finished()
+        if input_path != self.original_image_path:
+            # Another image was opened meanwhile: the result is not shown or
+            # kept as the current one, though a save in progress still writes it
+            return result
+
+        stats = cache.stats()
+        self.status_label.text = f'Cache: {stats["hits"] + stats["disk_hits"]} hits, {stats["misses"]} misses'
+        if instrument.enabled():
+            with instrument.span('display', result) as display:
+                self.display_image(result, self.processed_image_box)
+            self.breakdown_label.text = instrument.format_spans(spans) + f'\ndisplay: {display.seconds * 1000:.0f} ms'
+        else:
+            self.display_image(result, self.processed_image_box)
+
+        # Store the processed image and the settings that produced it,
+        # and enable download button
+        self.processed_image = result
+        self.processed_recipe = recipe
+        self.processed_is_preview = preview
+        self.download_button.enabled = True
+        return result
+
+    def handle_progress(self, fraction, message):
+        """Show progress reported by the running job"""
+        if fraction is not None:
+            self.progress_bar.value = fraction
+        if message:
+            self.status_label.text = message
+
+    def job_finished(self):
+        """Reset the progress controls once no job is left running"""
+        if not self.scheduler.busy and not self.save_scheduler.busy:
+            self.cancel_button.enabled = False
+            self.progress_bar.value = 0
+
+    def handle_cancel(self, widget):
+        """Cancel the running jobs, saves included"""
+        self.scheduler.cancel()
+        self.save_scheduler.cancel()
+        self.status_label.text = 'Cancelled'
 
 
 ################################################
@@ -0,0 +1,271 @@
+##=============================================================================
+# Headless batch processing
+#
+#   python -m imagic batch --op remove-bg|enhance|filter -o OUT_DIR INPUT ...
+#   python -m imagic batch --recipe RECIPE.json -o OUT_DIR INPUT ...
+#
+# INPUT may be a directory or a glob pattern. Files are streamed to a pool
+# of worker processes; outputs that already exist are skipped. Results are
+# saved as PNG unless --format jpeg, webp or gif is given. A single --op runs
+# as a one-step recipe through the same pipeline engine as the GUI. Animated
+# inputs keep every frame when the output format can store an animation.
+# This module must not import toga or tkinter.
+#
+# With --batch-size N, background removal runs on threads in one process
+# instead, so the segmentation of up to N images shares one ONNX run.
+##=============================================================================
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from imagic.filters import FILTERS
+from imagic.formats import ANIMATED_FORMATS, DEFAULT_COMPRESS_LEVEL, DEFAULT_QUALITY, FORMAT_EXTENSIONS, IMAGE_EXTENSIONS
+from imagic.pipeline import Recipe
+from imagic.processing import OPERATIONS
+from imagic.sessions import DEFAULT_MODEL, MODELS
+
+
+def iter_inputs(sources):
+    """Lazily yield image paths from directories and glob patterns"""
+    for source in sources:
+        if os.path.isdir(source):
+            entries = (entry.path for entry in os.scandir(source) if entry.is_file())
+        else:
+            entries = glob.iglob(source, recursive=True)
+        for path in entries:
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                yield path
+
+
+def output_path_for(input_path, output_dir, suffix='', format='PNG'):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f'{stem}{suffix}{FORMAT_EXTENSIONS[format]}')
+
+
+def parse_color(value):
+    """Parse 'R,G,B' or 'R,G,B,A' into an RGBA tuple"""
+    parts = [int(part) for part in value.split(',')]
+    if len(parts) not in (3, 4) or not all(0 <= part <= 255 for part in parts):
+        raise argparse.ArgumentTypeError(f'Invalid colour: {value}')
+    return tuple(parts) + ((255,) if len(parts) == 3 else ())
+
+
+def operation_params(args):
+    """Build the keyword arguments for the selected operation"""
+    if args.op == 'remove-bg':
+        return dict(bgcolor=args.bgcolor, model=args.model, alpha_matting=args.alpha_matting, fast=args.fast,
+                    refine_edges=args.refine_edges)
+    if args.op == 'enhance':
+        return dict(
+            color=args.color,
+            contrast=args.contrast,
+            brightness=args.brightness,
+            sharpness=args.sharpness,
+            portrait=args.portrait,
+        )
+    return dict(filter=args.filter, intensity=args.intensity)
+
+
+def save_options(args):
+    """Build the encoder settings for the selected output format"""
+    return dict(
+        format=args.format.upper(),
+        quality=args.quality,
+        compress_level=args.compress_level,
+        lossless=args.lossless,
+    )
+
+
+#------------------------------------------------------------------------------
+# Worker process side
+
+_worker_recipe = None
+_worker_save_options = None
+
+
+def _init_worker(recipe, onnx_threads, options):
+    global _worker_recipe, _worker_save_options
+    _worker_recipe = recipe
+    # The workers already use every core, so each PNG is compressed on one thread
+    _worker_save_options = dict(options, threads=1)
+    if onnx_threads:
+        os.environ['IMAGIC_ONNX_THREADS'] = str(onnx_threads)
+
+
+def _process_one(input_path, output_path):
+    """Process one file; returns (seconds, megapixels)"""
+    from imagic.animation import is_animated, process_animation
+    from imagic.pipeline import process_recipe
+    from imagic.processing import save_image
+
+    start = time.perf_counter()
+    # Write to a temporary name first so an interrupted run never leaves a
+    # truncated file that a later run would skip
+    partial_path = output_path + '.part'
+    try:
+        if _worker_save_options['format'] in ANIMATED_FORMATS and is_animated(input_path):
+            # One frame at a time per worker: the workers already use every core
+            options = {name: value for name, value in _worker_save_options.items() if name != 'threads'}
+            frames, (width, height) = process_animation(input_path, _worker_recipe, partial_path, workers=1, **options)
+            megapixels = frames * width * height / 1e6
+        else:
+            result = process_recipe(input_path, _worker_recipe)
+            megapixels = result.width * result.height / 1e6
+            save_image(result, partial_path, **_worker_save_options)
+        os.replace(partial_path, output_path)
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+    return time.perf_counter() - start, megapixels
+
+
+#------------------------------------------------------------------------------
+
+def run_batch(inputs, output_dir, op, params, workers=None, overwrite=False, suffix='', out=sys.stdout,
+              batch_size=1, options=None, recipe=None):
+    """
+    Process every input with `op` across `workers` processes, or with every
+    step of `recipe` when one is given.
+    With batch_size > 1, background removal uses `workers` threads instead
+    and segments up to batch_size images per ONNX run.
+    `options` are the save_image() settings (format, quality, ...).
+    Returns (processed, skipped, failed) counts.
+    """
+    options = {'format': 'PNG', **(options or {})}
+    recipe = recipe or Recipe.single(op, params)
+    remove_bg = [step['params'] for step in recipe.steps if step['op'] == 'remove-bg']
+    batched = bool(remove_bg) and batch_size > 1
+    workers = workers or (batch_size * 2 if batched else os.cpu_count()) or 1
+    os.makedirs(output_dir, exist_ok=True)
+
+    if batched:
+        # One process: ONNX gets all the cores, the batcher the images
+        from imagic.inference import enable_batching
+        enable_batching(batch_size)
+        executor_class, onnx_threads = ThreadPoolExecutor, None
+    else:
+        # Share the cores between the workers rather than oversubscribing them
+        executor_class = ProcessPoolExecutor
+        onnx_threads = max(1, (os.cpu_count() or 1) // workers) if remove_bg else None
+
+    processed = skipped = failed = 0
+    total_megapixels = 0.0
+    start = time.perf_counter()
+
+    with executor_class(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(recipe, onnx_threads, options)
+    ) as executor:
+        pending = {}
+
+        def collect(done):
+            nonlocal processed, failed, total_megapixels
+            for future in done:
+                input_path = pending.pop(future)
+                try:
+                    seconds, megapixels = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f'{input_path}: error: {e}', file=out)
+                    continue
+                processed += 1
+                total_megapixels += megapixels
+                print(f'{input_path}: {seconds:.2f}s ({megapixels:.1f} MP)', file=out)
+
+        for input_path in inputs:
+            output_path = output_path_for(input_path, output_dir, suffix, options['format'])
+            if not overwrite and os.path.exists(output_path):
+                skipped += 1
+                continue
+
+            # Keep only a few files in flight so huge directories stream
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[executor.submit(_process_one, input_path, output_path)] = input_path
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f'Processed {processed} images ({total_megapixels:.1f} MP) in {elapsed:.2f}s: '
+        f'{processed / elapsed if elapsed else 0:.2f} images/s, '
+        f'{total_megapixels / elapsed if elapsed else 0:.2f} MP/s '
+        f'({skipped} skipped, {failed} failed)',
+        file=out
+    )
+    return processed, skipped, failed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m imagic batch', description='Process images in bulk')
+    parser.add_argument('inputs', nargs='+', help='Input directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', required=True, help='Directory for the processed images')
+    parser.add_argument('--op', choices=sorted(OPERATIONS), help='Operation to run')
+    parser.add_argument('--recipe', default=None, help='JSON recipe to run instead of a single --op')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--overwrite', action='store_true', help='Reprocess images whose output already exists')
+    parser.add_argument('--suffix', default='', help='Suffix added to output file names')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Images per ONNX run for remove-bg; > 1 uses threads in one process')
+
+    group = parser.add_argument_group('output')
+    group.add_argument('--format', choices=['png', 'jpeg', 'webp', 'gif'], default='png', help='Output file format')
+    group.add_argument('--quality', type=int, default=DEFAULT_QUALITY, help='JPEG/WebP quality (WebP lossless: effort), 1-100')
+    group.add_argument('--compress-level', type=int, default=DEFAULT_COMPRESS_LEVEL, choices=range(10), metavar='0-9',
+                       help='PNG compression level')
+    group.add_argument('--lossless', action='store_true', help='Lossless WebP')
+
+    group = parser.add_argument_group('remove-bg')
+    group.add_argument('--model', default=DEFAULT_MODEL, choices=list(MODELS))
+    group.add_argument('--bgcolor', type=parse_color, default=None, help='Fill colour as R,G,B[,A]')
+    group.add_argument('--alpha-matting', action='store_true', help='Refine the mask edges with alpha matting')
+    group.add_argument('--fast', action='store_true', help='Segment a reduced copy and upsample the mask')
+    group.add_argument('--refine-edges', action='store_true',
+                       help='Refit the uncertain band of the mask to the image (faster than --alpha-matting)')
+
+    group = parser.add_argument_group('enhance')
+    group.add_argument('--color', type=float, default=1.2)
+    group.add_argument('--contrast', type=float, default=1.1)
+    group.add_argument('--brightness', type=float, default=1.1)
+    group.add_argument('--sharpness', type=float, default=1.3)
+    group.add_argument('--portrait', action='store_true')
+
+    group = parser.add_argument_group('filter')
+    group.add_argument('--filter', default='Grayscale', choices=FILTERS)
+    group.add_argument('--intensity', type=float, default=1.0)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if bool(args.op) == bool(args.recipe):
+        parser.error('give either --op or --recipe')
+    try:
+        recipe = Recipe.load(args.recipe) if args.recipe else Recipe.single(args.op, operation_params(args))
+    except (OSError, ValueError) as e:
+        parser.error(f'invalid recipe: {e}')
+
+    processed, skipped, failed = run_batch(
+        iter_inputs(args.inputs),
+        args.output_dir,
+        args.op,
+        None,
+        workers=args.workers,
+        overwrite=args.overwrite,
+        suffix=args.suffix,
+        batch_size=args.batch_size,
+        options=save_options(args),
+        recipe=recipe,
+    )
+    return 1 if failed else 0
@@ -0,0 +1,219 @@
+##=============================================================================
+# Benchmarks
+#
+#   python -m imagic bench [--ops enhance,filter] [--sizes 1,12,24,48]
+#                          [--source synthetic|example] [-o results.json]
+#                          [--baseline old.json [--threshold 0.15]]
+#
+# Runs every operation (background removal per model, each Enhance
+# configuration, every artistic filter) on images of the given sizes in
+# megapixels and reports wall time, CPU time, peak RSS and throughput.
+# Each case runs in a fresh process so its peak RSS is its own. Results are
+# saved as JSON; with --baseline, cases that got slower than the threshold
+# are flagged and the exit status is 1.
+##=============================================================================
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+from imagic.filters import FILTERS
+from imagic.kernels import filter_threads
+from imagic.sessions import MODELS
+
+SIZES = [1, 12, 24, 48]
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', '..', 'examples', 'Taylor-Swift.jpg')
+
+ENHANCE_CONFIGS = {
+    'default': dict(),
+    'portrait': dict(portrait=True),
+    'sharp': dict(sharpness=1.8),
+    'no-sharpen': dict(sharpness=1.0),
+}
+
+
+def build_cases(ops=('remove-bg', 'enhance', 'filter')):
+    """(name, op, params) for every benchmarked configuration"""
+    cases = []
+    if 'remove-bg' in ops:
+        for model in MODELS:
+            cases.append((f'remove-bg/{model}', 'remove-bg', dict(model=model)))
+        cases.append(('remove-bg/u2net-fast', 'remove-bg', dict(model='u2net', fast=True)))
+        cases.append(('remove-bg/u2net-refine', 'remove-bg', dict(model='u2net', refine_edges=True)))
+    if 'enhance' in ops:
+        for name, params in ENHANCE_CONFIGS.items():
+            cases.append((f'enhance/{name}', 'enhance', params))
+    if 'filter' in ops:
+        for name in FILTERS:
+            cases.append((f'filter/{name}', 'filter', dict(filter=name, intensity=1.0)))
+    return cases
+
+
+def image_size(megapixels, aspect=1.5):
+    width = int(math.sqrt(megapixels * 1e6 * aspect))
+    return width, max(1, int(width / aspect))
+
+
+def make_input(megapixels, source='synthetic'):
+    """A deterministic RGB test image of about `megapixels`"""
+    import numpy as np
+    from PIL import Image
+
+    size = image_size(megapixels)
+    if source == 'example':
+        with Image.open(EXAMPLE) as img:
+            return img.convert('RGB').resize(size, Image.Resampling.LANCZOS)
+
+    # Smooth colour blobs with some edges: upscale a small random image
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, (max(2, size[1] // 64), max(2, size[0] // 64), 3), dtype=np.uint8)
+    return Image.fromarray(small).resize(size, Image.Resampling.BICUBIC)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, or None where unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(name, op, params, megapixels, source='synthetic', repeat=1):
+    """Run one case in this process and return its measurements"""
+    from imagic.masks import get_mask_cache
+    from imagic.processing import run_operation
+
+    entry = dict(case=name, op=op, params=params, megapixels=megapixels)
+    try:
+        img = make_input(megapixels, source)
+        entry['megapixels'] = round(img.width * img.height / 1e6, 2)
+        entry['input_rss_mb'] = peak_rss_mb()
+        walls, cpus = [], []
+        for _ in range(repeat):
+            # Measure the work, not the caches
+            get_mask_cache().clear()
+            wall, cpu = time.perf_counter(), time.process_time()
+            run_operation(img, op, **params)
+            walls.append(time.perf_counter() - wall)
+            cpus.append(time.process_time() - cpu)
+    except Exception as e:
+        entry['error'] = f'{type(e).__name__}: {e}'
+        return entry
+
+    best = min(range(repeat), key=walls.__getitem__)
+    entry.update(
+        wall_s=walls[best],
+        cpu_s=cpus[best],
+        peak_rss_mb=peak_rss_mb(),
+        mp_per_s=entry['megapixels'] / walls[best] if walls[best] else None,
+    )
+    return entry
+
+
+def run_benchmarks(cases, sizes, source='synthetic', repeat=1, isolate=True, out=sys.stdout):
+    """Run every case at every size; returns the list of result entries"""
+    results = []
+    pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) if isolate else None
+    try:
+        for megapixels in sizes:
+            for name, op, params in cases:
+                args = (name, op, params, megapixels, source, repeat)
+                entry = pool.apply(run_case, args) if pool else run_case(*args)
+                results.append(entry)
+                print(format_entry(entry), file=out, flush=True)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return results
+
+
+def format_entry(entry, baseline_entry=None):
+    head = f'{entry["case"]:<28} {entry["megapixels"]:6.1f} MP'
+    if 'error' in entry:
+        return f'{head}  error: {entry["error"]}'
+    rss = entry['peak_rss_mb']
+    line = (
+        f'{head} {entry["wall_s"]:8.3f}s wall {entry["cpu_s"]:8.3f}s cpu '
+        f'{rss if rss is not None else float("nan"):8.0f} MB {entry["mp_per_s"]:7.2f} MP/s'
+    )
+    if baseline_entry and 'wall_s' in baseline_entry:
+        line += f'  ({entry["wall_s"] / baseline_entry["wall_s"]:.2f}x baseline)'
+    return line
+
+
+def _key(entry):
+    return entry['case'], round(entry['megapixels'])
+
+
+def compare(results, baseline, threshold=0.15):
+    """
+    Cases whose wall time grew by more than `threshold` (a fraction) over
+    the baseline: a list of (case, megapixels, baseline_s, current_s).
+    """
+    previous = {_key(entry): entry for entry in baseline if 'wall_s' in entry}
+    regressions = []
+    for entry in results:
+        old = previous.get(_key(entry))
+        if old is None or 'wall_s' not in entry:
+            continue
+        if entry['wall_s'] > old['wall_s'] * (1 + threshold):
+            regressions.append((entry['case'], entry['megapixels'], old['wall_s'], entry['wall_s']))
+    return regressions
+
+
+def machine_info():
+    return dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+        filter_threads=filter_threads(),
+        date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m imagic bench', description='Benchmark the processing operations')
+    parser.add_argument('--ops', default='remove-bg,enhance,filter', help='Comma separated operations')
+    parser.add_argument('--cases', default=None, help='Only cases whose name contains one of these (comma separated)')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='Comma separated sizes in megapixels')
+    parser.add_argument('--source', choices=['synthetic', 'example'], default='synthetic', help='Input image content')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case; the fastest is reported')
+    parser.add_argument('-o', '--output', default='bench-results.json', help='Where to save the results')
+    parser.add_argument('--baseline', default=None, help='Results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Slowdown that counts as a regression')
+    parser.add_argument('--no-isolate', action='store_true', help='Run all cases in this process (peak RSS is cumulative)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    cases = build_cases(args.ops.split(','))
+    if args.cases:
+        patterns = args.cases.split(',')
+        cases = [case for case in cases if any(pattern in case[0] for pattern in patterns)]
+    sizes = [float(size) for size in args.sizes.split(',')]
+
+    results = run_benchmarks(cases, sizes, args.source, args.repeat, isolate=not args.no_isolate)
+    with open(args.output, 'w') as f:
+        json.dump(dict(machine=machine_info(), source=args.source, results=results), f, indent=2)
+    print(f'Results saved to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for case, megapixels, old, new in regressions:
+            print(f'REGRESSION {case} at {megapixels:.1f} MP: {old:.3f}s -> {new:.3f}s ({new / old:.2f}x)')
+        if regressions:
+            return 1
+        print(f'No regressions over {args.threshold:.0%} against {args.baseline}')
+    return 0
@@ -0,0 +1,285 @@
+##=============================================================================
+# Result cache
+#
+# Processed images keyed by the content of the input file, the operation and
+# its parameters, so processing the same image again with the same settings
+# returns at once instead of re-running the pipeline (including the ONNX
+# background removal). Results live in a memory LRU and, optionally, in a
+# directory of PNG files; both tiers are bounded by size.
+#
+#   IMAGIC_CACHE_MB        memory tier size (default 256, 0 disables it)
+#   IMAGIC_CACHE_DIR       directory for the disk tier (default: none)
+#   IMAGIC_CACHE_DISK_MB   disk tier size (default 1024)
+#   IMAGIC_STAGE_CACHE_MB  intermediate stages of an operation (default 256)
+#
+# Cached images are shared between callers and must not be modified.
+#
+# The stage cache holds the intermediate arrays of multi-stage operations
+# (enhance), keyed by the input and the parameters of the stages that
+# produced them, so changing a late parameter only re-runs the stages after
+# it.
+##=============================================================================
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from imagic.thumbnails import image_bytes
+
+DEFAULT_CACHE_MB = 256
+DEFAULT_DISK_CACHE_MB = 1024
+DEFAULT_STAGE_CACHE_MB = 256
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Hash of a file's content"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result_key(digest, op, params, variant='full'):
+    """Cache key for an operation with the given parameters on an input"""
+    # JSON with sorted keys gives the same text for the same parameters;
+    # tuples (colours) and lists encode alike
+    text = json.dumps([digest, op, variant, params], sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """Two-tier LRU of processed images with hit and miss counts"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB << 20, disk_dir=None, disk_max_bytes=DEFAULT_DISK_CACHE_MB << 20):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.current_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._disk_entries = OrderedDict()
+        self._digests = {}
+        self._lock = threading.Lock()
+        if disk_dir:
+            self._scan_disk()
+
+    #--------------------------------------------------------------------------
+    # Keys
+
+    def digest(self, path):
+        """Content hash of an input file, remembered by path, mtime and size"""
+        stat = os.stat(path)
+        stamp = (os.fspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self._digests.get(stamp)
+        if digest is None:
+            digest = self._digests[stamp] = file_digest(path)
+        return digest
+
+    #--------------------------------------------------------------------------
+    # Lookup
+
+    def get(self, key, count=True) -> Image.Image:
+        """Return a cached result, or None; counts a hit or a miss unless count is False"""
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+                self.hits += count
+                return img
+
+        img = self._load_from_disk(key)
+        with self._lock:
+            if img is None:
+                self.misses += count
+                return None
+            self.disk_hits += count
+            self._remember(key, img)
+        return img
+
+    def put(self, key, img: Image.Image, disk=True):
+        """Cache a result; disk=False keeps it in memory only"""
+        with self._lock:
+            self._remember(key, img)
+        if self.disk_dir and disk:
+            self._save_to_disk(key, img)
+
+    def stats(self):
+        """Hit and miss counts and the size of each tier"""
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                bytes=self.current_bytes,
+                disk_entries=len(self._disk_entries),
+                disk_bytes=self.disk_bytes,
+            )
+
+    def clear(self):
+        """Empty the memory tier; the disk tier is kept"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    #--------------------------------------------------------------------------
+    # Memory tier
+
+    def _remember(self, key, img):
+        if self.max_bytes <= 0 or key in self._entries:
+            return
+        self._entries[key] = img
+        self.current_bytes += image_bytes(img)
+        # Always keep the newest entry, even if it alone exceeds the cap
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.current_bytes -= image_bytes(old)
+
+    #--------------------------------------------------------------------------
+    # Disk tier
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.png')
+
+    def _scan_disk(self):
+        """Index the existing cache files, least recently used first"""
+        os.makedirs(self.disk_dir, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith('.png'):
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, entry.name[:-len('.png')], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk_entries[key] = size
+            self.disk_bytes += size
+
+    def _load_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        with self._lock:
+            if key not in self._disk_entries:
+                return None
+            self._disk_entries.move_to_end(key)
+        path = self._disk_path(key)
+        try:
+            with Image.open(path) as img:
+                img.load()
+            os.utime(path)
+        except OSError as e:
+            print(f'Error reading cached result {path}: {e}')
+            with self._lock:
+                self.disk_bytes -= self._disk_entries.pop(key, 0)
+            return None
+        return img
+
+    def _save_to_disk(self, key, img):
+        path = self._disk_path(key)
+        partial_path = path + '.part'
+        try:
+            # Speed matters more than size for a cache
+            img.save(partial_path, format='PNG', compress_level=1)
+            os.replace(partial_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f'Error writing cached result {path}: {e}')
+            return
+
+        with self._lock:
+            self.disk_bytes += size - self._disk_entries.pop(key, 0)
+            self._disk_entries[key] = size
+            evicted = []
+            while self.disk_bytes > self.disk_max_bytes and len(self._disk_entries) > 1:
+                old, old_size = self._disk_entries.popitem(last=False)
+                self.disk_bytes -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(self._disk_path(old))
+            except OSError:
+                pass
+
+
+class StageCache:
+    """LRU of intermediate stage arrays, bounded by memory"""
+
+    def __init__(self, max_bytes=DEFAULT_STAGE_CACHE_MB << 20):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def find(self, keys):
+        """
+        The last of `keys` (one per stage, in order) that is cached, as
+        (index, array), or (-1, None); counts one hit or miss.
+        """
+        with self._lock:
+            for index in reversed(range(len(keys))):
+                arr = self._entries.get(keys[index])
+                if arr is not None:
+                    self._entries.move_to_end(keys[index])
+                    self.hits += 1
+                    return index, arr
+            self.misses += 1
+            return -1, None
+
+    def put(self, key, arr):
+        """Cache a stage's output; the array must not be modified afterwards"""
+        with self._lock:
+            if self.max_bytes <= 0 or key in self._entries:
+                return
+            self._entries[key] = arr
+            self.current_bytes += arr.nbytes
+            # Always keep the newest entry, even if it alone exceeds the cap
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                self.current_bytes -= old.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+#------------------------------------------------------------------------------
+
+_cache = None
+_stage_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResultCache:
+    """The process-wide result cache, configured from the environment"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                max_bytes=int(float(os.environ.get('IMAGIC_CACHE_MB', DEFAULT_CACHE_MB)) * (1 << 20)),
+                disk_dir=os.environ.get('IMAGIC_CACHE_DIR') or None,
+                disk_max_bytes=int(float(os.environ.get('IMAGIC_CACHE_DISK_MB', DEFAULT_DISK_CACHE_MB)) * (1 << 20)),
+            )
+        return _cache
+
+
+def get_stage_cache() -> StageCache:
+    """The process-wide stage cache, configured from the environment"""
+    global _stage_cache
+    with _cache_lock:
+        if _stage_cache is None:
+            _stage_cache = StageCache(int(float(os.environ.get('IMAGIC_STAGE_CACHE_MB', DEFAULT_STAGE_CACHE_MB)) * (1 << 20)))
+        return _stage_cache
@@ -0,0 +1,347 @@
+##=============================================================================
+# Output encoding
+#
+# Saves results as PNG, JPEG or WebP with the given quality settings.
+#
+# 8-bit PNGs are written by a small encoder of our own: every scanline uses
+# the Up filter (computed with NumPy), bands of rows are deflated on a thread
+# pool and each band becomes one IDAT chunk. zlib releases the GIL, so the
+# compression runs on several cores, and only a few bands are held in memory
+# at once. Other PNG modes, JPEG and WebP go through Pillow.
+#
+# JPEG has no alpha channel: transparent results are flattened onto white.
+#
+# GIFs and animated PNGs are written frame by frame (GIF frames each with
+# their own palette, APNG frames with the same parallel deflate), so an
+# animation can be streamed to disk without holding its frames. Animated
+# WebP goes through Pillow, which collects the frames first. Each GIF frame
+# is saved by Pillow as a GIF of its own, whose control extension and image
+# blocks are copied into the animation, its palette becoming the frame's.
+##=============================================================================
+import functools
+import io
+import itertools
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from imagic.formats import DEFAULT_COMPRESS_LEVEL, DEFAULT_QUALITY
+
+WEBP_METHOD = 4
+BAND_ROWS = 256
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Pillow mode -> PNG colour type, for the modes the PNG encoder handles
+PNG_COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+ADLER_BASE = 65521
+
+# Palette index reserved for transparent pixels in GIF frames
+GIF_TRANSPARENT = 255
+
+
+def encode_options(format, quality=DEFAULT_QUALITY, compress_level=DEFAULT_COMPRESS_LEVEL, lossless=False):
+    """Pillow save() keyword arguments for a format"""
+    if format == 'PNG':
+        return dict(compress_level=compress_level)
+    if format == 'JPEG':
+        return dict(quality=quality)
+    if format == 'WEBP':
+        # For lossless WebP, quality is the compression effort; exact keeps
+        # the colour under fully transparent pixels
+        return dict(quality=quality, lossless=lossless, exact=lossless, method=WEBP_METHOD)
+    if format == 'GIF':
+        return dict()
+    raise ValueError(f'Unsupported save format: {format}')
+
+
+def prepare(img: Image, format) -> Image:
+    """Convert an image to a mode the format can store"""
+    if format == 'JPEG':
+        if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            return Image.alpha_composite(Image.new('RGBA', rgba.size, 'white'), rgba).convert('RGB')
+        if img.mode not in ('RGB', 'L', 'CMYK'):
+            return img.convert('RGB')
+    elif format == 'WEBP' and img.mode not in ('RGB', 'RGBA'):
+        return img.convert('RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB')
+    return img
+
+
+def save(img: Image, path, format, quality=DEFAULT_QUALITY, compress_level=DEFAULT_COMPRESS_LEVEL,
+         lossless=False, threads=None):
+    """
+    Encode an image to `path` (a file name or binary file object).
+    `threads` is the number of threads compressing a PNG (default: all cores).
+    """
+    img = prepare(img, format)
+    if format == 'PNG' and img.mode in PNG_COLOR_TYPES:
+        if isinstance(path, (str, os.PathLike)):
+            with open(path, 'wb') as f:
+                write_png(img, f, compress_level, threads)
+        else:
+            write_png(img, path, compress_level, threads)
+        return
+    if format == 'GIF':
+        save_animation([(img, 0)], path, format)
+        return
+
+    options = encode_options(format, quality, compress_level, lossless)
+    icc_profile = img.info.get('icc_profile')
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    img.save(path, format=format, **options)
+
+
+#------------------------------------------------------------------------------
+# PNG
+
+def _chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(tag)))
+
+
+def adler32_combine(adler1, adler2, length2):
+    """Adler-32 of two buffers from the checksums of each and the length of the second"""
+    rem = length2 % ADLER_BASE
+    low1, high1 = adler1 & 0xffff, adler1 >> 16
+    low = (low1 + (adler2 & 0xffff) - 1) % ADLER_BASE
+    high = (rem * low1 + high1 + (adler2 >> 16) - rem) % ADLER_BASE
+    return low | (high << 16)
+
+
+def _deflate_band(rows, start, stop, level, last):
+    """Up-filter and deflate rows[start:stop]; returns (data, adler32, length)"""
+    band = rows[start:stop]
+    filtered = np.empty((len(band), band.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    if start:
+        np.subtract(band, rows[start - 1:stop - 1], out=filtered[:, 1:])
+    else:
+        # The first scanline has no previous row to subtract
+        filtered[0, 1:] = band[0]
+        np.subtract(band[1:], band[:-1], out=filtered[1:, 1:])
+    raw = filtered.data
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(raw) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(raw), filtered.size
+
+
+def _png_header(f, img: Image, width, height, mode):
+    f.write(PNG_SIGNATURE)
+    f.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, PNG_COLOR_TYPES[mode], 0, 0, 0)))
+    icc_profile = img.info.get('icc_profile')
+    if icc_profile:
+        f.write(_chunk(b'iCCP', b'ICC Profile\0\0' + zlib.compress(icc_profile)))
+
+
+def _write_image_data(img: Image, write, compress_level, threads, band_rows):
+    """
+    Deflate an image's scanlines as one zlib stream, band by band in
+    parallel, passing each piece to write(data) in order
+    """
+    width, height = img.size
+    rows = np.asarray(img).reshape(height, -1)
+    threads = threads or os.cpu_count() or 1
+
+    # zlib header for a 32K window; the level bits are advisory
+    write(b'\x78\x01')
+    adler = 1
+    pending = deque()
+
+    def write_next():
+        nonlocal adler
+        data, band_adler, length = pending.popleft().result()
+        write(data)
+        adler = adler32_combine(adler, band_adler, length)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for start in range(0, height, band_rows):
+            # Keep only a few bands in flight, writing them in order
+            if len(pending) >= threads * 2:
+                write_next()
+            stop = min(start + band_rows, height)
+            pending.append(executor.submit(_deflate_band, rows, start, stop, compress_level, stop == height))
+        while pending:
+            write_next()
+    write(struct.pack('>I', adler))
+
+
+def write_png(img: Image, f, compress_level=DEFAULT_COMPRESS_LEVEL, threads=None, band_rows=BAND_ROWS):
+    """
+    Write an 8-bit L, LA, RGB or RGBA image as PNG, deflating bands of rows
+    in parallel. The bands are raw deflate blocks ending on a sync flush, so
+    concatenated they form one zlib stream.
+    """
+    _png_header(f, img, *img.size, img.mode)
+    _write_image_data(img, lambda data: f.write(_chunk(b'IDAT', data)), compress_level, threads, band_rows)
+    f.write(_chunk(b'IEND', b''))
+
+
+#------------------------------------------------------------------------------
+# Animations
+
+def save_animation(frames, path, format, size=None, loop=None, quality=DEFAULT_QUALITY,
+                   compress_level=DEFAULT_COMPRESS_LEVEL, lossless=False, count=None):
+    """
+    Encode an iterable of (img, duration_ms) frames as a GIF, animated PNG or
+    WebP. `loop` is the GIF loop count: None plays once, 0 repeats forever.
+    GIF frames are written as they arrive; `size` is the canvas size (default:
+    that of the first frame, which is then read before writing the header).
+    PNG frames are written as they arrive when their `count` is given, since
+    it goes in the header; otherwise they are collected first, as WebP's are.
+    """
+    if format in ('GIF', 'PNG'):
+        if format == 'PNG':
+            if count is None:
+                frames = list(frames)
+                count = len(frames)
+            write = functools.partial(write_apng, count=count, loop=loop, compress_level=compress_level)
+        else:
+            write = functools.partial(write_gif, size=size, loop=loop)
+        if isinstance(path, (str, os.PathLike)):
+            with open(path, 'wb') as f:
+                write(frames, f)
+        else:
+            write(frames, path)
+        return
+
+    if format != 'WEBP':
+        raise ValueError(f'{format} cannot store an animation')
+    frames = list(frames)
+    mode = 'RGBA' if any('A' in img.mode or 'transparency' in img.info for img, _ in frames) else 'RGB'
+    images = [img.convert(mode) for img, _ in frames]
+    options = encode_options(format, quality, compress_level, lossless)
+    images[0].save(
+        path,
+        format=format,
+        save_all=True,
+        append_images=images[1:],
+        duration=[duration for _, duration in frames],
+        # APNG and WebP count plays, with 0 for forever
+        loop=1 if loop is None else loop,
+        **options
+    )
+
+
+def write_apng(frames, f, count, loop=None, compress_level=DEFAULT_COMPRESS_LEVEL, threads=None,
+               band_rows=BAND_ROWS):
+    """
+    Write `count` (img, duration_ms) frames as an animated PNG, one frame at
+    a time. Every frame is a complete picture the size of the first; the
+    first frame decides between RGB and RGBA.
+    """
+    frames = iter(frames)
+    first = next(frames)
+    width, height = first[0].size
+    mode = 'RGBA' if 'A' in first[0].mode or 'transparency' in first[0].info else 'RGB'
+
+    _png_header(f, first[0], width, height, mode)
+    # APNG counts plays, with 0 for forever
+    f.write(_chunk(b'acTL', struct.pack('>II', count, 1 if loop is None else loop)))
+    sequence = itertools.count()
+    written = 0
+    for img, duration in itertools.chain([first], frames):
+        if img.size != (width, height):
+            raise ValueError('Animation frames must all have the same size')
+        # Replace the whole canvas with the frame, and leave it in place
+        f.write(_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', next(sequence), width, height, 0, 0, int(duration), 1000, 0, 0
+        )))
+        if written:
+            write = lambda data: f.write(_chunk(b'fdAT', struct.pack('>I', next(sequence)) + data))
+        else:
+            write = lambda data: f.write(_chunk(b'IDAT', data))
+        _write_image_data(img.convert(mode), write, compress_level, threads, band_rows)
+        written += 1
+    if written != count:
+        raise ValueError(f'Expected {count} animation frames, got {written}')
+    f.write(_chunk(b'IEND', b''))
+
+
+def gif_frame(img: Image):
+    """
+    Quantise a frame to its own palette; returns (frame, transparency index
+    or None). Pixels less than half opaque become transparent.
+    """
+    if 'A' not in img.mode and 'transparency' not in img.info:
+        return img.convert('RGB').quantize(256), None
+    rgba = img.convert('RGBA')
+    frame = rgba.convert('RGB').quantize(GIF_TRANSPARENT)
+    palette = frame.getpalette()
+    frame.putpalette(palette + [0] * (768 - len(palette)))
+    frame.paste(GIF_TRANSPARENT, mask=rgba.getchannel('A').point(lambda a: 255 if a < 128 else 0))
+    return frame, GIF_TRANSPARENT
+
+
+def write_gif(frames, f, size=None, loop=None):
+    """Write (img, duration_ms) frames as a GIF, one frame at a time"""
+    frames = iter(frames)
+    first = next(frames)
+    width, height = size or first[0].size
+
+    # A two colour global palette; every frame carries its own
+    f.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0x80, 0, 0) + b'\0\0\0\xff\xff\xff')
+    if loop is not None:
+        f.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\0')
+    for img, duration in itertools.chain([first], frames):
+        frame, transparency = gif_frame(img)
+        # Frames are complete pictures: clear transparent ones before the next
+        params = dict(duration=duration, disposal=1 if transparency is None else 2)
+        if transparency is not None:
+            params['transparency'] = transparency
+        data = io.BytesIO()
+        frame.save(data, format='GIF', optimize=False, **params)
+        f.write(_gif_frame_blocks(data.getvalue()))
+    f.write(b';')
+
+
+def _skip_sub_blocks(data, pos):
+    """Position after the GIF data sub-blocks starting at `pos`"""
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _gif_frame_blocks(data):
+    """
+    The graphic control extension and image of a single-frame GIF, with its
+    global colour table moved into the image as a local one
+    """
+    flags = data[10]
+    pos = 13
+    table, table_bits = b'', 0
+    if flags & 0x80:
+        table_bits = flags & 7
+        pos += 3 << (table_bits + 1)
+        table = data[13:pos]
+
+    blocks = []
+    while data[pos] != 0x3B:
+        if data[pos] == 0x21:
+            # Extensions: keep the frame's delay, disposal and transparency
+            end = _skip_sub_blocks(data, pos + 2)
+            if data[pos + 1] == 0xF9:
+                blocks.append(data[pos:end])
+        elif data[pos] == 0x2C:
+            image_flags = data[pos + 9]
+            start = pos + 10
+            if image_flags & 0x80:
+                start += 3 << ((image_flags & 7) + 1)
+                blocks.append(data[pos:start])
+            elif table:
+                blocks.append(data[pos:pos + 9] + bytes([image_flags & 0x60 | 0x80 | table_bits]) + table)
+            else:
+                blocks.append(data[pos:start])
+            # LZW code size, then the compressed pixels
+            end = _skip_sub_blocks(data, start + 1)
+            blocks.append(data[start:end])
+        else:
+            raise ValueError(f'Unexpected GIF block: {data[pos]:#x}')
+        pos = end
+    return b''.join(blocks)
@@ -0,0 +1,352 @@
+##=============================================================================
+# Enhancement engine
+#
+# A fused version of the Enhance Image chain. Color is a 3x4 colour matrix
+# and Brightness and Contrast are folded into a single 256-entry LUT, both
+# applied in place; Contrast's mean comes from a chunked luma histogram
+# instead of an extra image. The neighbourhood filters (median, smooth,
+# unsharp mask, edge enhance) run with OpenCV on two ping-pong buffers that
+# are reused from stage to stage instead of allocating a new image per step,
+# in bands of rows spread over the cores (see imagic.kernels).
+#
+# The result matches the PIL chain (ImageFilter / ImageEnhance) to within a
+# mean absolute difference of 1 level. The remaining differences come from
+# rounding inside PIL's filters, from the float32 LAB of the eye stage and
+# from the 1-pixel border, which PIL leaves unfiltered; EDGE_ENHANCE
+# amplifies them, so isolated pixels can differ by more. With portrait and
+# a sharpness above 1.5 the eye stage's rounding goes through both
+# sharpening filters, and the mean difference is up to 2.5 levels.
+#
+# enhance_tiled() runs the same chain tile by tile for images too large to
+# hold several copies of; the Contrast mean is measured over the whole
+# image first, so the tiles stitch back to the untiled result.
+#
+# The chain is a line of four stages (median, portrait, tone, sharpen).
+# Given a StageCache, enhance() caches the output of each stage under the
+# input and the parameters up to that stage, and starts from the last one
+# still valid: changing Sharpness only re-runs the sharpening.
+##=============================================================================
+import functools
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from imagic.filters import merge_alpha, split_alpha
+from imagic.instrument import Stages
+from imagic.kernels import CHUNK_ROWS, convolve, gaussian_blur, median, run_chunks
+from imagic.masks import image_digest
+from imagic.scheduler import checkpoint
+from imagic.tiling import TILE_SIZE, gaussian_halo, process_tiled
+
+# PIL's ImageFilter.SMOOTH_MORE and ImageFilter.EDGE_ENHANCE kernels, as
+# integer taps and a scale. With integer taps the sums are exact int16
+# values, so a pixel's result does not depend on where the image is split
+# into chunks or tiles.
+SMOOTH_MORE_KERNEL = np.array([
+    [1, 1, 1, 1, 1],
+    [1, 5, 5, 5, 1],
+    [1, 5, 44, 5, 1],
+    [1, 5, 5, 5, 1],
+    [1, 1, 1, 1, 1],
+], dtype=np.float32)
+SMOOTH_MORE_SCALE = 1 / 100
+
+EDGE_ENHANCE_KERNEL = np.array([
+    [-1, -1, -1],
+    [-1, 10, -1],
+    [-1, -1, -1],
+], dtype=np.float32)
+EDGE_ENHANCE_SCALE = 1 / 2
+
+# ITU-R 601-2 luma, as used by PIL for convert('L')
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def lightness_contrast(arr, factor=1.2, amount=1.0):
+    '''
+    Scale the LAB lightness of an RGB uint8 array in place.
+    Works on float32 LAB one band of rows at a time, so the temporary data is
+    a few rows rather than a float64 copy of the whole image. `amount` blends
+    the result with the original in RGB, as Image.blend does.
+    '''
+    def band(top, bottom):
+        rows = arr[top:bottom]
+        lab = cv2.cvtColor(rows.astype(np.float32) / 255.0, cv2.COLOR_RGB2LAB)
+        lightness = lab[..., 0]
+        lightness *= factor
+        np.minimum(lightness, 100, out=lightness)
+        rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+        rgb *= 255.0
+        np.clip(rgb, 0, 255, out=rgb)
+        if amount == 1.0:
+            rows[...] = rgb
+        else:
+            blend_into(rows, rgb.astype(np.uint8), amount)
+    run_chunks(band, arr.shape[0])
+
+
+def blend_into(arr, other, alpha):
+    """
+    Image.blend(arr, other, alpha) written into arr: PIL computes
+    arr + alpha * (other - arr) in double precision, stores it as a float
+    and truncates.
+    """
+    mixed = other.astype(np.float64)
+    mixed -= arr
+    mixed *= alpha
+    mixed += arr
+    mixed = mixed.astype(np.float32)
+    np.clip(mixed, 0, 255, out=mixed)
+    arr[...] = mixed
+
+
+def enhance_eyes(img: Image, factor=1.2, amount=1.0) -> Image:
+    '''
+    Enhance eyes by increasing local contrast and clarity.
+    Without AI-based facial detection, we'll need to use general image processing techniques
+    that hopefully enhance the eye regions' contrast and clarity.
+    '''
+    rgb, alpha = split_alpha(img)
+    arr = np.array(rgb)
+    lightness_contrast(arr, factor, amount)
+    return merge_alpha(Image.fromarray(arr), alpha)
+
+
+def color_matrix(color):
+    """
+    ImageEnhance.Color as a 3x4 matrix: x1 = gray + color * (x - gray),
+    where gray = LUMA . x
+    """
+    matrix = np.zeros((3, 4), dtype=np.float32)
+    matrix[:, :3] = color * np.eye(3, dtype=np.float32) + (1.0 - color) * LUMA[np.newaxis, :]
+    # PIL truncates where cv2 rounds
+    matrix[:, 3] = -0.5
+    return matrix
+
+
+def brightness_lut(brightness):
+    """ImageEnhance.Brightness as a LUT (scale, truncate, clip)"""
+    return np.clip(np.floor(np.arange(256) * brightness), 0, 255).astype(np.uint8)
+
+
+def tone_lut(brightness, contrast, mean):
+    """
+    ImageEnhance.Brightness followed by ImageEnhance.Contrast as one
+    256-entry LUT, including PIL's clipping and truncation after each step:
+    x2 = brightness * x1, x3 = mean + contrast * (x2 - mean)
+    """
+    x2 = brightness_lut(brightness).astype(np.float32)
+    x3 = np.floor(mean + contrast * (x2 - mean))
+    return np.clip(x3, 0, 255).astype(np.uint8)
+
+
+def luma_histogram(src, brightness):
+    """Histogram of the luma after the Brightness step, chunk by chunk"""
+    lut = brightness_lut(brightness)
+    hist = np.zeros(256)
+    for top in range(0, src.shape[0], CHUNK_ROWS):
+        gray = cv2.cvtColor(cv2.LUT(src[top:top + CHUNK_ROWS], lut), cv2.COLOR_RGB2GRAY)
+        hist += cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    return hist
+
+
+def histogram_mean(hist):
+    """Mean of a histogram, rounded as ImageEnhance.Contrast does"""
+    return int(np.dot(hist, np.arange(256)) / max(1, hist.sum()) + 0.5)
+
+
+def contrast_mean(src, brightness):
+    """
+    Mean luma of the image after the Brightness step, rounded as
+    ImageEnhance.Contrast does. Computed from a histogram so the brightened
+    image is never materialised.
+    """
+    return histogram_mean(luma_histogram(src, brightness))
+
+
+def sharpen_level(sharpness):
+    """0: no sharpening, 1: unsharp mask, 2: unsharp mask and edge enhancement"""
+    return 0 if sharpness <= 1.0 else 1 if sharpness <= 1.5 else 2
+
+
+def stage_keys(img: Image, color, contrast, brightness, sharpness, portrait, mean=None):
+    """
+    Stage cache keys for enhance(): one per stage (median, portrait, tone,
+    sharpen), made of the input and the parameters of that stage and of
+    every stage before it.
+    """
+    key = (image_digest(img),)
+    keys = []
+    for params in ((), (portrait,), (color, brightness, contrast, mean), (sharpen_level(sharpness),)):
+        key += params
+        keys.append(key)
+    return keys
+
+
+def enhance(img: Image, color=1.2, contrast=1.1, brightness=1.1, sharpness=1.3, portrait=False,
+            report=None, mean=None, stage_cache=None) -> Image:
+    """
+    Enhance an image: noise reduction, optional portrait smoothing, colour,
+    brightness and contrast, then sharpening.
+
+    Pass a list as `report` to collect per-stage timing and peak memory.
+    `mean` overrides the Contrast mean, which is otherwise measured on img.
+    With a StageCache the output of each stage is cached and the chain
+    resumes after the last stage whose parameters have not changed.
+    """
+    rgb, alpha = split_alpha(img)
+    stages = Stages(report, prefix='enhance.')
+    try:
+        done, cached, keys = -1, None, None
+        if stage_cache is not None:
+            keys = stage_keys(rgb, color, contrast, brightness, sharpness, portrait, mean)
+            done, cached = stage_cache.find(keys[:-1])
+
+        def store(index, src):
+            if keys is not None:
+                stage_cache.put(keys[index], src.copy())
+
+        # Two working buffers, swapped after each neighbourhood filter
+        src = stages.run('decode', np.array, rgb if cached is None else cached)
+        dst = np.empty_like(src)
+
+        # Step 0: Noise Reduction (apply before enhancements)
+        if done < 0:
+            checkpoint(0.1, 'Noise reduction ...')
+            stages.run('median', median, src, dst, 3)
+            src, dst = dst, src
+            store(0, src)
+
+        # Step 1: Optional processes for portraits
+        if portrait and done < 1:
+            checkpoint(0.3, 'Smooth More ...')
+            stages.run('smooth', _smooth_more, src, dst)
+
+            checkpoint(0.45, 'Enhance Eyes ...')
+            stages.run('eyes', _enhance_eyes, src)
+            store(1, src)
+
+        # Steps 2-4: Color, then Brightness and Contrast as one LUT
+        if done < 2:
+            checkpoint(0.6, 'Adjusting colour ...')
+            stages.run('tone', _tone, src, color, brightness, contrast, mean)
+            store(2, src)
+
+        # Step 5: Smart Sharpening
+        level = sharpen_level(sharpness)
+        if level:
+            checkpoint(0.8, 'Sharpening ...')
+            stages.run('unsharp', _unsharp_mask, src, dst)
+            if level > 1:
+                # Additional edge enhancement for higher sharpness values
+                stages.run('edge', convolve, src, dst, EDGE_ENHANCE_KERNEL, EDGE_ENHANCE_SCALE)
+                src, dst = dst, src
+
+        result = stages.run('encode', Image.fromarray, src)
+    finally:
+        stages.close()
+
+    return merge_alpha(result, alpha)
+
+
+#------------------------------------------------------------------------------
+# Tiled enhancement
+
+def enhance_halo(sharpness=1.3, portrait=False):
+    """Pixels of context each output pixel of enhance() depends on"""
+    halo = 1  # median 3x3
+    if portrait:
+        halo += len(SMOOTH_MORE_KERNEL) // 2
+    if sharpness > 1.0:
+        halo += gaussian_halo(2)
+        if sharpness > 1.5:
+            halo += len(EDGE_ENHANCE_KERNEL) // 2
+    return halo
+
+
+def image_contrast_mean(img: Image, color=1.2, brightness=1.1, portrait=False, band_rows=256):
+    """
+    The Contrast mean enhance() would measure on img, computed band by band
+    so the whole image is never converted at once.
+    """
+    # The stages before Contrast need this many rows above and below a band
+    halo = 1 + (len(SMOOTH_MORE_KERNEL) // 2 if portrait else 0)
+    matrix = color_matrix(color)
+    hist = np.zeros(256)
+    for top in range(0, img.height, band_rows):
+        bottom = min(top + band_rows, img.height)
+        padded_top = max(0, top - halo)
+        rgb, _ = split_alpha(img.crop((0, padded_top, img.width, min(img.height, bottom + halo))))
+        src = np.array(rgb)
+        dst = np.empty_like(src)
+        cv2.medianBlur(src, 3, dst)
+        src, dst = dst, src
+        if portrait:
+            _smooth_more(src, dst)
+            _enhance_eyes(src)
+        band = src[top - padded_top:bottom - padded_top]
+        cv2.transform(band, matrix, dst=band)
+        hist += luma_histogram(band, brightness)
+    return histogram_mean(hist)
+
+
+def enhance_tiled(img: Image, color=1.2, contrast=1.1, brightness=1.1, sharpness=1.3, portrait=False,
+                  tile_size=TILE_SIZE, workers=1) -> Image:
+    """enhance() tile by tile, for images too large to process in one piece"""
+    checkpoint(0.05, 'Measuring contrast ...')
+    mean = image_contrast_mean(img, color, brightness, portrait)
+    func = functools.partial(
+        enhance,
+        color=color,
+        contrast=contrast,
+        brightness=brightness,
+        sharpness=sharpness,
+        portrait=portrait,
+        mean=mean
+    )
+    return process_tiled(img, func, enhance_halo(sharpness, portrait), tile_size, workers)
+
+
+#------------------------------------------------------------------------------
+# Stages. `src` holds the current image; `dst` is scratch space.
+
+def _smooth_more(src, dst):
+    """60% SMOOTH_MORE, 40% original, written back into src"""
+    convolve(src, dst, SMOOTH_MORE_KERNEL, SMOOTH_MORE_SCALE)
+
+    def band(top, bottom):
+        blend_into(src[top:bottom], dst[top:bottom], 0.6)
+    run_chunks(band, src.shape[0])
+
+
+def _enhance_eyes(src):
+    """Eye enhancement blended at 25%, in place"""
+    lightness_contrast(src, 1.2, amount=0.25)
+
+
+def _tone(src, color, brightness, contrast, mean=None):
+    """Color as an in-place matrix pass, then Brightness and Contrast as one LUT pass"""
+    cv2.transform(src, color_matrix(color), dst=src)
+    if mean is None:
+        mean = contrast_mean(src, brightness)
+    cv2.LUT(src, tone_lut(brightness, contrast, mean), dst=src)
+
+
+def _unsharp_mask(src, dst, radius=2, percent=150, threshold=3):
+    """UnsharpMask(radius=2, percent=150, threshold=3), written back into src"""
+    gaussian_blur(src, dst, radius)
+    # Same integer arithmetic as PIL: pixels differing from the blur by more
+    # than the threshold move away from it by diff * percent / 100 (truncated).
+    # Work in row chunks so the int32 temporaries stay small.
+    def band(top, bottom):
+        s = src[top:bottom]
+        diff = s.astype(np.int32)
+        diff -= dst[top:bottom]
+        step = np.abs(diff) * percent // 100
+        step *= np.sign(diff)
+        step[np.abs(diff) <= threshold] = 0
+        step += s
+        np.clip(step, 0, 255, out=step)
+        s[...] = step
+    run_chunks(band, src.shape[0])
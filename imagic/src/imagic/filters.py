@@ -0,0 +1,221 @@
+##=============================================================================
+# Artistic filters
+#
+# Each filter runs on the whole image at once: colour filters are 3x3
+# matrices applied with NumPy, tone filters are 256-entry lookup tables and
+# the neighbourhood filters use PIL's kernels, run in parallel bands with
+# OpenCV (see imagic.kernels). Nothing here depends on Toga,
+# so the filters can be used headless (batch jobs, server, benchmarks).
+##=============================================================================
+import cv2
+import numpy as np
+from PIL import Image, ImageFilter
+
+from imagic.kernels import gaussian_blur, kernel_filter, pil_kernel
+from imagic.tiling import gaussian_halo
+
+FILTERS = ['Grayscale', 'Sepia', 'Blur', 'Emboss', 'Edge Enhance', 'Posterize', 'Negative']
+
+# ITU-R 601-2 luma, the same weights PIL uses for convert('L')
+GRAYSCALE_MATRIX = np.array([
+    [0.299, 0.587, 0.114],
+    [0.299, 0.587, 0.114],
+    [0.299, 0.587, 0.114],
+], dtype=np.float32)
+
+SEPIA_MATRIX = np.array([
+    [0.393, 0.769, 0.189],
+    [0.349, 0.686, 0.168],
+    [0.272, 0.534, 0.131],
+], dtype=np.float32)
+
+# Number of pixels converted to float32 at a time by color_matrix, so the
+# temporary buffers stay small regardless of the image size
+CHUNK_PIXELS = 1 << 20
+
+# Premultiplied alpha modes and their straight alpha equivalents
+PREMULTIPLIED_MODES = {'La': 'LA', 'RGBa': 'RGBA'}
+
+
+def split_alpha(img: Image.Image):
+    """
+    Normalise an image of any PIL mode to RGB.
+    Returns (rgb_image, alpha_band) where alpha_band is None for opaque modes.
+    """
+    if img.mode == 'RGB':
+        return img, None
+    if img.mode in PREMULTIPLIED_MODES:
+        # Pillow only converts the premultiplied modes to their straight form
+        img = img.convert(PREMULTIPLIED_MODES[img.mode])
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        img = img.convert('RGBA')
+        return img.convert('RGB'), img.getchannel('A')
+    return img.convert('RGB'), None
+
+
+def merge_alpha(rgb: Image.Image, alpha) -> Image.Image:
+    """Re-attach an alpha band removed by split_alpha"""
+    if alpha is None:
+        return rgb
+    rgba = rgb.convert('RGBA')
+    rgba.putalpha(alpha)
+    return rgba
+
+
+def blend_matrix(matrix, intensity: float) -> np.ndarray:
+    """Fold an intensity blend with the original into a colour matrix"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return intensity * matrix + (1.0 - intensity) * np.eye(3, dtype=np.float32)
+
+
+def blend_lut(table, intensity: float) -> np.ndarray:
+    """Fold an intensity blend with the original into a 256-entry LUT"""
+    identity = np.arange(256, dtype=np.float32)
+    blended = identity + intensity * (np.asarray(table, dtype=np.float32) - identity)
+    return np.clip(np.rint(blended), 0, 255).astype(np.uint8)
+
+
+def color_matrix(rgb: Image.Image, matrix, offset=0.0) -> Image.Image:
+    """
+    Apply a 3x3 colour matrix (out = matrix @ pixel + offset) to an RGB image.
+    The work is done in row chunks so only CHUNK_PIXELS are held as float32.
+    """
+    src = np.asarray(rgb)
+    out = np.empty_like(src)
+    m = np.asarray(matrix, dtype=np.float32).T
+    offset = np.asarray(offset, dtype=np.float32) + 0.5  # round, not truncate
+    rows = max(1, CHUNK_PIXELS // max(1, src.shape[1]))
+    for top in range(0, src.shape[0], rows):
+        chunk = src[top:top + rows].astype(np.float32) @ m
+        chunk += offset
+        np.clip(chunk, 0, 255, out=chunk)
+        out[top:top + rows] = chunk
+    return Image.fromarray(out)
+
+
+def neighbourhood_filter(rgb: Image.Image, func, *args) -> Image.Image:
+    """Run a kernels function (src, dst, ...) on an RGB image"""
+    src = np.asarray(rgb)
+    dst = np.empty_like(src)
+    func(src, dst, *args)
+    return Image.fromarray(dst)
+
+
+def apply_lut(rgb: Image.Image, table) -> Image.Image:
+    """Apply the same 256-entry LUT to every band of an RGB image"""
+    return rgb.point(np.asarray(table, dtype=np.uint8).tolist() * 3)
+
+
+def negative_lut() -> np.ndarray:
+    return 255 - np.arange(256, dtype=np.uint8)
+
+
+def posterize_lut(bits: int) -> np.ndarray:
+    """Keep only the top `bits` bits of each value, like ImageOps.posterize"""
+    bits = min(8, max(1, bits))
+    mask = ~(2 ** (8 - bits) - 1) & 0xFF
+    return np.arange(256, dtype=np.uint8) & mask
+
+
+#------------------------------------------------------------------------------
+# Point transforms, for fusing consecutive filters into one pass
+
+def point_transform(filter_type: str, intensity: float = 1.0):
+    """
+    A per-pixel filter as ('matrix', 3x3 matrix) or ('lut', 256-entry table),
+    or None for filters that look at neighbouring pixels.
+    """
+    if filter_type == 'Grayscale':
+        return 'matrix', blend_matrix(GRAYSCALE_MATRIX, intensity)
+    if filter_type == 'Sepia':
+        return 'matrix', blend_matrix(SEPIA_MATRIX, intensity)
+    if filter_type == 'Posterize':
+        return 'lut', posterize_lut(int(8 - (intensity * 3)))
+    if filter_type == 'Negative':
+        return 'lut', blend_lut(negative_lut(), intensity)
+    return None
+
+
+def fuse_transforms(transforms) -> list:
+    """Compose runs of lookup tables into one; matrices are kept as they are"""
+    fused = []
+    for kind, value in transforms:
+        if kind == 'lut' and fused and fused[-1][0] == 'lut':
+            fused[-1] = ('lut', np.asarray(value, dtype=np.uint8)[fused[-1][1]])
+        else:
+            fused.append((kind, value))
+    return fused
+
+
+def apply_transforms(img: Image.Image, transforms) -> Image.Image:
+    """
+    Apply point transforms in order in a single pass over the image, row
+    chunk by row chunk, rounding and clipping after each one exactly as
+    applying them as separate filters would.
+    """
+    rgb, alpha = split_alpha(img)
+    src = np.asarray(rgb)
+    out = np.empty_like(src)
+    transforms = fuse_transforms(transforms)
+    rows = max(1, CHUNK_PIXELS // max(1, src.shape[1]))
+    for top in range(0, src.shape[0], rows):
+        chunk = src[top:top + rows]
+        for kind, value in transforms:
+            if kind == 'matrix':
+                values = chunk.astype(np.float32) @ np.asarray(value, dtype=np.float32).T
+                values += 0.5
+                np.clip(values, 0, 255, out=values)
+                chunk = values.astype(np.uint8)
+            else:
+                chunk = cv2.LUT(chunk, np.asarray(value, dtype=np.uint8))
+        out[top:top + rows] = chunk
+    return merge_alpha(Image.fromarray(out), alpha)
+
+
+def apply_filter(img: Image.Image, filter_type: str, intensity: float = 1.0) -> Image.Image:
+    """
+    Apply an artistic filter to an image of any mode.
+
+    For Grayscale, Sepia, Emboss, Edge Enhance and Negative, `intensity` blends
+    the filtered result with the original (0 = original, 1 = full filter,
+    above 1 exaggerates). For Blur it scales the radius and for Posterize it
+    sets how many bits are removed, as before.
+    Alpha is preserved; the result is RGB or RGBA.
+    """
+    rgb, alpha = split_alpha(img)
+
+    if filter_type == 'Grayscale':
+        result = color_matrix(rgb, blend_matrix(GRAYSCALE_MATRIX, intensity))
+
+    elif filter_type == 'Sepia':
+        result = color_matrix(rgb, blend_matrix(SEPIA_MATRIX, intensity))
+
+    elif filter_type == 'Blur':
+        result = neighbourhood_filter(rgb, gaussian_blur, intensity * 2)
+
+    elif filter_type == 'Emboss':
+        result = Image.blend(rgb, neighbourhood_filter(rgb, kernel_filter, *pil_kernel(ImageFilter.EMBOSS)), intensity)
+
+    elif filter_type == 'Edge Enhance':
+        edges = neighbourhood_filter(rgb, kernel_filter, *pil_kernel(ImageFilter.EDGE_ENHANCE_MORE))
+        result = Image.blend(rgb, edges, intensity)
+
+    elif filter_type == 'Posterize':
+        result = apply_lut(rgb, posterize_lut(int(8 - (intensity * 3))))
+
+    elif filter_type == 'Negative':
+        result = apply_lut(rgb, blend_lut(negative_lut(), intensity))
+
+    else:
+        raise ValueError(f'Unknown filter: {filter_type}')
+
+    return merge_alpha(result, alpha)
+
+
+def filter_halo(filter_type: str, intensity: float = 1.0) -> int:
+    """Pixels of context each output pixel of apply_filter() depends on"""
+    if filter_type == 'Blur':
+        return gaussian_halo(intensity * 2)
+    if filter_type in ('Emboss', 'Edge Enhance'):
+        return 1  # 3x3 kernels
+    return 0
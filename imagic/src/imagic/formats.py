@@ -0,0 +1,27 @@
+##=============================================================================
+# Image file types
+#
+# Kept free of heavy imports so the GUI can validate files at startup.
+##=============================================================================
+import os
+
+# File types accepted by the app and the batch runner
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+# Formats results can be saved in, by file extension
+SAVE_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG', '.webp': 'WEBP', '.gif': 'GIF'}
+
+# Encoder defaults: JPEG/WebP quality and PNG compression level
+DEFAULT_QUALITY = 90
+DEFAULT_COMPRESS_LEVEL = 3
+
+# File extension used for each save format
+FORMAT_EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp', 'GIF': '.gif'}
+
+# Save formats that can store an animation (PNG as APNG)
+ANIMATED_FORMATS = ('GIF', 'PNG', 'WEBP')
+
+
+def save_format(path, default='PNG'):
+    """The save format for a file name, from its extension"""
+    return SAVE_FORMATS.get(os.path.splitext(str(path))[1].lower(), default)
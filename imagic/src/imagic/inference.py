@@ -0,0 +1,193 @@
+##=============================================================================
+# Batched segmentation
+#
+# rembg runs one image per ONNX call. For bulk jobs the masks are instead
+# computed here: each image is preprocessed the way rembg does it, several
+# are stacked into one NCHW tensor and run together, and the masks are split
+# back out. An InferenceBatcher collects requests from several threads and
+# flushes a batch when it is full or when the oldest request has waited
+# max_wait seconds, so interactive latency stays bounded.
+#
+# Batching only pays off with concurrent callers, so it is off unless
+# enable_batching() is called: the HTTP service and the threaded batch mode
+# (--batch-size) turn it on. Otherwise each request runs its own session
+# directly and never waits for a batch to fill.
+#
+#   IMAGIC_BATCH_SIZE      largest batch (default 4)
+#   IMAGIC_BATCH_WAIT_MS   longest wait for a batch to fill (default 20)
+##=============================================================================
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+from imagic.sessions import MODELS, get_pool
+
+DEFAULT_BATCH_SIZE = 4
+DEFAULT_BATCH_WAIT_MS = 20
+
+# rembg model name -> (mean, std, input size) used by its session's normalize()
+PREPROCESS = {
+    'u2net': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'u2netp': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'silueta': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'isnet-general-use': ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+
+def supports_batching(name):
+    return MODELS.get(name, name) in PREPROCESS
+
+
+def preprocess(img: Image.Image, model) -> np.ndarray:
+    """CHW float32 network input for one image, as rembg's normalize() builds it"""
+    mean, std, size = PREPROCESS[model]
+    arr = np.asarray(img.convert('RGB').resize(size, Image.Resampling.LANCZOS), dtype=np.float32)
+    arr /= max(arr.max(), 1e-6)
+    arr -= np.array(mean, dtype=np.float32)
+    arr /= np.array(std, dtype=np.float32)
+    return arr.transpose(2, 0, 1)
+
+
+def postprocess(pred: np.ndarray, size) -> Image.Image:
+    """Scale one prediction to 0..255 and resize it to the image size"""
+    lo, hi = pred.min(), pred.max()
+    pred = (pred - lo) / max(hi - lo, 1e-6)
+    mask = Image.fromarray((pred.clip(0, 1) * 255).astype(np.uint8), 'L')
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+def has_dynamic_batch(session):
+    """True if the model's input accepts more than one image per run"""
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int) or batch_dim != 1
+
+
+def predict_batch(session, images, model) -> list:
+    """Masks for several images, in one ONNX run when the model allows it"""
+    model = MODELS.get(model, model)
+    inner = session.inner_session
+    input_name = inner.get_inputs()[0].name
+    tensor = np.stack([preprocess(img, model) for img in images])
+
+    if has_dynamic_batch(session):
+        preds = inner.run(None, {input_name: tensor})[0][:, 0]
+    else:
+        # Exported with a fixed batch of 1: still saves the queueing and
+        # preprocessing, one run per image
+        preds = [inner.run(None, {input_name: tensor[i:i + 1]})[0][0, 0] for i in range(len(images))]
+
+    return [postprocess(pred, img.size) for pred, img in zip(preds, images)]
+
+
+class InferenceBatcher:
+    """Collects mask requests for one model and runs them in batches"""
+
+    def __init__(self, model, max_batch=None, max_wait=None, pool=None):
+        self.model = model
+        self.max_batch = max_batch or int(os.environ.get('IMAGIC_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+        if max_wait is None:
+            max_wait = float(os.environ.get('IMAGIC_BATCH_WAIT_MS', DEFAULT_BATCH_WAIT_MS)) / 1000
+        self.max_wait = max_wait
+        self.pool = pool or get_pool()
+        self.batches = 0
+        self.images = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f'imagic-batch-{model}', daemon=True)
+        self._thread.start()
+
+    def submit(self, img: Image.Image) -> Future:
+        future = Future()
+        self._queue.put((img, future))
+        return future
+
+    def predict(self, img: Image.Image) -> Image.Image:
+        """The mask for one image, computed in a batch with concurrent requests"""
+        return self.submit(img).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        """Block for one request, then take more until the batch is full or the wait is over"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [(img, future) for img, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                session = self.pool.get(self.model)
+                masks = predict_batch(session, [img for img, _ in batch], self.model)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(batch)
+            for (_, future), mask in zip(batch, masks):
+                future.set_result(mask)
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+_batch_size = None
+
+
+def enable_batching(max_batch=None):
+    """
+    Send masks of the models that support it through process-wide batchers
+    of up to max_batch images (default: IMAGIC_BATCH_SIZE)
+    """
+    global _batch_size
+    with _batchers_lock:
+        _batch_size = max_batch or int(os.environ.get('IMAGIC_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+        for batcher in _batchers.values():
+            batcher.max_batch = _batch_size
+
+
+def disable_batching():
+    global _batch_size
+    with _batchers_lock:
+        _batch_size = None
+
+
+def get_batcher(model):
+    """
+    The process-wide batcher for a model, or None when batching is not
+    enabled or the model does not support it
+    """
+    if _batch_size is None or not supports_batching(model):
+        return None
+    with _batchers_lock:
+        batcher = _batchers.get(model)
+        if batcher is None:
+            batcher = _batchers[model] = InferenceBatcher(model, max_batch=_batch_size)
+        return batcher
@@ -0,0 +1,217 @@
+##=============================================================================
+# Instrumentation
+#
+# Named spans around the processing steps (decode, each enhance stage,
+# filters, segmentation, encode, display) recording duration, allocated
+# and peak traced memory, and the image size. Spans are written as JSON
+# lines and can be collected per job for the breakdown shown in the GUI.
+#
+#   IMAGIC_TRACE=1           enable spans, written to stderr
+#   IMAGIC_TRACE_FILE=PATH   append the JSON lines to a file instead
+#   IMAGIC_TRACE_MEMORY=0    skip memory tracking (tracemalloc) when tracing
+#
+# When tracing is off, span() returns a shared do-nothing context manager,
+# so instrumented code pays for one function call per span.
+#
+# Memory figures come from tracemalloc, which sees NumPy and Python
+# allocations but not buffers allocated inside OpenCV or Pillow, and is
+# process-wide: spans running concurrently in other threads add to them.
+##=============================================================================
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.environ.get('IMAGIC_TRACE', '0') not in ('', '0')
+TRACE_MEMORY = os.environ.get('IMAGIC_TRACE_MEMORY', '1') != '0'
+
+_NULL = nullcontext()
+_local = threading.local()
+_write_lock = threading.Lock()
+_trace_file = None
+
+
+def enabled():
+    return ENABLED
+
+
+def enable(memory=True):
+    """Turn tracing on from code (e.g. a settings toggle)"""
+    global ENABLED, TRACE_MEMORY
+    ENABLED = True
+    TRACE_MEMORY = memory
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+class Span:
+    """One timed step; seconds and memory are filled in when it ends"""
+
+    __slots__ = ('name', 'fields', 'depth', 'ts', 'seconds', 'alloc_bytes', 'peak_bytes', 'child_peak')
+
+    def __init__(self, name, fields, depth):
+        self.name = name
+        self.fields = fields
+        self.depth = depth
+        self.ts = time.time()
+        self.seconds = 0.0
+        self.alloc_bytes = None
+        self.peak_bytes = None
+        self.child_peak = 0
+
+    def as_dict(self):
+        entry = dict(span=self.name, ts=round(self.ts, 6), ms=round(self.seconds * 1000, 3), depth=self.depth)
+        if self.alloc_bytes is not None:
+            entry.update(alloc_bytes=self.alloc_bytes, peak_bytes=self.peak_bytes)
+        entry.update(self.fields)
+        return entry
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def _measure(name, fields, memory):
+    stack = _stack()
+    current = Span(name, fields, len(stack))
+    parent = stack[-1] if stack else None
+    stack.append(current)
+
+    if memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # reset_peak() is global: remember what the enclosing span has seen
+        if parent is not None:
+            parent.child_peak = max(parent.child_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - start
+        if memory:
+            now, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, current.child_peak)
+            current.alloc_bytes = now - base
+            current.peak_bytes = max(0, peak - base)
+            if parent is not None:
+                parent.child_peak = max(parent.child_peak, peak)
+        stack.pop()
+        if ENABLED:
+            _emit(current)
+
+
+def span(name, img=None, force=False, **fields):
+    """
+    Context manager timing a named step. `img` (a PIL image or array)
+    records the image size; other keyword arguments are logged as is.
+    With force=True the span is measured even when tracing is off (it is
+    only logged when tracing is on).
+    """
+    if not (ENABLED or force):
+        return _NULL
+    if img is not None:
+        size = getattr(img, 'size', None)
+        if not isinstance(size, tuple):
+            # NumPy array: (height, width, ...)
+            size = (img.shape[1], img.shape[0])
+        fields['width'], fields['height'] = size
+    return _measure(name, fields, TRACE_MEMORY or force)
+
+
+#------------------------------------------------------------------------------
+# Output
+
+def _emit(current):
+    entry = current.as_dict()
+    entry['thread'] = threading.current_thread().name
+    collector = getattr(_local, 'collector', None)
+    if collector is not None:
+        collector.append(entry)
+
+    global _trace_file
+    line = json.dumps(entry, default=str)
+    with _write_lock:
+        path = os.environ.get('IMAGIC_TRACE_FILE')
+        if path:
+            if _trace_file is None or _trace_file.name != path:
+                _trace_file = open(path, 'a', buffering=1)
+            _trace_file.write(line + '\n')
+        else:
+            print(line, file=sys.stderr)
+
+
+def collect_spans(func, *args, **kwargs):
+    """
+    Call func and return (result, spans), where spans are the entries
+    emitted by this thread while it ran, in the order they ended.
+    """
+    previous = getattr(_local, 'collector', None)
+    _local.collector = spans = []
+    try:
+        return func(*args, **kwargs), spans
+    finally:
+        _local.collector = previous
+
+
+def format_spans(spans, max_depth=1):
+    """One line per span, indented by nesting, in the order they started"""
+    lines = []
+    for entry in sorted(spans, key=lambda entry: (entry['ts'], entry['depth'])):
+        if entry['depth'] > max_depth:
+            continue
+        line = f'{"  " * entry["depth"]}{entry["span"]}: {entry["ms"]:.0f} ms'
+        if entry.get('peak_bytes') is not None:
+            line += f', {entry["peak_bytes"] / 1e6:.1f} MB'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+#------------------------------------------------------------------------------
+# Stage reports
+
+class Stages:
+    """
+    Runs the stages of an operation in spans. Pass a list as `report` to
+    also get the per-stage wall time and peak traced memory back.
+    """
+
+    def __init__(self, report, prefix=''):
+        self.report = report
+        self.prefix = prefix
+        self._started_tracing = False
+        if report is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def run(self, name, func, *args):
+        if self.report is None and not ENABLED:
+            return func(*args)
+        with span(self.prefix + name, force=self.report is not None) as current:
+            result = func(*args)
+        if self.report is not None:
+            self.report.append(dict(stage=name, seconds=current.seconds, peak_bytes=current.peak_bytes or 0))
+        return result
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+
+
+def format_report(report):
+    """Render a stage report as a small text table"""
+    lines = [f'{"stage":<12} {"ms":>9} {"peak MB":>9}']
+    for entry in report:
+        lines.append(f'{entry["stage"]:<12} {entry["seconds"] * 1000:9.1f} {entry["peak_bytes"] / 1e6:9.1f}')
+    return '\n'.join(lines)
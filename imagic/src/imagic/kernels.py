@@ -0,0 +1,161 @@
+##=============================================================================
+# Parallel neighbourhood filters
+#
+# OpenCV versions of PIL's neighbourhood filters (median, 3x3 and 5x5
+# kernels, Gaussian blur) that use every core. The image is split into
+# horizontal bands of CHUNK_ROWS rows; each band is filtered together with
+# the rows its kernel reaches above and below (the halo), and only its own
+# rows are stored, so the bands join without seams. Bands run on a shared
+# thread pool: OpenCV and NumPy release the GIL while they work.
+#
+# Kernels use integer taps and int16 sums, so every pixel is computed
+# exactly the same way whatever the band boundaries, number of threads or
+# tiles.
+#
+#   IMAGIC_FILTER_THREADS   threads filtering bands (default: CPU count)
+##=============================================================================
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Rows per band (columns for vertical kernels); also bounds the temporaries
+CHUNK_ROWS = 128
+
+# Fixed-point unit for the blur's fractional box taps, so that 255 * FIXED_ONE
+# fits in int16
+FIXED_ONE = 1 << 7
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def filter_threads():
+    """Threads used for the bands, from IMAGIC_FILTER_THREADS"""
+    value = os.environ.get('IMAGIC_FILTER_THREADS')
+    return max(1, int(value)) if value else os.cpu_count() or 1
+
+
+def get_executor():
+    """The process-wide thread pool the bands run on"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=filter_threads(), thread_name_prefix='imagic-band')
+        return _executor
+
+
+def run_chunks(func, length, size=CHUNK_ROWS):
+    """
+    Call func(start, stop) for consecutive chunks of range(length), in
+    parallel when there is more than one chunk and more than one thread.
+    The chunks must write disjoint outputs. Returns when all are done.
+    """
+    starts = range(0, length, size)
+    # Inline when called from a band itself, so bands never wait on bands,
+    # and in animation frames, which already run one per core
+    nested = threading.current_thread().name.startswith(('imagic-band', 'imagic-frame'))
+    if len(starts) == 1 or nested or filter_threads() == 1:
+        for start in starts:
+            func(start, min(start + size, length))
+        return
+    futures = [get_executor().submit(func, start, min(start + size, length)) for start in starts]
+    for future in futures:
+        # Raises the first error, after the remaining chunks have finished
+        future.result()
+
+
+def pil_kernel(filter):
+    """
+    A PIL ImageFilter.Kernel (e.g. ImageFilter.EMBOSS) as (taps, scale,
+    offset) for convolve(). PIL applies the rows of its kernels bottom up.
+    """
+    size, scale, offset, taps = filter.filterargs
+    kernel = np.array(taps, dtype=np.float32).reshape(size[1], size[0])[::-1].copy()
+    return kernel, 1 / scale, offset
+
+
+def convolve(src, dst, kernel, scale=1.0, offset=0):
+    """
+    dst = round(scale * (src correlated with integer taps) + offset),
+    saturated to uint8, with replicated borders. One-dimensional vertical
+    kernels may run in place (dst is src).
+    """
+    height, width = src.shape[:2]
+    delta = offset / scale
+
+    if kernel.shape[1] == 1:
+        # Vertical kernel: columns are independent
+        def column_band(left, right):
+            acc = cv2.filter2D(src[:, left:right], cv2.CV_16S, kernel, delta=delta, borderType=cv2.BORDER_REPLICATE)
+            _store(acc, dst[:, left:right], scale)
+        run_chunks(column_band, width)
+        return
+
+    margin = kernel.shape[0] // 2
+
+    def row_band(top, bottom):
+        lo, hi = max(0, top - margin), min(height, bottom + margin)
+        acc = cv2.filter2D(src[lo:hi], cv2.CV_16S, kernel, delta=delta, borderType=cv2.BORDER_REPLICATE)
+        _store(acc[top - lo:bottom - lo], dst[top:bottom], scale)
+    run_chunks(row_band, height)
+
+
+def _store(acc, out, scale):
+    """Scale, round and saturate filter sums into a uint8 view"""
+    cv2.threshold(acc, 0, 0, cv2.THRESH_TOZERO, dst=acc)
+    out[...] = cv2.convertScaleAbs(acc, alpha=scale)
+
+
+def kernel_filter(src, dst, kernel, scale=1.0, offset=0):
+    """
+    convolve() with PIL's border handling for ImageFilter.Kernel: the
+    outer rows and columns the kernel does not fit in are copied unfiltered.
+    """
+    convolve(src, dst, kernel, scale, offset)
+    margin_y, margin_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+    if margin_y:
+        dst[:margin_y] = src[:margin_y]
+        dst[-margin_y:] = src[-margin_y:]
+    if margin_x:
+        dst[:, :margin_x] = src[:, :margin_x]
+        dst[:, -margin_x:] = src[:, -margin_x:]
+
+
+def median(src, dst, size=3):
+    """PIL's MedianFilter(size) into dst (replicated borders)"""
+    height = src.shape[0]
+    margin = size // 2
+
+    def band(top, bottom):
+        lo, hi = max(0, top - margin), min(height, bottom + margin)
+        dst[top:bottom] = cv2.medianBlur(src[lo:hi], size)[top - lo:bottom - lo]
+    run_chunks(band, height)
+
+
+def box_kernel(radius, passes=3):
+    """
+    The extended box kernel PIL uses for GaussianBlur(radius): `passes` of
+    it give the variance of a Gaussian, with fractional end taps.
+    """
+    sigma2 = radius * radius / passes
+    size = int((np.sqrt(12 * sigma2 + 1) - 1) / 2)
+    edge = (2 * size + 1) * (size * (size + 1) - 3 * sigma2) / (6 * (sigma2 - (size + 1) ** 2))
+    box = np.ones(2 * size + 3, dtype=np.float32)
+    box[0] = box[-1] = edge
+    return box / box.sum()
+
+
+def gaussian_blur(src, dst, radius, passes=3):
+    """
+    PIL's GaussianBlur(radius) into dst: repeated box blurs, horizontal then
+    vertical, rounded to uint8 after each pass like PIL does.
+    """
+    box = np.rint(box_kernel(radius, passes) * FIXED_ONE)
+    box[len(box) // 2] += FIXED_ONE - box.sum()
+    np.copyto(dst, src)
+    for kernel in (box[np.newaxis, :], box[:, np.newaxis]):
+        for _ in range(passes):
+            convolve(dst, dst, kernel, 1 / FIXED_ONE)
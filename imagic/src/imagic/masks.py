@@ -0,0 +1,293 @@
+##=============================================================================
+# Background masks
+#
+# Background removal runs in two steps. The segmentation network turns the
+# input into an alpha mask, which is cached per input image and model (and
+# per alpha matting settings for matted cutouts). The output is then
+# composited from the mask with Pillow's vectorised C operations (putalpha,
+# alpha_composite), so changing the fill colour or switching between
+# transparent and filled output takes a fraction of a second instead of
+# another inference.
+#
+# In fast mode the network sees a copy decoded at reduced size (JPEG DCT
+# scaling) and the mask is brought back to full resolution with a guided
+# filter that follows the edges of the original.
+#
+# Edge refinement is a cheap alternative to full alpha matting: a trimap
+# (certain foreground, certain background, uncertain band) is cut from the
+# mask with erode, and only the band is re-estimated, with a colour guided
+# filter fitted at reduced scale and applied at full resolution.
+##=============================================================================
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from imagic.thumbnails import image_bytes, make_thumbnail
+
+# Memory cap for cached masks and matted cutouts
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# Rows upsampled at a time, bounding the float temporaries
+CHUNK_ROWS = 256
+
+# Long edge of the image given to the network in fast mode. The models
+# resize to 320 px (u2net) or 1024 px (isnet) internally.
+INFERENCE_SIZE = 1024
+
+# Long edge of the uncertain band's bounding box when the edge refinement
+# fits its guided filter; larger bands are fitted at reduced scale
+REFINE_SIZE = 1024
+
+
+def image_digest(img: Image.Image):
+    """Hash of an image's mode, size and pixels"""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f'{img.mode} {img.size}'.encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+class MaskCache:
+    """LRU of masks and matted cutouts, bounded by memory"""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute) -> Image.Image:
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return img
+            self.misses += 1
+
+        img = compute()
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = img
+                self.current_bytes += image_bytes(img)
+                # Always keep the newest entry, even if it alone exceeds the cap
+                while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                    _, old = self._entries.popitem(last=False)
+                    self.current_bytes -= image_bytes(old)
+        return img
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = MaskCache()
+
+
+def get_mask_cache() -> MaskCache:
+    return _cache
+
+
+#------------------------------------------------------------------------------
+# Compositing
+
+def cutout(img: Image.Image, mask: Image.Image) -> Image.Image:
+    """RGBA copy of img with the mask as alpha (combined with any existing alpha)"""
+    rgba = img.convert('RGBA')
+    mask = mask.convert('L')
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        # Multiply the two alphas, rounded (ImageChops.multiply is off by
+        # one for about half of the pairs)
+        product = np.asarray(rgba.getchannel('A'), dtype=np.uint16) * np.asarray(mask) + 127
+        mask = Image.fromarray((product // 255).astype(np.uint8), 'L')
+    rgba.putalpha(mask)
+    return rgba
+
+
+def fill_background(rgba: Image.Image, bgcolor) -> Image.Image:
+    """Composite an RGBA image over a solid RGBA colour ("over")"""
+    return Image.alpha_composite(Image.new('RGBA', rgba.size, tuple(bgcolor)), rgba)
+
+
+def composite(img: Image.Image, mask: Image.Image, bgcolor=None) -> Image.Image:
+    """Cut img out with the mask, on transparency or on a solid colour"""
+    rgba = cutout(img, mask)
+    if bgcolor is not None:
+        rgba = fill_background(rgba, bgcolor)
+    return rgba
+
+
+#------------------------------------------------------------------------------
+# Segmentation
+
+def compute_mask(img: Image.Image, session) -> Image.Image:
+    """Run the segmentation network and return the alpha mask ('L')"""
+    from rembg import remove
+    return remove(img, session=session, only_mask=True).convert('L')
+
+
+def matting_cutout(img: Image.Image, mask: Image.Image, fg_threshold=240, bg_threshold=10, erode_size=10) -> Image.Image:
+    """Refine the mask with alpha matting; returns an RGBA cutout"""
+    from rembg.bg import alpha_matting_cutout
+    return alpha_matting_cutout(img, mask, fg_threshold, bg_threshold, erode_size)
+
+
+#------------------------------------------------------------------------------
+# Fast mode
+
+def reduced_image(img: Image.Image, max_size=INFERENCE_SIZE) -> Image.Image:
+    """
+    A copy of img whose long edge is at most max_size. Images opened from a
+    file are decoded again at reduced size instead of shrinking the full
+    decode.
+    """
+    filename = getattr(img, 'filename', None)
+    if filename:
+        try:
+            with Image.open(filename) as source:
+                if source.size == img.size:
+                    return make_thumbnail(source, max_size)
+        except OSError:
+            pass
+    return make_thumbnail(img, max_size)
+
+
+def _box(arr, radius):
+    return cv2.boxFilter(arr, -1, (2 * radius + 1, 2 * radius + 1), borderType=cv2.BORDER_REFLECT)
+
+
+def _gray(img: Image.Image) -> np.ndarray:
+    return np.asarray(img.convert('L'), dtype=np.float32) / 255
+
+
+def _upsample_rows(coeff, height, top, bottom):
+    """Rows top..bottom of coeff bilinearly resized to `height` rows"""
+    y = (np.arange(top, bottom, dtype=np.float32) + 0.5) * coeff.shape[0] / height - 0.5
+    y = np.clip(y, 0, coeff.shape[0] - 1)
+    y0 = y.astype(np.int32)
+    y1 = np.minimum(y0 + 1, coeff.shape[0] - 1)
+    weight = (y - y0)[:, np.newaxis]
+    return coeff[y0] * (1 - weight) + coeff[y1] * weight
+
+
+def guided_upsample(mask: Image.Image, guide: Image.Image, full: Image.Image, radius=4, eps=1e-3) -> Image.Image:
+    """
+    Bring a low resolution mask up to the size of `full` with a fast guided
+    filter (He & Sun): the linear coefficients are fitted against the low
+    resolution guide, upsampled, and applied to the full resolution luma,
+    so mask edges snap to edges in the original.
+    """
+    p = np.asarray(mask.convert('L').resize(guide.size), dtype=np.float32) / 255
+    guide_luma = _gray(guide)
+    mean_i = _box(guide_luma, radius)
+    mean_p = _box(p, radius)
+    var_i = _box(guide_luma * guide_luma, radius) - mean_i * mean_i
+    cov_ip = _box(guide_luma * p, radius) - mean_i * mean_p
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    # Resize across first; rows are interpolated band by band below
+    width, height = full.size
+    a = cv2.resize(_box(a, radius), (width, a.shape[0]), interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(_box(b, radius), (width, b.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+    out = np.empty((height, width), dtype=np.uint8)
+    for top in range(0, height, CHUNK_ROWS):
+        bottom = min(top + CHUNK_ROWS, height)
+        luma = _gray(full.crop((0, top, width, bottom)))
+        q = _upsample_rows(a, height, top, bottom) * luma + _upsample_rows(b, height, top, bottom)
+        out[top:bottom] = np.clip(q * 255 + 0.5, 0, 255)
+    return Image.fromarray(out, 'L')
+
+
+#------------------------------------------------------------------------------
+# Edge refinement
+
+def trimap(mask: np.ndarray, fg_threshold=240, bg_threshold=10, erode_size=10):
+    """(foreground, background) boolean arrays: the certain parts of a mask, eroded"""
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * erode_size + 1, 2 * erode_size + 1))
+    fg = cv2.erode((mask >= fg_threshold).astype(np.uint8), kernel)
+    bg = cv2.erode((mask <= bg_threshold).astype(np.uint8), kernel)
+    return fg.astype(bool), bg.astype(bool)
+
+
+def _color_guided_filter(guide, p, radius, eps):
+    """Coefficients (a, b) of a guided filter with an RGB guide (He et al.), smoothed"""
+    mean_i = _box(guide, radius)
+    mean_p = _box(p, radius)
+    cov = _box(guide * p[..., np.newaxis], radius) - mean_i * mean_p[..., np.newaxis]
+    sigma = np.empty(guide.shape[:2] + (3, 3), dtype=np.float32)
+    for i in range(3):
+        for j in range(i, 3):
+            sigma[..., i, j] = sigma[..., j, i] = (
+                _box(guide[..., i] * guide[..., j], radius) - mean_i[..., i] * mean_i[..., j]
+            )
+    sigma += eps * np.eye(3, dtype=np.float32)
+    a = np.linalg.solve(sigma, cov[..., np.newaxis])[..., 0]
+    b = mean_p - np.einsum('...c,...c->...', a, mean_i)
+    return _box(a, radius), _box(b, radius)
+
+
+def refine_mask(img: Image.Image, mask: Image.Image, fg_threshold=240, bg_threshold=10, erode_size=10,
+                radius=None, eps=1e-3) -> Image.Image:
+    """
+    Re-estimate the mask in its uncertain band so that soft edges (hair,
+    fur, motion blur) follow the image. Pixels the trimap marks as certain
+    keep their mask value; only the bounding box of the band is read, and
+    the filter is fitted at reduced scale when that box is large.
+
+    The filter window should span the blur of the mask's edges: by default
+    two mask pixels of a 320 px segmentation (u2net) scaled to the image.
+    """
+    if radius is None:
+        radius = max(8, max(img.size) // 160)
+    m = np.asarray(mask.convert('L'))
+    fg, bg = trimap(m, fg_threshold, bg_threshold, erode_size)
+    unknown = ~(fg | bg)
+    if not unknown.any():
+        return mask
+
+    # The band's bounding box, with room for the filter window
+    x, y, w, h = cv2.boundingRect(unknown.astype(np.uint8))
+    scale = max(1, -(-max(w, h) // REFINE_SIZE))
+    margin = 2 * radius * scale
+    left, top = max(0, x - margin), max(0, y - margin)
+    right, bottom = min(m.shape[1], x + w + margin), min(m.shape[0], y + h + margin)
+    width, height = right - left, bottom - top
+
+    rgb = img.crop((left, top, right, bottom)).convert('RGB')
+    # Certain pixels pin the filter to 0 and 1
+    p = m[top:bottom, left:right].astype(np.float32) / 255
+    p[fg[top:bottom, left:right]] = 1
+    p[bg[top:bottom, left:right]] = 0
+
+    small_size = (max(1, width // scale), max(1, height // scale))
+    guide = np.asarray(rgb.resize(small_size, Image.Resampling.BOX), dtype=np.float32) / 255
+    a, b = _color_guided_filter(guide, cv2.resize(p, small_size, interpolation=cv2.INTER_AREA),
+                                max(1, radius // scale), eps)
+    # Resize across first; rows are interpolated band by band below
+    a = cv2.resize(a, (width, a.shape[0]), interpolation=cv2.INTER_LINEAR).reshape(a.shape[0], -1)
+    b = cv2.resize(b, (width, b.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+    out = m.copy()
+    full = np.asarray(rgb)
+    for start in range(0, height, CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, height)
+        band = unknown[top + start:top + stop, left:right]
+        if not band.any():
+            continue
+        a_rows = _upsample_rows(a, height, start, stop).reshape(stop - start, width, 3)[band]
+        b_rows = _upsample_rows(b, height, start, stop)[band]
+        q = np.einsum('nc,nc->n', a_rows, full[start:stop][band].astype(np.float32) / 255) + b_rows
+        out[top + start:top + stop, left:right][band] = np.clip(q * 255 + 0.5, 0, 255)
+    return Image.fromarray(out, 'L')
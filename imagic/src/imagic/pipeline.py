@@ -0,0 +1,269 @@
+##=============================================================================
+# Processing pipelines
+#
+# A recipe is an ordered list of steps, each a registered operation with
+# typed parameters, saved and loaded as JSON:
+#
+#   {"name": "Portrait", "steps": [
+#       {"op": "remove-bg", "params": {"model": "u2net"}},
+#       {"op": "enhance", "params": {"portrait": true}},
+#       {"op": "filter", "params": {"filter": "Sepia", "intensity": 0.5}}]}
+#
+# The executor groups consecutive per-pixel steps (colour matrix and lookup
+# table filters) into one pass over the image. With a result cache it stores
+# the image after each group under the recipe prefix that produced it, so a
+# recipe that starts like an earlier one resumes from the longest cached
+# prefix instead of starting over. Given a stage cache too, steps that are
+# chains of stages (enhance) also resume inside the step, after the last
+# stage whose parameters did not change. The GUI and the batch runner both
+# run their work through here.
+##=============================================================================
+import json
+
+from PIL import Image
+
+from imagic.cache import result_key
+from imagic.enhance import enhance
+from imagic.filters import FILTERS, apply_transforms, point_transform
+from imagic.instrument import span
+from imagic.processing import run_operation
+from imagic.scheduler import checkpoint
+from imagic.sessions import DEFAULT_MODEL, MODELS
+from imagic.sources import open_image
+from imagic.tiling import needs_tiling
+
+
+class Param:
+    """A typed step parameter with a default and optional choices or limits"""
+
+    def __init__(self, name, type, default, choices=None, min=None, max=None):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.choices = choices
+        self.min = min
+        self.max = max
+
+    def coerce(self, value):
+        """Convert a (JSON) value to the parameter's type, checking its range"""
+        if value is None:
+            if self.default is not None:
+                raise ValueError(f'{self.name} must not be empty')
+            return None
+        if self.type == 'color':
+            value = tuple(int(part) for part in value)
+            if len(value) not in (3, 4) or not all(0 <= part <= 255 for part in value):
+                raise ValueError(f'{self.name} must be an RGB or RGBA colour')
+            return value + ((255,) if len(value) == 3 else ())
+        if self.type is bool and not isinstance(value, bool):
+            raise ValueError(f'{self.name} must be true or false')
+        value = self.type(value)
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(f'{self.name} must be one of {", ".join(map(str, self.choices))}')
+        if (self.min is not None and value < self.min) or (self.max is not None and value > self.max):
+            raise ValueError(f'{self.name} must be between {self.min} and {self.max}')
+        return value
+
+
+class StepType:
+    """A registered operation: how to run it and which parameters it takes"""
+
+    def __init__(self, name, params, run, point=None, staged=False):
+        self.name = name
+        self.params = {param.name: param for param in params}
+        self.run = run
+        self.point = point
+        self.staged = staged
+
+    def normalize(self, params):
+        """All parameters, with defaults filled in and values coerced"""
+        unknown = set(params) - set(self.params)
+        if unknown:
+            raise ValueError(f'Unknown parameters for {self.name}: {", ".join(sorted(unknown))}')
+        return {
+            name: param.coerce(params[name]) if name in params else param.default
+            for name, param in self.params.items()
+        }
+
+
+STEPS = {}
+
+
+def register(name, params, run, point=None, staged=False):
+    """
+    Register an operation as a recipe step. run(img, **params) returns the
+    new image; point(**params) may return a filters.point_transform() tuple
+    when the step only maps each pixel's own value, so it can be fused.
+    A staged step's run() also takes stage_cache=, a cache.StageCache.
+    """
+    STEPS[name] = StepType(name, params, run, point, staged)
+
+
+def _operation(op):
+    return lambda img, **params: run_operation(img, op, **params)
+
+
+def _enhance(img, stage_cache=None, **params):
+    if stage_cache is None or needs_tiling(img):
+        return run_operation(img, 'enhance', **params)
+    with span('enhance', img):
+        return enhance(img, stage_cache=stage_cache, **params)
+
+
+register('remove-bg', [
+    Param('bgcolor', 'color', None),
+    Param('model', str, DEFAULT_MODEL, choices=list(MODELS)),
+    Param('alpha_matting', bool, False),
+    Param('fast', bool, False),
+    Param('refine_edges', bool, False),
+], _operation('remove-bg'))
+
+register('enhance', [
+    Param('color', float, 1.2, min=0.0),
+    Param('contrast', float, 1.1, min=0.0),
+    Param('brightness', float, 1.1, min=0.0),
+    Param('sharpness', float, 1.3, min=0.0),
+    Param('portrait', bool, False),
+], _enhance, staged=True)
+
+register('filter', [
+    Param('filter', str, 'Grayscale', choices=FILTERS),
+    Param('intensity', float, 1.0, min=0.0),
+], _operation('filter'), point=lambda filter, intensity: point_transform(filter, intensity))
+
+
+#------------------------------------------------------------------------------
+# Recipes
+
+class Recipe:
+    """A named list of steps, each dict(op=..., params={...}) with all parameters filled in"""
+
+    def __init__(self, steps=(), name=''):
+        self.name = name
+        self.steps = []
+        for step in steps:
+            self.add(step['op'], step.get('params', {}))
+
+    @classmethod
+    def single(cls, op, params, name=''):
+        return cls([dict(op=op, params=params)], name)
+
+    def add(self, op, params=None):
+        if op not in STEPS:
+            raise ValueError(f'Unknown operation: {op}')
+        self.steps.append(dict(op=op, params=STEPS[op].normalize(params or {})))
+        return self
+
+    def to_dict(self):
+        return dict(name=self.name, steps=self.steps)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('steps', []), data.get('name', ''))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def describe(self):
+        return ' → '.join(step['op'] for step in self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __eq__(self, other):
+        return isinstance(other, Recipe) and self.steps == other.steps
+
+
+def _stage(transforms, step, stage_cache):
+    if transforms is not None and len(transforms) > 1:
+        return lambda img: apply_transforms(img, transforms)
+    step_type = STEPS[step['op']]
+    if step_type.staged and stage_cache is not None:
+        return lambda img: step_type.run(img, stage_cache=stage_cache, **step['params'])
+    return lambda img: step_type.run(img, **step['params'])
+
+
+def plan(recipe: Recipe, stage_cache=None):
+    """
+    Group the steps for execution: a list of (stop, run) where run(img)
+    produces the image after steps[:stop] from the one before the group.
+    Consecutive per-pixel steps share one group. Staged steps use
+    stage_cache, when given, to resume from their cached stages.
+    """
+    groups = []
+    for index, step in enumerate(recipe.steps):
+        step_type = STEPS[step['op']]
+        transform = step_type.point(**step['params']) if step_type.point else None
+        if transform is not None and groups and groups[-1][1] is not None:
+            groups[-1][0] = index + 1
+            groups[-1][1].append(transform)
+        else:
+            groups.append([index + 1, None if transform is None else [transform], step])
+    return [(stop, _stage(transforms, step, stage_cache)) for stop, transforms, step in groups]
+
+
+def execute(recipe: Recipe, load, cache=None, source=None, variant='full', stage_cache=None) -> Image.Image:
+    """
+    Run a recipe on the image returned by load().
+
+    With a cache (a ResultCache) and a source key such as the content digest
+    of the input, the image after each group of steps is cached under the
+    recipe prefix that produced it, and the run resumes from the longest
+    prefix already cached; load() is only called when none is. Only the
+    final result is written to the cache's disk tier. A StageCache lets the
+    step that does run resume from its own cached stages.
+    """
+    stages = plan(recipe, stage_cache)
+    if not stages:
+        return load()
+
+    def key(stop):
+        return result_key(source, 'recipe', recipe.steps[:stop], variant)
+
+    img, done = None, 0
+    if cache is not None and source is not None:
+        # The full recipe counts as a hit or miss; shorter prefixes are probes
+        img = cache.get(key(stages[-1][0]))
+        if img is not None:
+            return img
+        for stop, _ in reversed(stages[:-1]):
+            img = cache.get(key(stop), count=False)
+            if img is not None:
+                done = stop
+                break
+    if img is None:
+        img = load()
+
+    for index, (stop, run) in enumerate(stages):
+        if stop <= done:
+            continue
+        checkpoint(index / len(stages), f'Step {index + 1} of {len(stages)} ...')
+        img = run(img)
+        if cache is not None and source is not None:
+            cache.put(key(stop), img, disk=stop == stages[-1][0])
+    return img
+
+
+def run_recipe(img: Image.Image, recipe: Recipe) -> Image.Image:
+    """Run a recipe on an image, without caching"""
+    return execute(recipe, lambda: img)
+
+
+def process_recipe(input_path, recipe: Recipe, cache=None, variant='full', stage_cache=None,
+                   sources=None) -> Image.Image:
+    """
+    Decode an image file and run a recipe on it, reusing cached prefixes and
+    stages. With a SourceCache the decoded input is shared with other calls.
+    """
+    source = cache.digest(input_path) if cache is not None else None
+    if sources is not None:
+        load = lambda: sources.get(input_path).image()
+    else:
+        load = lambda: open_image(input_path)
+    return execute(recipe, load, cache, source, variant, stage_cache)
@@ -0,0 +1,54 @@
+##=============================================================================
+# Fast preview
+#
+# Processing a downscaled proxy of the original gives near-instant feedback
+# while the parameters are being tuned. The full-resolution image is only
+# rendered when the result is saved, using the same parameters.
+##=============================================================================
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from imagic.scheduler import checkpoint
+from imagic.sources import get_sources
+
+# Long edge of the preview proxy, in pixels
+PREVIEW_SIZE = 1024
+
+
+class ProxyCache:
+    """Downscaled copies of source images, keyed by path and mtime"""
+
+    def __init__(self, max_size=PREVIEW_SIZE, max_entries=4):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path) -> Image.Image:
+        key = (os.fspath(path), os.path.getmtime(path))
+        with self._lock:
+            proxy = self._entries.get(key)
+            if proxy is not None:
+                self._entries.move_to_end(key)
+                return proxy
+
+        # Shares the decode with the other users of the file
+        proxy = get_sources().get(path).reduced(self.max_size)
+
+        with self._lock:
+            self._entries[key] = proxy
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return proxy
+
+
+def render_recipe_preview(proxies: ProxyCache, input_path, recipe, cache=None, stage_cache=None) -> Image.Image:
+    """Run a recipe on the cached proxy of input_path, reusing cached prefixes and stages"""
+    from imagic.pipeline import execute
+
+    checkpoint(0.05, 'Preparing preview ...')
+    source = cache.digest(input_path) if cache is not None else None
+    return execute(recipe, lambda: proxies.get(input_path), cache, source, variant=f'preview-{proxies.max_size}', stage_cache=stage_cache)
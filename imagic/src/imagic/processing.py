@@ -0,0 +1,160 @@
+##=============================================================================
+# Image processing operations
+#
+# The operations behind the "Choose Processing" options. They take and
+# return PIL images and read no widgets, so they can run in a worker thread
+# and be shared by the GUI and headless tools.
+##=============================================================================
+import functools
+
+from PIL import ExifTags, Image, ImageOps
+
+from imagic.encoding import save
+from imagic.enhance import enhance, enhance_halo, enhance_tiled
+from imagic.filters import apply_filter, filter_halo
+from imagic.formats import save_format
+from imagic.instrument import Stages, span
+from imagic.scheduler import checkpoint
+from imagic.sessions import DEFAULT_MODEL, get_pool
+from imagic.tiling import TILE_SIZE, needs_tiling, process_tiled, tile_workers
+
+
+def remove_background(img: Image, bgcolor=None, model=DEFAULT_MODEL, alpha_matting=False,
+                      fg_threshold=240, bg_threshold=10, erode_size=10, fast=False, refine_edges=False,
+                      report=None) -> Image:
+    """
+    Remove the background, optionally filling it with an RGBA colour.
+    The mask (and the matted cutout) is cached per image and model, so only
+    the compositing is redone when the fill changes.
+
+    With fast=True the network runs on a copy decoded at reduced size and
+    the mask is upsampled with a guided filter. refine_edges=True re-fits
+    the uncertain band of the mask to the image, a much faster alternative
+    to alpha matting. Pass a list as `report` to collect per-stage timing
+    and peak memory.
+    """
+    from imagic.inference import get_batcher
+    from imagic.masks import (INFERENCE_SIZE, composite, compute_mask, fill_background, get_mask_cache,
+                              guided_upsample, image_digest, matting_cutout, reduced_image, refine_mask)
+
+    cache = get_mask_cache()
+    stages = Stages(report, prefix='remove-bg.')
+    try:
+        fast = fast and max(img.size) > INFERENCE_SIZE
+        small = stages.run('decode', reduced_image, img, INFERENCE_SIZE) if fast else None
+
+        # rembg would apply the EXIF orientation itself; do it up front so
+        # the mask and the image line up (images decoded through
+        # imagic.sources are upright already)
+        if img.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+            img = ImageOps.exif_transpose(img)
+            if small is not None:
+                small = ImageOps.exif_transpose(small)
+
+        def segment(source):
+            batcher = get_batcher(model)
+            if batcher is not None:
+                # Shares an ONNX run with concurrent requests (service, batch jobs)
+                checkpoint(0.3, 'Removing background ...')
+                return batcher.predict(source)
+            checkpoint(0.1, 'Loading model ...')
+            session = get_pool().get(model)
+            checkpoint(0.3, 'Removing background ...')
+            return compute_mask(source, session)
+
+        if fast:
+            # The reduced copy and the full size identify the input without
+            # hashing the full image
+            key = (image_digest(small), img.size, model)
+            small_mask = stages.run('segment', cache.get_or_compute, key + ('fast',), lambda: segment(small))
+            checkpoint(0.6, 'Upsampling mask ...')
+            mask = stages.run('upsample', guided_upsample, small_mask, small, img)
+        else:
+            key = (image_digest(img), model)
+            mask = stages.run('segment', cache.get_or_compute, key, lambda: segment(img))
+
+        if refine_edges:
+            def refine():
+                checkpoint(0.65, 'Refining edges ...')
+                return refine_mask(img, mask, fg_threshold, bg_threshold, erode_size)
+
+            key += ('refined', fg_threshold, bg_threshold, erode_size)
+            mask = stages.run('refine', cache.get_or_compute, key, refine)
+
+        if alpha_matting:
+            def refine():
+                checkpoint(0.7, 'Alpha matting ...')
+                return matting_cutout(img, mask, fg_threshold, bg_threshold, erode_size)
+
+            matted = stages.run('matting', cache.get_or_compute, key + ('matting', fg_threshold, bg_threshold, erode_size), refine)
+            if bgcolor is None:
+                return matted
+            return stages.run('composite', fill_background, matted, bgcolor)
+
+        checkpoint(0.9, 'Compositing ...')
+        return stages.run('composite', composite, img, mask, bgcolor)
+    finally:
+        stages.close()
+
+
+def artistic_filter(img: Image, filter='Grayscale', intensity=1.0) -> Image:
+    """Apply artistic filter to image"""
+    checkpoint(0.2, f'Applying {filter} ...')
+    with span(f'filter.{filter}', img):
+        return apply_filter(img, filter, intensity)
+
+
+def artistic_filter_tiled(img: Image, filter='Grayscale', intensity=1.0, tile_size=TILE_SIZE, workers=1) -> Image:
+    """artistic_filter() tile by tile, for images too large to process in one piece"""
+    func = functools.partial(apply_filter, filter_type=filter, intensity=intensity)
+    with span(f'filter.{filter}', img, tiled=True):
+        return process_tiled(img, func, filter_halo(filter, intensity), tile_size, workers)
+
+
+# Operation name -> function taking (img, **params)
+OPERATIONS = {
+    'remove-bg': remove_background,
+    'enhance': enhance,
+    'filter': artistic_filter,
+}
+
+# Operations that can run tile by tile: name -> (tiled function, halo function).
+# Background removal needs the whole image in one inference, so it is not here.
+TILED_OPERATIONS = {
+    'enhance': (
+        enhance_tiled,
+        lambda sharpness=1.3, portrait=False, **_: enhance_halo(sharpness, portrait)
+    ),
+    'filter': (
+        artistic_filter_tiled,
+        lambda filter='Grayscale', intensity=1.0: filter_halo(filter, intensity)
+    ),
+}
+
+
+def run_operation(img: Image, op: str, tiled=None, **params) -> Image:
+    """
+    Run a named operation on an image. Images over the memory budget are
+    processed in tiles when the operation allows it; pass tiled=True or
+    False to force the choice.
+    """
+    if op not in OPERATIONS:
+        raise ValueError(f'Unknown operation: {op}')
+    with span(op, img):
+        if op in TILED_OPERATIONS and (needs_tiling(img) if tiled is None else tiled):
+            func, halo = TILED_OPERATIONS[op]
+            return func(img, workers=tile_workers(img, halo(**params)), **params)
+        return OPERATIONS[op](img, **params)
+
+
+def save_image(img: Image, output_path, format=None, **options):
+    """
+    Encode a result to disk; results stay in memory until they are saved.
+    The format defaults to the one for the file extension (PNG if unknown);
+    `options` are the quality settings of imagic.encoding.save().
+    """
+    format = format or save_format(output_path)
+    checkpoint(0.5, 'Saving ...')
+    with span('encode', img, format=format):
+        save(img, output_path, format, **options)
+    return output_path
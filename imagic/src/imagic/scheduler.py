@@ -0,0 +1,143 @@
+##=============================================================================
+# Processing scheduler
+#
+# Runs CPU-heavy processing in a worker pool so the Toga event loop stays
+# responsive. Only the most recent job matters: starting a new job cancels
+# the previous one and any result it still produces is dropped.
+##=============================================================================
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    """Raised when a job is cancelled or superseded by a newer one"""
+
+
+class Job:
+    """A single submitted job, shared between the event loop and the worker"""
+
+    def __init__(self, job_id, loop, on_progress=None):
+        self.id = job_id
+        self.loop = loop
+        self.on_progress = on_progress
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def report(self, fraction=None, message=None):
+        """Forward progress to the event loop (safe to call from any thread)"""
+        if self.on_progress is not None and not self.cancelled.is_set():
+            self.loop.call_soon_threadsafe(self.on_progress, fraction, message)
+
+
+_local = threading.local()
+
+
+def checkpoint(fraction=None, message=None):
+    """
+    Report progress from inside a job and stop early if it was cancelled.
+    Does nothing when called outside the scheduler (batch jobs, tests).
+    """
+    job = getattr(_local, 'job', None)
+    if job is None:
+        return
+    if job.cancelled.is_set():
+        raise JobCancelled()
+    if fraction is not None or message is not None:
+        job.report(fraction, message)
+
+
+def current_job():
+    """The job running on this thread, or None outside the scheduler"""
+    return getattr(_local, 'job', None)
+
+
+def run_job(job, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) on this thread as part of `job`, so its
+    checkpoint() calls report progress to the job and stop when it is
+    cancelled. Raises JobCancelled if the job was cancelled before it started.
+    """
+    if job.cancelled.is_set():
+        raise JobCancelled()
+    _local.job = job
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.job = None
+
+
+class ProcessingScheduler:
+    """
+    Send processing jobs to a thread pool (or any concurrent.futures executor).
+
+    on_progress(fraction, message) is called on the event loop for progress
+    reported through checkpoint(). Progress and cancellation checkpoints only
+    work with the default thread pool; a process pool runs jobs to completion
+    and simply drops stale results.
+    """
+
+    def __init__(self, executor=None, max_workers=2, on_progress=None):
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='imagic-worker'
+        )
+        self.on_progress = on_progress
+        self._current = None
+        self._next_id = 0
+
+    @property
+    def busy(self):
+        return self._current is not None
+
+    def cancel(self):
+        """Cancel the running job, if any"""
+        if self._current is not None:
+            self._current.cancel()
+            self._current = None
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the pool and return its result.
+        Raises JobCancelled if the job is cancelled or replaced before it ends.
+        """
+        self.cancel()
+
+        loop = asyncio.get_running_loop()
+        self._next_id += 1
+        job = Job(self._next_id, loop, self.on_progress)
+        self._current = job
+
+        if isinstance(self.executor, ThreadPoolExecutor):
+            call = functools.partial(run_job, job, func, *args, **kwargs)
+        else:
+            call = functools.partial(func, *args, **kwargs)
+        job.future = loop.run_in_executor(self.executor, call)
+
+        try:
+            result = await job.future
+        except (asyncio.CancelledError, Exception):
+            if self._finish(job):
+                raise
+            raise JobCancelled()
+
+        if not self._finish(job):
+            raise JobCancelled()
+        return result
+
+    def _finish(self, job):
+        """Release a finished job; returns False if it was cancelled or superseded"""
+        current = self._current is job and not job.cancelled.is_set()
+        if self._current is job:
+            self._current = None
+        return current
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
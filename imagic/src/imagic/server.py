@@ -0,0 +1,386 @@
+##=============================================================================
+# Headless HTTP service
+#
+#   python -m imagic serve [--host 127.0.0.1] [--port 8080] [--workers N]
+#                          [--queue-size N] [--timeout SECONDS] [--preload u2net]
+#
+#   POST /remove-bg?model=u2net&bgcolor=255,255,255     body: image bytes
+#   POST /enhance?sharpness=1.8&portrait=true
+#   POST /filter?filter=Sepia&intensity=0.8
+#        &format=png|jpeg|webp&quality=90                response: encoded image
+#   GET  /metrics                                        queue, latency, throughput
+#   GET  /health
+#
+# Every registered pipeline step is an endpoint; query parameters are
+# checked against the step's typed parameters. Requests wait in a bounded
+# queue for a pool of worker threads: when the queue is full the service
+# answers 503 with Retry-After instead of queueing more work, and a request
+# that is not done within the timeout (queueing included) gets 504 and its
+# job is cancelled at the next checkpoint. rembg sessions stay loaded for
+# the life of the process. Built on asyncio streams, so it needs nothing
+# beyond the standard library and the processing dependencies.
+##=============================================================================
+import argparse
+import asyncio
+import functools
+import io
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from imagic.scheduler import Job, run_job
+from imagic.sessions import DEFAULT_MODEL, get_pool
+
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_TIMEOUT = 60.0
+MAX_BODY_BYTES = 64 << 20
+
+# Latencies kept for the percentiles, and the window throughput is measured over
+LATENCY_SAMPLES = 1000
+THROUGHPUT_WINDOW = 60.0
+
+CONTENT_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Metrics:
+    """Request counts, recent latencies and completion times"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.finished = deque()
+
+    def record(self, seconds):
+        now = time.monotonic()
+        self.completed += 1
+        self.latencies.append(seconds)
+        self.finished.append(now)
+
+    def snapshot(self, queue_depth, in_flight, workers):
+        now = time.monotonic()
+        while self.finished and self.finished[0] < now - THROUGHPUT_WINDOW:
+            self.finished.popleft()
+        window = min(THROUGHPUT_WINDOW, now - self.started) or 1.0
+        latencies = sorted(self.latencies)
+        return dict(
+            queue_depth=queue_depth,
+            in_flight=in_flight,
+            workers=workers,
+            completed=self.completed,
+            failed=self.failed,
+            rejected=self.rejected,
+            timed_out=self.timed_out,
+            latency_ms={
+                name: None if value is None else round(value * 1000, 1)
+                for name, value in (
+                    ('p50', percentile(latencies, 0.5)),
+                    ('p90', percentile(latencies, 0.9)),
+                    ('p99', percentile(latencies, 0.99)),
+                )
+            },
+            throughput_per_s=round(len(self.finished) / window, 3),
+            uptime_s=round(now - self.started, 1),
+        )
+
+
+#------------------------------------------------------------------------------
+# Request parameters, and the work done on the worker threads
+
+def parse_params(op, query):
+    """Split the query into step parameters and output options, both checked"""
+    from imagic.formats import DEFAULT_COMPRESS_LEVEL, DEFAULT_QUALITY
+    from imagic.pipeline import STEPS
+
+    query = dict(query)
+    output = dict(
+        format=query.pop('format', 'png').upper(),
+        quality=int(query.pop('quality', DEFAULT_QUALITY)),
+        compress_level=int(query.pop('compress_level', DEFAULT_COMPRESS_LEVEL)),
+        lossless=query.pop('lossless', 'false').lower() in ('1', 'true', 'yes'),
+    )
+    if output['format'] == 'JPG':
+        output['format'] = 'JPEG'
+    if output['format'] not in CONTENT_TYPES:
+        raise ValueError(f'Unsupported format: {output["format"]}')
+    if not 1 <= output['quality'] <= 100:
+        raise ValueError('quality must be between 1 and 100')
+    if not 0 <= output['compress_level'] <= 9:
+        raise ValueError('compress_level must be between 0 and 9')
+
+    step_type = STEPS[op]
+    params = {}
+    for name, value in query.items():
+        param = step_type.params.get(name)
+        if param is None:
+            raise ValueError(f'Unknown parameter for {op}: {name}')
+        if param.type is bool:
+            value = value.lower() in ('1', 'true', 'yes')
+        elif param.type == 'color':
+            value = value.split(',')
+        params[name] = value
+    return step_type.normalize(params), output
+
+
+def process_bytes(op, params, output, body):
+    """Decode the request body, run one step and encode the result"""
+    from PIL import Image
+
+    from imagic.encoding import save
+    from imagic.pipeline import Recipe, run_recipe
+    from imagic.sources import oriented
+
+    try:
+        img = Image.open(io.BytesIO(body))
+        img.load()
+    except Exception as e:
+        raise ValueError(f'Cannot decode image: {e}')
+    img = oriented(img)
+    result = run_recipe(img, Recipe([dict(op=op, params=params)]))
+    buffer = io.BytesIO()
+    # The pool's threads are busy with other requests: one encoder thread each
+    save(result, buffer, output['format'], output['quality'], output['compress_level'], output['lossless'], threads=1)
+    return buffer.getvalue()
+
+
+#------------------------------------------------------------------------------
+
+class ImagicServer:
+    """
+    The HTTP front end, a bounded request queue and the worker pool behind it.
+    Start with `await server.start()`; `server.port` is the bound port.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, workers=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 timeout=DEFAULT_TIMEOUT, preload=(DEFAULT_MODEL,)):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.preload = preload
+        self.metrics = Metrics()
+        self.in_flight = 0
+        self._queue = None
+        self._executor = None
+        self._server = None
+        self._worker_tasks = []
+
+    async def start(self):
+        from imagic.pipeline import STEPS
+
+        self.operations = set(STEPS)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='imagic-serve')
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.workers > 1:
+            # Concurrent requests share ONNX runs for background removal
+            from imagic.inference import enable_batching
+            enable_batching()
+        if self.preload:
+            # Keep the models warm: load them now rather than on the first request
+            get_pool().preload(self.preload)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f'Imagic service listening on http://{self.host}:{self.port}')
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.workers > 1:
+            from imagic.inference import disable_batching
+            disable_batching()
+
+    #--------------------------------------------------------------------------
+    # Queue and workers
+
+    async def submit(self, func, *args):
+        """
+        Queue func(*args) for the worker pool and wait for its result.
+        Raises HTTPError 503 if the queue is full and 504 on timeout.
+        """
+        loop = asyncio.get_running_loop()
+        job = Job(0, loop)
+        result = loop.create_future()
+        try:
+            self._queue.put_nowait((job, func, args, result))
+        except asyncio.QueueFull:
+            self.metrics.rejected += 1
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, 'Queue full, retry later')
+        try:
+            return await asyncio.wait_for(asyncio.shield(result), self.timeout)
+        except asyncio.TimeoutError:
+            # Skipped if still queued, stopped at the next checkpoint if running
+            job.cancel()
+            result.cancel()
+            self.metrics.timed_out += 1
+            raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, f'Not done within {self.timeout:g}s')
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, func, args, result = await self._queue.get()
+            try:
+                if job.cancelled.is_set():
+                    continue
+                self.in_flight += 1
+                try:
+                    value = await loop.run_in_executor(self._executor, functools.partial(run_job, job, func, *args))
+                except Exception as e:
+                    if not result.done():
+                        result.set_exception(e)
+                else:
+                    if not result.done():
+                        result.set_result(value)
+                finally:
+                    self.in_flight -= 1
+            finally:
+                self._queue.task_done()
+
+    #--------------------------------------------------------------------------
+    # HTTP
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            status, headers, body = await self._respond(reader)
+        except HTTPError as e:
+            status, headers, body = e.status, {'Content-Type': 'application/json'}, json.dumps(dict(error=str(e))).encode()
+            if e.status == HTTPStatus.SERVICE_UNAVAILABLE:
+                headers['Retry-After'] = '1'
+        except Exception as e:
+            print(f'Error handling request: {e}')
+            status, headers, body = HTTPStatus.INTERNAL_SERVER_ERROR, {'Content-Type': 'application/json'}, b'{}'
+
+        head = [f'HTTP/1.1 {status.value} {status.phrase}']
+        headers.update({'Content-Length': str(len(body)), 'Connection': 'close'})
+        head += [f'{name}: {value}' for name, value in headers.items()]
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """(method, path, query, body) of one HTTP/1.1 request"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            method, target, _ = request_line.split(' ', 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Malformed request line')
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = headers.get('content-length') or '0'
+        if not length.isdigit():
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f'Invalid Content-Length: {length}')
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            # Refused before any of the body is read
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f'Body larger than {MAX_BODY_BYTES} bytes')
+        try:
+            body = await reader.readexactly(length) if length else b''
+        except asyncio.IncompleteReadError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Body shorter than Content-Length')
+        url = urlsplit(target)
+        return method.upper(), url.path, parse_qsl(url.query), body
+
+    async def _respond(self, reader):
+        method, path, query, body = await self._read_request(reader)
+        if path == '/health' and method == 'GET':
+            return HTTPStatus.OK, {'Content-Type': 'application/json'}, b'{"status": "ok"}'
+        if path == '/metrics' and method == 'GET':
+            snapshot = self.metrics.snapshot(self._queue.qsize(), self.in_flight, self.workers)
+            return HTTPStatus.OK, {'Content-Type': 'application/json'}, json.dumps(snapshot).encode()
+
+        op = path.strip('/')
+        if op not in self.operations:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f'Unknown endpoint: {path}')
+        if method != 'POST':
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, 'Use POST with the image as the body')
+        if not body:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Empty body: send the image bytes')
+        try:
+            params, output = parse_params(op, query)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+        start = time.monotonic()
+        try:
+            data = await self.submit(process_bytes, op, params, output, body)
+        except HTTPError:
+            raise
+        except ValueError as e:
+            self.metrics.failed += 1
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception as e:
+            self.metrics.failed += 1
+            print(f'Error processing request: {e}')
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+        self.metrics.record(time.monotonic() - start)
+        return HTTPStatus.OK, {'Content-Type': CONTENT_TYPES[output['format']]}, data
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m imagic serve', description='Serve the processing operations over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Worker threads (default: CPU count)')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help='Requests waiting before 503')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Seconds before a request gets 504')
+    parser.add_argument('--preload', default=DEFAULT_MODEL, help='Comma separated models to load at start ("" for none)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    server = ImagicServer(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        timeout=args.timeout,
+        preload=[name for name in args.preload.split(',') if name],
+    )
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,100 @@
+##=============================================================================
+# rembg session pool
+#
+# Building an ONNX Runtime session loads the model weights from disk and is
+# by far the most expensive part of a background removal. Sessions are
+# therefore created lazily, once per model, and kept for the life of the
+# process.
+##=============================================================================
+import os
+import threading
+
+# Display name -> rembg model name
+MODELS = {
+    'u2net': 'u2net',
+    'u2netp': 'u2netp',
+    'isnet': 'isnet-general-use',
+    'silueta': 'silueta',
+}
+DEFAULT_MODEL = 'u2net'
+
+
+def default_num_threads():
+    """ONNX thread count, from IMAGIC_ONNX_THREADS or the number of CPUs"""
+    value = os.environ.get('IMAGIC_ONNX_THREADS')
+    if value:
+        return max(1, int(value))
+    return os.cpu_count() or 1
+
+
+class SessionPool:
+    """Lazily created, process-wide rembg sessions keyed by model name"""
+
+    def __init__(self, num_threads=None):
+        self.num_threads = num_threads or default_num_threads()
+        self._sessions = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _model_lock(self, model):
+        with self._lock:
+            return self._locks.setdefault(model, threading.Lock())
+
+    def _create(self, model):
+        import onnxruntime as ort
+        from rembg import new_session
+
+        # The models run their graph sequentially, so only the intra-op pool
+        # does any work; sizing the inter-op pool too just spawns idle threads
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = self.num_threads
+        return new_session(model, sess_opts=sess_opts)
+
+    def get(self, name=DEFAULT_MODEL):
+        """Return the session for a model, creating it on first use"""
+        model = MODELS.get(name, name)
+        session = self._sessions.get(model)
+        if session is not None:
+            return session
+
+        # Only one thread builds a given model; others wait for it
+        with self._model_lock(model):
+            session = self._sessions.get(model)
+            if session is None:
+                print(f'Loading rembg model: {model}')
+                session = self._create(model)
+                self._sessions[model] = session
+            return session
+
+    def is_loaded(self, name=DEFAULT_MODEL):
+        return MODELS.get(name, name) in self._sessions
+
+    def preload(self, names=(DEFAULT_MODEL,)):
+        """Create sessions in a background thread so the first request is fast"""
+        def run():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f'Error preloading model {name}: {e}')
+
+        thread = threading.Thread(target=run, name='imagic-preload', daemon=True)
+        thread.start()
+        return thread
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> SessionPool:
+    """Return the process-wide session pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool()
+        return _pool
+
+
+def get_session(name=DEFAULT_MODEL):
+    return get_pool().get(name)
@@ -0,0 +1,119 @@
+##=============================================================================
+# Image sources
+#
+# Every consumer of an input file (the display thumbnail, the preview proxy,
+# full resolution processing) goes through here, so the file is decoded at
+# full size at most once per upload and the EXIF orientation is applied
+# once, at decode time. Reduced copies come from a JPEG decode at reduced
+# size (DCT scaling via draft()) until the full image has been decoded, and
+# from the full image after that.
+#
+# Decoded images are shared between callers and must not be modified.
+##=============================================================================
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import ExifTags, Image, ImageOps
+
+from imagic.instrument import span
+from imagic.thumbnails import make_thumbnail
+
+# Sources kept decoded: the current upload and the one before it
+MAX_SOURCES = 2
+
+
+def oriented(img: Image.Image) -> Image.Image:
+    """img turned upright according to its EXIF orientation (img itself if it already is)"""
+    if img.getexif().get(ExifTags.Base.Orientation, 1) == 1:
+        return img
+    return ImageOps.exif_transpose(img)
+
+
+def open_image(path, max_size=None) -> Image.Image:
+    """
+    Decode an image file, upright. With max_size, decode at reduced size
+    and return a copy whose long edge is at most max_size.
+    """
+    with Image.open(path) as img:
+        if max_size is not None:
+            return oriented(make_thumbnail(img, max_size))
+        with span('decode', img, format=img.format):
+            img.load()
+        return oriented(img)
+
+
+class ImageSource:
+    """One input file: its full resolution decode and reduced copies, each made once"""
+
+    def __init__(self, path):
+        self.path = path
+        self._image = None
+        self._reduced = {}
+        self._lock = threading.Lock()
+
+    def image(self) -> Image.Image:
+        """The full resolution image, decoded on first use"""
+        # Concurrent callers wait for the one decode rather than repeat it
+        with self._lock:
+            if self._image is None:
+                self._image = open_image(self.path)
+            return self._image
+
+    def reduced(self, max_size) -> Image.Image:
+        """A copy whose long edge is at most max_size, made on first use"""
+        with self._lock:
+            img = self._reduced.get(max_size)
+            if img is None:
+                if self._image is not None:
+                    img = make_thumbnail(self._image, max_size)
+                else:
+                    img = open_image(self.path, max_size)
+                self._reduced[max_size] = img
+            return img
+
+    @property
+    def decoded(self):
+        return self._image is not None
+
+
+class SourceCache:
+    """The most recently used sources, keyed by path, mtime and size"""
+
+    def __init__(self, max_entries=MAX_SOURCES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path) -> ImageSource:
+        stat = os.stat(path)
+        key = (os.fspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            source = self._entries.get(key)
+            if source is None:
+                source = self._entries[key] = ImageSource(path)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            return source
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_sources = None
+_sources_lock = threading.Lock()
+
+
+def get_sources() -> SourceCache:
+    """The process-wide source cache"""
+    global _sources
+    with _sources_lock:
+        if _sources is None:
+            _sources = SourceCache()
+        return _sources
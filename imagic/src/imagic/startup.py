@@ -0,0 +1,109 @@
+##=============================================================================
+# Startup timing and warm-up
+#
+# The GUI only imports toga and the light imagic modules up front; numpy,
+# OpenCV, PIL and rembg/onnxruntime are imported when first needed or by an
+# optional warm-up thread once the window is showing.
+#
+#   IMAGIC_STARTUP_TIMING=1   print how long it took to show the window
+#   IMAGIC_WARMUP=0           disable the background warm-up
+#
+#   python -m imagic importtime [module]
+#
+# prints the slowest imports of a module (default imagic.app) as measured by
+# `python -X importtime`, to track startup regressions.
+##=============================================================================
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Taken when this module is first imported, which imagic.app does before
+# anything else
+STARTED = time.perf_counter()
+
+# Imported by the warm-up thread, in order
+WARMUP_MODULES = ['numpy', 'PIL.Image', 'cv2', 'imagic.processing', 'imagic.preview']
+
+
+def elapsed_ms():
+    return (time.perf_counter() - STARTED) * 1000
+
+
+def report_startup(label='Window shown'):
+    """Print the time since startup when IMAGIC_STARTUP_TIMING is set"""
+    if os.environ.get('IMAGIC_STARTUP_TIMING'):
+        print(f'{label} after {elapsed_ms():.0f} ms')
+
+
+def warm_up(models=()):
+    """
+    Import the heavy modules and load rembg models in a background thread,
+    so the first processing request does not pay for them.
+    Returns the thread, or None when disabled with IMAGIC_WARMUP=0.
+    """
+    if os.environ.get('IMAGIC_WARMUP', '1') == '0':
+        return None
+
+    def run():
+        import importlib
+        for name in WARMUP_MODULES:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f'Error warming up {name}: {e}')
+        report_startup('Warm-up imports done')
+
+        if models:
+            from imagic.sessions import get_pool
+            get_pool().preload(models).join()
+            report_startup('Warm-up models loaded')
+
+    thread = threading.Thread(target=run, name='imagic-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def parse_importtime(text):
+    """
+    Parse `-X importtime` output into (cumulative_us, self_us, module)
+    tuples, slowest first.
+    """
+    rows = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header line
+        rows.append((int(fields[1]), int(fields[0]), fields[2].strip()))
+    rows.sort(reverse=True)
+    return rows
+
+
+def import_times(module='imagic.app'):
+    """Import a module in a fresh interpreter and return its import times"""
+    # The child sees the same modules as this interpreter
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        env=env
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{result.stderr[-2000:]}')
+    return parse_importtime(result.stderr)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    module = argv[0] if argv else 'imagic.app'
+    rows = import_times(module)
+    total = next((cumulative for cumulative, _, name in rows if name == module), rows[0][0] if rows else 0)
+    print(f'Importing {module} took {total / 1000:.1f} ms')
+    print(f'{"cumulative ms":>14} {"self ms":>9}  module')
+    for cumulative, own, name in rows[:25]:
+        print(f'{cumulative / 1000:14.1f} {own / 1000:9.1f}  {name}')
+    return 0
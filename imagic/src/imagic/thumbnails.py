@@ -0,0 +1,84 @@
+##=============================================================================
+# Thumbnails for display
+#
+# The image panes only need a few hundred pixels, so images are decoded at
+# reduced size (JPEG DCT scaling via draft(), then reduce()) and only the
+# thumbnail is handed to the widget. Thumbnails of files are turned upright
+# per their EXIF orientation, and cached by path, mtime and file size, in an
+# LRU bounded by memory.
+##=============================================================================
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# Long edge of the thumbnails; twice the 300 px display size for HiDPI screens
+THUMBNAIL_SIZE = 600
+
+# Memory cap for cached thumbnails
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def make_thumbnail(img: Image.Image, max_size=THUMBNAIL_SIZE) -> Image.Image:
+    """Decode img at reduced size and return a copy whose long edge is at most max_size"""
+    # Let the JPEG decoder skip detail we are going to throw away anyway
+    img.draft(img.mode, (max_size, max_size))
+    thumbnail = img.copy()
+    # thumbnail() uses reduce() for the bulk of the downscale, then resamples
+    thumbnail.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if thumbnail.mode not in ('RGB', 'RGBA'):
+        thumbnail = thumbnail.convert('RGBA' if 'transparency' in thumbnail.info or 'A' in thumbnail.mode else 'RGB')
+    return thumbnail
+
+
+def image_bytes(img: Image.Image):
+    return img.width * img.height * len(img.getbands())
+
+
+class ThumbnailCache:
+    """LRU cache of display thumbnails keyed by (path, mtime, size)"""
+
+    def __init__(self, max_size=THUMBNAIL_SIZE, max_bytes=MAX_CACHE_BYTES):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, path):
+        stat = os.stat(path)
+        return (os.fspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path) -> Image.Image:
+        """Return the thumbnail of an image file, decoding it on a miss"""
+        key = self._key(path)
+        with self._lock:
+            thumbnail = self._entries.get(key)
+            if thumbnail is not None:
+                self._entries.move_to_end(key)
+                return thumbnail
+
+        from imagic.sources import open_image
+        thumbnail = open_image(path, self.max_size)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = thumbnail
+                self.current_bytes += image_bytes(thumbnail)
+                self._evict()
+        return thumbnail
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone exceeds the cap
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.current_bytes -= image_bytes(old)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
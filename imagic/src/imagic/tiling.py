@@ -0,0 +1,128 @@
+##=============================================================================
+# Tiled processing for very large images
+#
+# Neighbourhood filters only look a few pixels around each output pixel, so
+# an image can be processed as tiles that overlap by that radius (the halo)
+# and stitched back without seams. Only the tiles in flight and the output
+# need to be held next to the decoded input, instead of several full-size
+# intermediate copies.
+#
+#   IMAGIC_MEMORY_BUDGET_MB   working memory allowed before tiling kicks in
+#                             (default 1024)
+##=============================================================================
+import math
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from PIL import Image
+
+from imagic.scheduler import checkpoint
+
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+# Full-size copies an untiled operation keeps alive at its peak
+WORKING_COPIES = 5
+
+# Long edge of a tile, excluding its halo
+TILE_SIZE = 2048
+
+
+def memory_budget():
+    """Memory budget in bytes, from IMAGIC_MEMORY_BUDGET_MB"""
+    value = os.environ.get('IMAGIC_MEMORY_BUDGET_MB')
+    return int(float(value or DEFAULT_MEMORY_BUDGET_MB) * 1024 * 1024)
+
+
+def working_bytes(width, height, bands=3, copies=WORKING_COPIES):
+    """Estimated peak memory of an untiled operation on a width x height image"""
+    return width * height * bands * copies
+
+
+def needs_tiling(img: Image.Image, budget=None):
+    """True if processing img in one piece would exceed the memory budget"""
+    budget = memory_budget() if budget is None else budget
+    return working_bytes(img.width, img.height, len(img.getbands())) > budget
+
+
+def tile_workers(img: Image.Image, halo, tile_size=TILE_SIZE, budget=None):
+    """How many tiles can be processed at once within the memory budget"""
+    budget = memory_budget() if budget is None else budget
+    side = tile_size + 2 * halo
+    # The decoded input and the output take their share of the budget first
+    available = budget - 2 * img.width * img.height * len(img.getbands())
+    per_tile = working_bytes(side, side, len(img.getbands())) * 2
+    return max(1, min(os.cpu_count() or 1, available // per_tile))
+
+
+def gaussian_halo(radius, passes=3):
+    """Pixels of context needed by PIL's GaussianBlur(radius)"""
+    # PIL runs `passes` extended box blurs of half-width size + 1 (with
+    # fractional end taps) along each axis
+    sigma2 = radius * radius / passes
+    size = int((math.sqrt(12 * sigma2 + 1) - 1) / 2)
+    return passes * (size + 1)
+
+
+def tile_boxes(width, height, tile_size=TILE_SIZE):
+    """Yield (left, top, right, bottom) boxes covering the image"""
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield (left, top, min(left + tile_size, width), min(top + tile_size, height))
+
+
+def _run_tile(img, func, box, halo):
+    """Process one tile with its halo and return the halo-free result"""
+    left, top, right, bottom = box
+    padded = (
+        max(0, left - halo),
+        max(0, top - halo),
+        min(img.width, right + halo),
+        min(img.height, bottom + halo),
+    )
+    result = func(img.crop(padded))
+    inner = (left - padded[0], top - padded[1], right - padded[0], bottom - padded[1])
+    return result.crop(inner)
+
+
+def process_tiled(img: Image.Image, func, halo, tile_size=TILE_SIZE, workers=1):
+    """
+    Apply func (Image -> Image of the same size) tile by tile.
+
+    halo is the number of pixels func needs around each output pixel; tiles
+    are cropped with that margin and trimmed afterwards, so the result is the
+    same as func(img). Tiles run on `workers` threads with at most two per
+    worker in flight; progress and cancellation are handled between tiles.
+    """
+    img.load()
+    boxes = list(tile_boxes(img.width, img.height, tile_size))
+    output = None
+    done_count = 0
+
+    def collect(done):
+        nonlocal output, done_count
+        for future in done:
+            box = pending.pop(future)
+            tile = future.result()
+            if output is None:
+                output = Image.new(tile.mode, img.size)
+            output.paste(tile, box[:2])
+            done_count += 1
+        checkpoint(done_count / len(boxes), f'Tile {done_count} of {len(boxes)} ...')
+
+    # Tiles run off the calling thread, so the operation's own progress
+    # reports stay quiet and only the tile count is shown
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='imagic-tile') as executor:
+        pending = {}
+        try:
+            for box in boxes:
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[executor.submit(_run_tile, img, func, box, halo)] = box
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        finally:
+            for future in pending:
+                future.cancel()
+    return output
@@ -0,0 +1,141 @@
+import io
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagic.animation import is_animated, iter_frames, map_frames, process_animation
+from imagic.encoding import save_animation
+from imagic.pipeline import Recipe
+
+COLORS = [(200, 30, 30), (30, 200, 30), (200, 30, 30), (30, 30, 200)]
+DURATIONS = [100, 200, 300, 400]
+
+
+def make_gif(path, loop=0, transparent=False):
+    frames = []
+    for color in COLORS:
+        frame = Image.new('RGB', (24, 16), color)
+        if transparent:
+            frame = frame.convert('RGBA')
+            frame.paste((0, 0, 0, 0), (0, 0, 8, 16))
+        frames.append(frame)
+    save_animation(zip(frames, DURATIONS), str(path), 'GIF', loop=loop)
+    return path
+
+
+def test_gif_round_trip_keeps_frames_durations_and_loop(tmp_path):
+    path = make_gif(tmp_path / 'in.gif', loop=3, transparent=True)
+    with Image.open(path) as img:
+        assert img.n_frames == 4
+        assert img.info['loop'] == 3
+        durations = []
+        for frame, duration in iter_frames(img):
+            assert frame.mode == 'RGBA'
+            assert frame.getpixel((0, 0))[3] == 0
+            durations.append(duration)
+    assert durations == DURATIONS
+
+
+def test_process_animation_filters_every_frame(tmp_path):
+    path = make_gif(tmp_path / 'in.gif')
+    out = tmp_path / 'out.gif'
+    recipe = Recipe.single('filter', dict(filter='Negative'))
+    assert process_animation(str(path), recipe, str(out), 'GIF', workers=2) == (4, (24, 16))
+
+    assert is_animated(str(out))
+    with Image.open(out) as img:
+        assert img.info['loop'] == 0
+        for (frame, duration), color, expected in zip(iter_frames(img), COLORS, DURATIONS):
+            assert frame.getpixel((5, 5)) == tuple(255 - c for c in color)
+            assert duration == expected
+
+
+def test_play_once_without_loop(tmp_path):
+    path = make_gif(tmp_path / 'in.gif', loop=None)
+    out = tmp_path / 'out.png'
+    process_animation(str(path), Recipe(), str(out), 'PNG')
+    with Image.open(out) as img:
+        assert img.format == 'PNG' and img.n_frames == 4
+        assert img.info['loop'] == 1
+
+
+@pytest.mark.parametrize('format', ['PNG', 'WEBP'])
+def test_animated_png_and_webp(tmp_path, format):
+    path = make_gif(tmp_path / 'in.gif')
+    out = io.BytesIO()
+    process_animation(str(path), Recipe.single('filter', dict(filter='Grayscale')), out, format, lossless=True)
+    out.seek(0)
+    with Image.open(out) as img:
+        assert img.format == format and img.n_frames == 4
+        assert img.info['loop'] == 0
+        img.seek(1)
+        r, g, b = img.convert('RGB').getpixel((5, 5))
+        assert r == g == b
+
+
+def test_animated_png_is_streamed():
+    frames = [random_frame(seed) for seed in range(3)]
+    out = io.BytesIO()
+    written = []
+
+    def produce():
+        for frame in frames:
+            # Everything before this frame is already on its way to disk
+            written.append(out.tell())
+            yield frame, 50
+
+    save_animation(produce(), out, 'PNG', count=len(frames), compress_level=1)
+    assert written[0] < written[1] < written[2]
+    out.seek(0)
+    with Image.open(out) as img:
+        assert img.n_frames == 3 and img.info['loop'] == 1
+        for index, frame in enumerate(frames):
+            img.seek(index)
+            assert img.info['duration'] == 50
+            assert np.array_equal(np.asarray(img.convert('RGBA')), np.asarray(frame))
+
+
+def random_frame(seed):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (40, 30, 4), dtype=np.uint8), 'RGBA')
+
+
+def test_map_frames_skips_duplicates_and_keeps_order():
+    calls = []
+
+    def func(img):
+        calls.append(img.getpixel((0, 0)))
+        return img.point(lambda v: 255 - v)
+
+    frames = [(Image.new('RGB', (4, 4), color), index) for index, color in enumerate(COLORS * 2)]
+    results = list(map_frames(func, iter(frames), workers=2))
+    assert [duration for _, duration in results] == list(range(8))
+    assert [img.getpixel((0, 0)) for img, _ in results] == [tuple(255 - c for c in color) for color in COLORS * 2]
+    assert sorted(calls) == sorted(set(COLORS))
+
+
+def test_map_frames_reads_ahead_a_bounded_number_of_frames():
+    read = 0
+    lock = threading.Lock()
+
+    def frames():
+        nonlocal read
+        rng = np.random.default_rng(0)
+        for index in range(40):
+            with lock:
+                read += 1
+            yield Image.fromarray(rng.integers(0, 256, size=(4, 4, 3), dtype=np.uint8)), index
+
+    for written, (_, index) in enumerate(map_frames(lambda img: img, frames(), workers=2), 1):
+        assert read - written <= 4 - 1
+    assert written == 40
+
+
+def test_map_frames_raises_frame_errors():
+    def func(img):
+        raise ValueError('bad frame')
+
+    with pytest.raises(ValueError, match='bad frame'):
+        list(map_frames(func, iter([(Image.new('RGB', (4, 4)), 0)]), workers=1))
@@ -1,3 +1,90 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+
 def test_first():
     """An initial test for the app."""
     assert 1 + 1 == 2
+
+
+#------------------------------------------------------------------------------
+# Jobs started for one image never show their result on another
+
+
+def make_app(monkeypatch):
+    pytest.importorskip('toga')
+    from PIL import Image
+
+    import imagic.pipeline
+    from imagic.app import ImageMagic
+    from imagic.scheduler import ProcessingScheduler
+
+    class Harness(ImageMagic):
+        main_window = None  # shadows toga's property so a stand-in can be set
+
+        def display_image(self, source, container):
+            self.shown.append(source)
+
+    started, release = threading.Event(), threading.Event()
+
+    def process_recipe(input_path, *args, **kwargs):
+        started.set()
+        release.wait(2)
+        return Image.new('RGB', (4, 4))
+
+    monkeypatch.setattr(imagic.pipeline, 'process_recipe', process_recipe)
+
+    app = Harness.__new__(Harness)
+    app.shown = []
+    app.scheduler = ProcessingScheduler()
+    app.save_scheduler = ProcessingScheduler(max_workers=1)
+    app.original_image_path = 'first.png'
+    app.processed_image = None
+    app.preview_cache = None
+    app.cancel_button = SimpleNamespace(enabled=False)
+    app.process_button = SimpleNamespace(enabled=False)
+    app.download_button = SimpleNamespace(enabled=False)
+    app.progress_bar = SimpleNamespace(value=0)
+    app.status_label = SimpleNamespace(text='')
+    app.processed_image_box = SimpleNamespace(clear=lambda: None)
+    app.original_image_box = None
+    return app, started, release
+
+
+def test_upload_drops_the_previous_images_job(monkeypatch):
+    app, started, release = make_app(monkeypatch)
+
+    async def open_file_dialog(**kwargs):
+        return 'second.png'
+
+    app.main_window = SimpleNamespace(open_file_dialog=open_file_dialog)
+
+    async def main():
+        job = asyncio.ensure_future(app.run_processing(None))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        await app.handle_file_upload(None)
+        release.set()
+        return await job
+
+    assert asyncio.run(main()) is None
+    assert app.original_image_path == 'second.png'
+    assert app.processed_image is None
+    assert app.shown == ['second.png']
+
+
+def test_result_for_another_image_is_not_shown(monkeypatch):
+    app, started, release = make_app(monkeypatch)
+
+    async def main():
+        job = asyncio.ensure_future(app.run_processing(None))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        app.original_image_path = 'second.png'
+        release.set()
+        return await job
+
+    asyncio.run(main())
+    assert app.processed_image is None
+    assert app.shown == []
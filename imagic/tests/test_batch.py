@@ -0,0 +1,108 @@
+import io
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import imagic.processing
+from imagic.batch import _init_worker, _process_one, iter_inputs, main, parse_color, run_batch
+from imagic.pipeline import Recipe
+
+
+def make_inputs(directory, count=3):
+    rng = np.random.default_rng(0)
+    for index in range(count):
+        arr = rng.integers(0, 256, size=(20, 30, 3), dtype=np.uint8)
+        Image.fromarray(arr).save(directory / f'img{index}.jpg')
+    (directory / 'notes.txt').write_text('not an image')
+
+
+def test_iter_inputs_directory_and_glob(tmp_path):
+    make_inputs(tmp_path)
+    assert sorted(os.path.basename(p) for p in iter_inputs([str(tmp_path)])) == ['img0.jpg', 'img1.jpg', 'img2.jpg']
+    assert len(list(iter_inputs([str(tmp_path / 'img1.*')]))) == 1
+
+
+def test_run_batch_skips_existing_outputs(tmp_path):
+    src, out = tmp_path / 'src', tmp_path / 'out'
+    src.mkdir()
+    make_inputs(src)
+    params = dict(filter='Sepia', intensity=1.0)
+
+    log = io.StringIO()
+    assert run_batch(iter_inputs([str(src)]), str(out), 'filter', params, workers=2, out=log) == (3, 0, 0)
+    assert sorted(os.listdir(out)) == ['img0.png', 'img1.png', 'img2.png']
+    assert 'MP/s' in log.getvalue()
+
+    assert run_batch(iter_inputs([str(src)]), str(out), 'filter', params, workers=2, out=io.StringIO()) == (0, 3, 0)
+
+
+def test_run_batch_output_format(tmp_path):
+    src, out = tmp_path / 'src', tmp_path / 'out'
+    src.mkdir()
+    make_inputs(src, count=1)
+    options = dict(format='WEBP', quality=80, lossless=False)
+    run_batch(iter_inputs([str(src)]), str(out), 'filter', dict(filter='Sepia'), workers=1, out=io.StringIO(),
+              options=options)
+    assert os.listdir(out) == ['img0.webp']
+    with Image.open(out / 'img0.webp') as result:
+        assert result.format == 'WEBP'
+
+
+def test_run_batch_keeps_animation(tmp_path):
+    src, out = tmp_path / 'src', tmp_path / 'out'
+    src.mkdir()
+    frames = [Image.new('RGB', (12, 8), color) for color in ('red', 'blue', 'red')]
+    frames[0].save(src / 'anim.gif', save_all=True, append_images=frames[1:], duration=[50, 120, 80], loop=0)
+    run_batch(iter_inputs([str(src)]), str(out), 'filter', dict(filter='Negative'), workers=1, out=io.StringIO(),
+              options=dict(format='GIF'))
+    with Image.open(out / 'anim.gif') as result:
+        assert result.n_frames == 3 and result.info['loop'] == 0
+        result.seek(1)
+        assert result.info['duration'] == 120
+        assert result.convert('RGB').getpixel((0, 0)) == (255, 255, 0)
+
+
+def test_failed_save_leaves_no_partial_file(tmp_path, monkeypatch):
+    make_inputs(tmp_path, count=1)
+    out = tmp_path / 'out'
+    out.mkdir()
+
+    def save_image(img, path, **options):
+        with open(path, 'wb') as f:
+            f.write(b'truncated')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(imagic.processing, 'save_image', save_image)
+    _init_worker(Recipe.single('filter', dict(filter='Negative')), None, dict(format='PNG'))
+    with pytest.raises(OSError):
+        _process_one(str(tmp_path / 'img0.jpg'), str(out / 'img0.png'))
+    assert os.listdir(out) == []
+
+
+def test_batch_runs_recipe(tmp_path):
+    src, out = tmp_path / 'src', tmp_path / 'out'
+    src.mkdir()
+    make_inputs(src, count=1)
+    recipe = tmp_path / 'recipe.json'
+    recipe.write_text('{"steps": [{"op": "filter", "params": {"filter": "Negative"}},'
+                      ' {"op": "filter", "params": {"filter": "Grayscale"}}]}')
+    assert main(['--recipe', str(recipe), '-o', str(out), '-j', '1', str(src)]) == 0
+    with Image.open(src / 'img0.jpg') as img, Image.open(out / 'img0.png') as result:
+        expected = np.asarray(img.convert('RGB').point(lambda v: 255 - v).convert('L'))
+        assert np.abs(np.asarray(result)[..., 0].astype(int) - expected).max() <= 1
+
+
+def test_parse_color():
+    assert parse_color('10,20,30') == (10, 20, 30, 255)
+    assert parse_color('10,20,30,0') == (10, 20, 30, 0)
+
+
+def test_batch_does_not_import_gui_toolkits():
+    code = 'import sys, imagic.batch; assert not {"toga", "tkinter"} & set(sys.modules)'
+    src = os.path.join(os.path.dirname(__file__), '..', 'src')
+    env = dict(os.environ, PYTHONPATH=src)
+    subprocess.run([sys.executable, '-c', code], check=True, env=env)
@@ -0,0 +1,65 @@
+import io
+import json
+
+from imagic.bench import build_cases, compare, image_size, main, run_benchmarks
+
+
+def test_build_cases_covers_operations():
+    names = [name for name, _, _ in build_cases()]
+    assert 'remove-bg/isnet' in names
+    assert 'enhance/portrait' in names
+    assert 'filter/Edge Enhance' in names
+    assert [name for name, _, _ in build_cases(['enhance'])] == [
+        'enhance/default', 'enhance/portrait', 'enhance/sharp', 'enhance/no-sharpen'
+    ]
+
+
+def test_image_size():
+    width, height = image_size(24)
+    assert abs(width * height / 1e6 - 24) < 0.01
+
+
+def test_run_benchmarks_measures():
+    cases = [case for case in build_cases(['filter']) if case[0] in ('filter/Sepia', 'filter/Blur')]
+    out = io.StringIO()
+    results = run_benchmarks(cases, [0.05], isolate=False, out=out)
+    assert [entry['case'] for entry in results] == ['filter/Sepia', 'filter/Blur']
+    for entry in results:
+        assert entry['wall_s'] > 0
+        assert entry['cpu_s'] >= 0
+        assert entry['mp_per_s'] > 0
+    assert 'filter/Blur' in out.getvalue()
+
+
+def test_errors_are_recorded():
+    results = run_benchmarks([('bad', 'filter', dict(filter='Nope'))], [0.01], isolate=False, out=io.StringIO())
+    assert 'Unknown filter' in results[0]['error']
+
+
+def test_compare_flags_slowdowns():
+    baseline = [
+        dict(case='a', megapixels=12.0, wall_s=1.0),
+        dict(case='b', megapixels=12.0, wall_s=1.0),
+        dict(case='c', megapixels=12.0, error='boom'),
+    ]
+    results = [
+        dict(case='a', megapixels=12.01, wall_s=1.1),
+        dict(case='b', megapixels=12.0, wall_s=1.5),
+        dict(case='c', megapixels=12.0, wall_s=9.0),
+    ]
+    assert compare(results, baseline, 0.15) == [('b', 12.0, 1.0, 1.5)]
+
+
+def test_main_writes_json_and_compares(tmp_path):
+    output = tmp_path / 'results.json'
+    args = ['--ops', 'filter', '--cases', 'Negative', '--sizes', '0.05', '--no-isolate', '-o', str(output)]
+    assert main(args) == 0
+    saved = json.loads(output.read_text())
+    assert saved['results'][0]['case'] == 'filter/Negative'
+    assert 'cpu_count' in saved['machine']
+
+    # An impossibly fast baseline is a regression
+    saved['results'][0]['wall_s'] = 1e-9
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(saved))
+    assert main(args + ['--baseline', str(baseline)]) == 1
@@ -0,0 +1,79 @@
+import numpy as np
+from PIL import Image
+
+from imagic.cache import ResultCache, result_key
+from imagic.pipeline import Recipe, process_recipe
+
+
+def make_input(path, value=100):
+    Image.new('RGB', (32, 24), (value, 50, 200)).save(path)
+    return path
+
+
+def test_key_depends_on_content_and_params(tmp_path):
+    cache = ResultCache()
+    a = make_input(tmp_path / 'a.png')
+    b = make_input(tmp_path / 'b.png')
+    c = make_input(tmp_path / 'c.png', value=101)
+
+    def key(path, params, variant='full'):
+        return result_key(cache.digest(path), 'filter', params, variant)
+
+    expected = key(a, dict(filter='Sepia', intensity=1.0))
+    # Same content under another name
+    assert key(b, dict(intensity=1.0, filter='Sepia')) == expected
+    assert key(c, dict(filter='Sepia', intensity=1.0)) != expected
+    assert key(a, dict(filter='Sepia', intensity=0.5)) != expected
+    assert key(a, dict(filter='Sepia', intensity=1.0), variant='preview') != expected
+
+
+def test_colour_tuples_and_lists_match():
+    assert result_key('d', 'remove-bg', dict(bgcolor=(1, 2, 3, 255))) == result_key('d', 'remove-bg', dict(bgcolor=[1, 2, 3, 255]))
+
+
+def test_repeated_recipe_is_a_hit(tmp_path):
+    cache = ResultCache()
+    path = make_input(tmp_path / 'a.png')
+
+    first = process_recipe(path, Recipe.single('enhance', dict(color=1.2)), cache)
+    second = process_recipe(path, Recipe.single('enhance', dict(color=1.2)), cache)
+    assert second is first
+    process_recipe(path, Recipe.single('enhance', dict(color=1.3)), cache)
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 2)
+
+
+def test_memory_tier_is_bounded():
+    cache = ResultCache(max_bytes=3 * 10 * 10 * 3)
+    for index in range(5):
+        cache.put(str(index), Image.new('RGB', (10, 10)))
+    assert len(cache) == 3
+    assert cache.current_bytes == 3 * 300
+    assert cache.get('0') is None
+    assert cache.get('4') is not None
+
+
+def test_disk_tier(tmp_path):
+    disk = tmp_path / 'cache'
+    img = Image.new('RGBA', (8, 8), (10, 20, 30, 40))
+    ResultCache(disk_dir=disk).put('abc', img)
+
+    # A new cache (next session) finds the result on disk
+    cache = ResultCache(disk_dir=disk)
+    result = cache.get('abc')
+    assert result.mode == 'RGBA'
+    np.testing.assert_array_equal(np.asarray(result), np.asarray(img))
+    assert cache.stats()['disk_hits'] == 1
+    assert cache.get('abc') is result
+    assert cache.stats()['hits'] == 1
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    disk = tmp_path / 'cache'
+    cache = ResultCache(max_bytes=0, disk_dir=disk, disk_max_bytes=1)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, Image.new('RGB', (8, 8)))
+    assert [path.name for path in disk.iterdir()] == ['c.png']
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
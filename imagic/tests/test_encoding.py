@@ -0,0 +1,106 @@
+import io
+import os
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagic.encoding import adler32_combine, save, write_gif, write_png
+from imagic.formats import save_format
+from imagic.processing import save_image
+
+
+def random_image(mode, width=37, height=600):
+    rng = np.random.default_rng(0)
+    bands = len(mode)
+    shape = (height, width) if bands == 1 else (height, width, bands)
+    return Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode)
+
+
+def test_adler32_combine():
+    first, second = os.urandom(1000), os.urandom(70000)
+    assert adler32_combine(zlib.adler32(first), zlib.adler32(second), len(second)) == zlib.adler32(first + second)
+
+
+@pytest.mark.parametrize('mode', ['L', 'LA', 'RGB', 'RGBA'])
+@pytest.mark.parametrize('threads', [1, 3])
+def test_png_round_trip(mode, threads):
+    img = random_image(mode)
+    f = io.BytesIO()
+    write_png(img, f, compress_level=1, threads=threads, band_rows=64)
+    f.seek(0)
+    with Image.open(f) as result:
+        result.load()
+        assert result.mode == mode
+        assert np.array_equal(np.asarray(result), np.asarray(img))
+
+
+def test_png_keeps_icc_profile():
+    img = random_image('RGB', 8, 8)
+    img.info['icc_profile'] = b'not really a profile'
+    f = io.BytesIO()
+    save(img, f, 'PNG')
+    f.seek(0)
+    with Image.open(f) as result:
+        assert result.info['icc_profile'] == b'not really a profile'
+
+
+def test_other_png_modes_use_pillow():
+    img = random_image('L', 16, 16).convert('P')
+    f = io.BytesIO()
+    save(img, f, 'PNG')
+    f.seek(0)
+    with Image.open(f) as result:
+        assert result.mode == 'P'
+
+
+def test_jpeg_flattens_alpha_on_white():
+    img = Image.new('RGBA', (16, 16), (255, 0, 0, 0))
+    f = io.BytesIO()
+    save(img, f, 'JPEG', quality=95)
+    f.seek(0)
+    with Image.open(f) as result:
+        assert result.mode == 'RGB'
+        assert min(result.getpixel((8, 8))) > 245
+
+
+def test_webp_lossless_keeps_alpha():
+    img = random_image('RGBA', 32, 32)
+    f = io.BytesIO()
+    save(img, f, 'WEBP', lossless=True)
+    f.seek(0)
+    with Image.open(f) as result:
+        assert result.mode == 'RGBA'
+        assert np.array_equal(np.asarray(result), np.asarray(img))
+
+
+def test_gif_round_trip():
+    colors = [(255, 0, 0), (0, 128, 255), (10, 200, 30)]
+    frames = []
+    for index, color in enumerate(colors):
+        frame = Image.new('RGBA', (20, 12), color + (255,))
+        frame.paste((0, 0, 0, 0), (0, 0, 4 + index * 4, 12))
+        frames.append((frame, 100 * (index + 1)))
+    # An opaque frame, which has no transparency index
+    frames.append((Image.new('RGBA', (20, 12), (90, 60, 30, 255)), 50))
+    f = io.BytesIO()
+    write_gif(frames, f, loop=2)
+    f.seek(0)
+    with Image.open(f) as result:
+        assert result.n_frames == 4
+        assert result.info['loop'] == 2
+        for index, (frame, duration) in enumerate(frames):
+            result.seek(index)
+            assert result.info['duration'] == duration
+            arr = np.asarray(result.convert('RGBA'))
+            assert np.array_equal(arr, np.asarray(frame))
+
+
+def test_save_image_uses_extension(tmp_path):
+    img = random_image('RGB', 20, 20)
+    for name, format in [('a.png', 'PNG'), ('b.JPG', 'JPEG'), ('c.webp', 'WEBP')]:
+        path = save_image(img, str(tmp_path / name), quality=80)
+        with Image.open(path) as result:
+            assert result.format == format
+    assert save_format('noextension') == 'PNG'
@@ -0,0 +1,138 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+
+from imagic.cache import StageCache
+from imagic.enhance import enhance, enhance_eyes
+from imagic.instrument import format_report
+
+EXAMPLE = Path(__file__).parent.parent / 'examples' / 'Taylor-Swift.jpg'
+
+# A 320 px copy of the example and the output of the original PIL /
+# scikit-image enhancement code on it
+DATA = Path(__file__).parent / 'data'
+
+
+def reference(name):
+    with Image.open(DATA / f'{name}.png') as img:
+        return np.asarray(img.convert('RGB')).astype(int)
+
+
+def reference_enhance(img, color=1.2, contrast=1.1, brightness=1.1, sharpness=1.3):
+    """The original PIL chain, without the portrait steps"""
+    img = img.filter(ImageFilter.MedianFilter(size=3))
+    img = ImageEnhance.Color(img).enhance(color)
+    img = ImageEnhance.Brightness(img).enhance(brightness)
+    img = ImageEnhance.Contrast(img).enhance(contrast)
+    if sharpness > 1.0:
+        img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
+        if sharpness > 1.5:
+            img = img.filter(ImageFilter.EDGE_ENHANCE)
+    return img
+
+
+@pytest.fixture(scope='module')
+def photo():
+    with Image.open(EXAMPLE) as img:
+        img.thumbnail((640, 640))
+        return img.convert('RGB')
+
+
+@pytest.fixture(scope='module')
+def portrait():
+    with Image.open(DATA / 'portrait.png') as img:
+        return img.convert('RGB')
+
+
+@pytest.mark.parametrize('params', [
+    dict(),
+    dict(sharpness=0.5),
+    dict(color=0.5, contrast=1.6, brightness=0.8),
+    dict(color=1.8, contrast=0.7, brightness=1.3, sharpness=1.0),
+    dict(sharpness=1.8),
+])
+def test_matches_pil_chain(photo, params):
+    expected = np.asarray(reference_enhance(photo, **params)).astype(int)
+    result = np.asarray(enhance(photo, **params)).astype(int)
+    # PIL leaves the border unfiltered, so compare the interior
+    diff = np.abs(expected - result)[4:-4, 4:-4]
+    assert diff.mean() <= 1.0
+
+
+@pytest.mark.parametrize('params, name, tolerance', [
+    (dict(portrait=True), 'portrait-enhanced', 1.0),
+    (dict(portrait=True, sharpness=1.8), 'portrait-enhanced-sharp', 2.5),
+])
+def test_portrait_matches_pil_chain(portrait, params, name, tolerance):
+    expected = reference(name)
+    result = np.asarray(enhance(portrait, **params)).astype(int)
+    diff = np.abs(expected - result)[4:-4, 4:-4]
+    assert diff.mean() <= tolerance
+
+
+def test_alpha_preserved_and_report(photo):
+    img = photo.convert('RGBA')
+    img.putalpha(128)
+    report = []
+    result = enhance(img, sharpness=1.8, report=report)
+    assert result.mode == 'RGBA'
+    assert np.all(np.asarray(result.getchannel('A')) == 128)
+    assert [entry['stage'] for entry in report] == ['decode', 'median', 'tone', 'unsharp', 'edge', 'encode']
+    assert 'unsharp' in format_report(report)
+
+
+def test_enhance_eyes_matches_float_lab(portrait):
+    expected = reference('portrait-eyes')
+    diff = np.abs(expected - np.asarray(enhance_eyes(portrait)).astype(int))
+    assert diff.mean() <= 0.5 and diff.max() <= 1
+
+    # The 25% blend of the portrait path
+    expected = np.asarray(Image.blend(portrait, Image.fromarray(expected.astype(np.uint8)), 0.25)).astype(int)
+    diff = np.abs(expected - np.asarray(enhance_eyes(portrait, amount=0.25)).astype(int))
+    assert diff.mean() <= 0.25 and diff.max() <= 1
+
+
+def test_enhance_eyes_keeps_alpha(photo):
+    img = photo.convert('RGBA')
+    img.putalpha(99)
+    result = enhance_eyes(img)
+    assert result.mode == 'RGBA'
+    assert np.all(np.asarray(result.getchannel('A')) == 99)
+
+
+def stages_run(report):
+    return [entry['stage'] for entry in report if entry['stage'] not in ('decode', 'encode')]
+
+
+@pytest.mark.parametrize('changes, expected', [
+    (dict(sharpness=1.8), ['unsharp', 'edge']),
+    (dict(contrast=1.4), ['tone', 'unsharp']),
+    (dict(portrait=False), ['tone', 'unsharp']),
+    (dict(), ['unsharp']),
+])
+def test_stage_cache_reruns_changed_stages(photo, changes, expected):
+    params = dict(portrait=True)
+    stage_cache = StageCache()
+    enhance(photo, stage_cache=stage_cache, **params)
+    assert len(stage_cache) == 3
+
+    params.update(changes)
+    report = []
+    result = enhance(photo, report=report, stage_cache=stage_cache, **params)
+    assert stages_run(report) == expected
+    assert np.array_equal(np.asarray(result), np.asarray(enhance(photo, **params)))
+
+
+def test_stage_cache_is_bounded(photo):
+    stage_cache = StageCache(max_bytes=np.asarray(photo).nbytes * 2)
+    enhance(photo, stage_cache=stage_cache, portrait=True)
+    assert len(stage_cache) == 2
+    report = []
+    enhance(photo, report=report, stage_cache=stage_cache, portrait=True, sharpness=1.8)
+    assert stages_run(report) == ['unsharp', 'edge']
+    # Another image does not match the cached stages
+    report = []
+    enhance(photo.rotate(180), report=report, stage_cache=stage_cache)
+    assert stages_run(report)[0] == 'median'
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagic.filters import FILTERS, PREMULTIPLIED_MODES, apply_filter
+
+
+def make_image(mode='RGB', size=(32, 24)):
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    img = Image.fromarray(arr)
+    if mode in PREMULTIPLIED_MODES:
+        img = img.convert(PREMULTIPLIED_MODES[mode])
+    return img.convert(mode)
+
+
+def test_sepia_matches_reference_formula():
+    img = make_image()
+    result = np.asarray(apply_filter(img, 'Sepia')).astype(int)
+
+    r, g, b = np.moveaxis(np.asarray(img).astype(float), 2, 0)
+    expected = np.stack([
+        np.minimum(0.393 * r + 0.769 * g + 0.189 * b, 255),
+        np.minimum(0.349 * r + 0.686 * g + 0.168 * b, 255),
+        np.minimum(0.272 * r + 0.534 * g + 0.131 * b, 255),
+    ], axis=2)
+    assert np.abs(result - expected).max() <= 1
+
+
+@pytest.mark.parametrize('filter_type', FILTERS)
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'L', 'P', 'LA', 'La', 'RGBa', 'CMYK'])
+def test_filters_accept_any_mode(filter_type, mode):
+    img = make_image(mode)
+    result = apply_filter(img, filter_type, 1.0)
+    assert result.size == img.size
+    assert result.mode == ('RGBA' if mode in ('RGBA', 'LA', 'La', 'RGBa') else 'RGB')
+
+
+def test_alpha_is_preserved():
+    img = make_image('RGBA')
+    img.putalpha(77)
+    result = apply_filter(img, 'Negative')
+    assert np.all(np.asarray(result.getchannel('A')) == 77)
+
+
+@pytest.mark.parametrize('filter_type', ['Grayscale', 'Sepia', 'Emboss', 'Edge Enhance', 'Negative'])
+def test_zero_intensity_returns_original(filter_type):
+    img = make_image()
+    result = apply_filter(img, filter_type, 0.0)
+    assert np.array_equal(np.asarray(result), np.asarray(img))
+
+
+def test_negative_and_posterize_luts():
+    img = make_image()
+    arr = np.asarray(img)
+    assert np.array_equal(np.asarray(apply_filter(img, 'Negative')), 255 - arr)
+    # intensity 1.0 keeps 5 bits
+    assert np.array_equal(np.asarray(apply_filter(img, 'Posterize', 1.0)), arr & 0xF8)
+
+
+def test_unknown_filter():
+    with pytest.raises(ValueError):
+        apply_filter(make_image(), 'Oil Paint')
@@ -0,0 +1,119 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from imagic.inference import (InferenceBatcher, disable_batching, enable_batching, get_batcher, postprocess,
+                              predict_batch, preprocess)
+from imagic.sessions import SessionPool
+
+
+class FakeInner:
+    """ONNX session stand-in: the prediction is the mean of the input channels"""
+
+    def __init__(self, batch_dim='batch'):
+        self.batch_dim = batch_dim
+        self.runs = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='input.1', shape=[self.batch_dim, 3, 320, 320])]
+
+    def run(self, outputs, feeds):
+        tensor = feeds['input.1']
+        self.runs.append(len(tensor))
+        return [tensor.mean(axis=1, keepdims=True)]
+
+
+class FakePool(SessionPool):
+    def __init__(self, batch_dim='batch'):
+        super().__init__(num_threads=1)
+        self.inner = FakeInner(batch_dim)
+
+    def _create(self, model):
+        return SimpleNamespace(inner_session=self.inner)
+
+
+def gradient(width, height):
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    arr = np.repeat(x[np.newaxis, :, np.newaxis], height, axis=0).repeat(3, axis=2)
+    return Image.fromarray(arr.astype(np.uint8))
+
+
+def test_preprocess_matches_rembg_normalize():
+    img = gradient(500, 300)
+    mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+    resized = np.array(img.resize((320, 320), Image.Resampling.LANCZOS)) / 255.0
+    expected = ((resized - mean) / std).transpose(2, 0, 1)
+    result = preprocess(img, 'u2net')
+    assert result.shape == (3, 320, 320)
+    assert result.dtype == np.float32
+    assert np.abs(result - expected).max() < 1e-5
+
+
+def test_postprocess_scales_and_resizes():
+    mask = postprocess(np.array([[2.0, 4.0], [4.0, 6.0]], dtype=np.float32), (8, 8))
+    assert mask.mode == 'L'
+    assert mask.size == (8, 8)
+    arr = np.asarray(mask)
+    assert arr.min() == 0 and arr.max() == 255
+
+
+def test_predict_batch_runs_once():
+    pool = FakePool()
+    images = [gradient(200, 100), gradient(50, 80).transpose(Image.Transpose.FLIP_LEFT_RIGHT)]
+    masks = predict_batch(pool.get('u2net'), images, 'u2net')
+    assert pool.inner.runs == [2]
+    assert [mask.size for mask in masks] == [(200, 100), (50, 80)]
+    # Each mask follows its own image
+    assert np.asarray(masks[0])[50, 190] > np.asarray(masks[0])[50, 10]
+    assert np.asarray(masks[1])[40, 45] < np.asarray(masks[1])[40, 5]
+
+
+def test_fixed_batch_model_runs_per_image():
+    pool = FakePool(batch_dim=1)
+    predict_batch(pool.get('u2net'), [gradient(64, 64)] * 3, 'u2net')
+    assert pool.inner.runs == [1, 1, 1]
+
+
+def test_batcher_groups_concurrent_requests():
+    pool = FakePool()
+    batcher = InferenceBatcher('u2net', max_batch=3, max_wait=0.5, pool=pool)
+    masks = []
+    threads = [threading.Thread(target=lambda: masks.append(batcher.predict(gradient(64, 32)))) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert len(masks) == 6
+    assert sum(pool.inner.runs) == 6
+    assert max(pool.inner.runs) <= 3
+    assert batcher.batches < 6
+
+
+def test_batcher_wait_is_bounded():
+    pool = FakePool()
+    pool.get('u2net')
+    batcher = InferenceBatcher('u2net', max_batch=8, max_wait=0.05, pool=pool)
+    start = time.perf_counter()
+    batcher.predict(gradient(32, 32))
+    assert time.perf_counter() - start < 1
+    assert pool.inner.runs == [1]
+    batcher.close()
+
+
+def test_batching_is_off_until_enabled():
+    assert get_batcher('u2net') is None
+    enable_batching(3)
+    try:
+        batcher = get_batcher('u2net')
+        assert batcher is get_batcher('u2net')
+        assert batcher.max_batch == 3
+        # Models without a known preprocessing run their own session
+        assert get_batcher('birefnet-general') is None
+    finally:
+        disable_batching()
+    assert get_batcher('u2net') is None
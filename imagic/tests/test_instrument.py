@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagic import instrument
+from imagic.enhance import enhance
+from imagic.instrument import Stages, collect_spans, format_spans, span
+from imagic.processing import run_operation
+
+
+@pytest.fixture
+def tracing(tmp_path, monkeypatch):
+    path = tmp_path / 'trace.jsonl'
+    monkeypatch.setenv('IMAGIC_TRACE_FILE', str(path))
+    instrument.enable()
+    yield path
+    instrument.disable()
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_disabled_span_is_free():
+    instrument.disable()
+    assert span('a') is span('b', Image.new('RGB', (4, 4)))
+    _, spans = collect_spans(lambda: None)
+    assert spans == []
+
+
+def test_spans_are_written_as_json_lines(tracing):
+    with span('outer', Image.new('RGB', (40, 30)), op='test'):
+        with span('inner', np.zeros((20, 10, 3))):
+            buffer = np.ones(1_000_000, dtype=np.uint8)
+        del buffer
+
+    inner, outer = read_lines(tracing)
+    assert inner['span'] == 'inner' and inner['depth'] == 1
+    assert (inner['width'], inner['height']) == (10, 20)
+    assert inner['alloc_bytes'] >= 1_000_000
+    assert outer['span'] == 'outer' and outer['depth'] == 0 and outer['op'] == 'test'
+    assert (outer['width'], outer['height']) == (40, 30)
+    # The enclosing span sees the peak of its children
+    assert outer['peak_bytes'] >= 1_000_000
+    assert outer['ms'] >= inner['ms']
+
+
+def test_collect_spans_from_operation(tracing):
+    img = Image.new('RGB', (64, 48), 'gray')
+    result, spans = collect_spans(run_operation, img, 'enhance', portrait=True)
+    assert result.size == img.size
+    names = [entry['span'] for entry in spans]
+    assert names[-1] == 'enhance'
+    assert 'enhance.median' in names and 'enhance.tone' in names
+
+    text = format_spans(spans)
+    assert text.splitlines()[0].startswith('enhance:')
+    assert '  enhance.median:' in text
+
+
+def test_stage_report_without_tracing():
+    instrument.disable()
+    report = []
+    enhance(Image.new('RGB', (32, 32)), report=report)
+    assert [entry['stage'] for entry in report][0] == 'decode'
+    assert all(entry['seconds'] >= 0 and entry['peak_bytes'] >= 0 for entry in report)
+
+
+def test_stages_pass_through_when_off():
+    instrument.disable()
+    stages = Stages(None)
+    assert stages.run('x', lambda a: a + 1, 1) == 2
+    stages.close()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from imagic.kernels import convolve, gaussian_blur, kernel_filter, median, pil_kernel, run_chunks
+
+
+@pytest.fixture
+def noise():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(300, 70, 3), dtype=np.uint8)
+
+
+def run(func, src, *args):
+    dst = np.empty_like(src)
+    func(src, dst, *args)
+    return dst
+
+
+@pytest.mark.parametrize('filter', [ImageFilter.EMBOSS, ImageFilter.EDGE_ENHANCE_MORE, ImageFilter.CONTOUR])
+def test_kernel_filter_matches_pil(noise, filter):
+    expected = np.asarray(Image.fromarray(noise).filter(filter))
+    assert np.array_equal(run(kernel_filter, noise, *pil_kernel(filter)), expected)
+
+
+def test_median_matches_pil(noise):
+    expected = np.asarray(Image.fromarray(noise).filter(ImageFilter.MedianFilter(3)))
+    assert np.array_equal(run(median, noise), expected)
+
+
+@pytest.mark.parametrize('radius, max_diff, mean_diff', [(1, 3, 0.6), (2, 2, 0.2), (5, 1, 0.2)])
+def test_gaussian_blur_matches_pil(noise, radius, max_diff, mean_diff):
+    # The fractional box taps are rounded to 1/128, which shows most on
+    # small radii and pure noise
+    expected = np.asarray(Image.fromarray(noise).filter(ImageFilter.GaussianBlur(radius))).astype(int)
+    diff = np.abs(run(gaussian_blur, noise, radius).astype(int) - expected)
+    assert diff.max() <= max_diff
+    assert diff.mean() < mean_diff
+
+
+def test_threads_do_not_change_results(noise, monkeypatch):
+    kernel, scale, offset = pil_kernel(ImageFilter.EMBOSS)
+    cases = [
+        (median, ()),
+        (gaussian_blur, (3,)),
+        (kernel_filter, (kernel, scale, offset)),
+        (convolve, (np.ones((5, 5), dtype=np.float32), 1 / 25)),
+    ]
+    monkeypatch.setenv('IMAGIC_FILTER_THREADS', '1')
+    expected = [run(func, noise, *args) for func, args in cases]
+    monkeypatch.setenv('IMAGIC_FILTER_THREADS', '4')
+    for (func, args), single in zip(cases, expected):
+        assert np.array_equal(run(func, noise, *args), single), func.__name__
+
+
+def test_run_chunks_covers_range_and_raises(monkeypatch):
+    monkeypatch.setenv('IMAGIC_FILTER_THREADS', '3')
+    seen = []
+    run_chunks(lambda start, stop: seen.append((start, stop)), 300, 128)
+    assert sorted(seen) == [(0, 128), (128, 256), (256, 300)]
+
+    def fail(start, stop):
+        if start:
+            raise RuntimeError('band failed')
+
+    with pytest.raises(RuntimeError):
+        run_chunks(fail, 300, 128)
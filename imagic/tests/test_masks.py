@@ -0,0 +1,188 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagic.masks import (MaskCache, composite, cutout, fill_background, get_mask_cache, guided_upsample,
+                          image_digest, reduced_image, refine_mask, trimap)
+from imagic.processing import remove_background
+
+
+@pytest.fixture
+def image_and_mask():
+    rng = np.random.default_rng(1)
+    img = Image.fromarray(rng.integers(0, 256, (40, 60, 3), dtype=np.uint8))
+    mask = Image.fromarray(rng.integers(0, 256, (40, 60), dtype=np.uint8))
+    return img, mask
+
+
+def test_cutout_uses_mask_as_alpha(image_and_mask):
+    img, mask = image_and_mask
+    rgba = np.asarray(cutout(img, mask))
+    np.testing.assert_array_equal(rgba[..., :3], np.asarray(img))
+    np.testing.assert_array_equal(rgba[..., 3], np.asarray(mask))
+
+
+def test_cutout_keeps_existing_alpha(image_and_mask):
+    img, mask = image_and_mask
+    half = img.convert('RGBA')
+    half.putalpha(128)
+    expected = (128 * np.asarray(mask).astype(int) + 127) // 255
+    np.testing.assert_array_equal(np.asarray(cutout(half, mask))[..., 3], expected)
+
+
+@pytest.mark.parametrize('bgcolor', [(255, 0, 0, 255), (10, 200, 30, 128), (0, 0, 0, 0)])
+def test_fill_over_colour(image_and_mask, bgcolor):
+    img, mask = image_and_mask
+    result = np.asarray(fill_background(cutout(img, mask), bgcolor)).astype(float)
+    alpha = np.asarray(mask, dtype=float)[..., None] / 255
+    bg_alpha = bgcolor[3] / 255
+    out_alpha = alpha + bg_alpha * (1 - alpha)
+    expected = (np.asarray(img) * alpha + np.array(bgcolor[:3]) * bg_alpha * (1 - alpha)) / np.maximum(out_alpha, 1e-6)
+    visible = out_alpha[..., 0] > 0.1
+    assert np.abs(result[..., :3] - expected)[visible].max() <= 2
+    assert np.abs(result[..., 3:] - out_alpha * 255).max() <= 1
+
+
+def test_composite_opaque_fill(image_and_mask):
+    img, mask = image_and_mask
+    result = composite(img, mask, (0, 0, 255, 255))
+    assert result.mode == 'RGBA'
+    alpha = np.asarray(mask, dtype=np.float32)[..., None] / 255
+    expected = np.asarray(img) * alpha + np.array([0, 0, 255]) * (1 - alpha)
+    assert np.abs(np.asarray(result)[..., :3] - expected).max() <= 0.5 + 1e-3
+    assert (np.asarray(result)[..., 3] == 255).all()
+
+
+def test_mask_cache_computes_once(image_and_mask):
+    img, mask = image_and_mask
+    cache = MaskCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return mask
+
+    key = (image_digest(img), 'u2net')
+    assert cache.get_or_compute(key, compute) is mask
+    assert cache.get_or_compute(key, compute) is mask
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_image_digest_depends_on_pixels(image_and_mask):
+    img, _ = image_and_mask
+    other = img.copy()
+    other.putpixel((0, 0), (1, 2, 3))
+    assert image_digest(img) == image_digest(img.copy())
+    assert image_digest(img) != image_digest(other)
+
+
+def step_image(width, height):
+    """Dark left half, bright textured right half, and its ideal mask"""
+    rng = np.random.default_rng(2)
+    arr = np.full((height, width, 3), 30, dtype=np.uint8)
+    arr[:, width // 2:] = rng.integers(200, 256, (height, width - width // 2, 3))
+    mask = np.zeros((height, width), dtype=np.uint8)
+    mask[:, width // 2:] = 255
+    return Image.fromarray(arr), mask
+
+
+def test_guided_upsample_follows_edges():
+    full, ideal = step_image(1203, 800)
+    small = full.resize((150, 100), Image.Resampling.BOX)
+    small_mask = Image.fromarray(ideal).resize(small.size, Image.Resampling.BILINEAR)
+
+    guided = np.asarray(guided_upsample(small_mask, small, full)).astype(int)
+    plain = np.asarray(small_mask.resize(full.size, Image.Resampling.BILINEAR)).astype(int)
+    assert guided.shape == ideal.shape
+    assert np.abs(guided - ideal).mean() < np.abs(plain - ideal).mean() * 0.75
+
+
+def test_reduced_image_decodes_small(tmp_path):
+    path = tmp_path / 'big.jpg'
+    step_image(3000, 2000)[0].save(path, quality=90)
+    with Image.open(path) as img:
+        img.load()
+        small = reduced_image(img, 1024)
+    assert small.size == (1024, 683)
+    assert small.mode == 'RGB'
+
+
+def test_fast_mode_reports_stages(tmp_path):
+    path = tmp_path / 'big.jpg'
+    full, ideal = step_image(2400, 1600)
+    full.save(path, quality=95)
+    with Image.open(path) as img:
+        img.load()
+        small = reduced_image(img)
+        # A mask already in the cache skips the network
+        small_mask = Image.fromarray(ideal).resize(small.size)
+        get_mask_cache().get_or_compute((image_digest(small), img.size, 'u2net', 'fast'), lambda: small_mask)
+
+        report = []
+        result = remove_background(img, bgcolor=(0, 0, 255, 255), fast=True, report=report)
+
+    assert result.size == full.size
+    assert [entry['stage'] for entry in report] == ['decode', 'segment', 'upsample', 'composite']
+    arr = np.asarray(result)
+    # Left of the edge is background (blue), right keeps the image
+    assert (arr[:, :1100, 2] > 240).mean() > 0.99
+    assert (arr[:, 1300:, 0] > 190).mean() > 0.99
+
+
+def soft_edge_image(width, height):
+    """Two colours blended by a wavy, soft-edged disc, and that blend as the ideal alpha"""
+    yy, xx = np.mgrid[0:height, 0:width]
+    radius = np.hypot(xx - width / 2, yy - height / 2)
+    edge = height / 3 + height / 40 * np.sin(np.arctan2(yy - height / 2, xx - width / 2) * 40)
+    alpha = np.clip((edge - radius) / (height / 100) + 0.5, 0, 1)
+    arr = alpha[..., np.newaxis] * [220, 180, 140] + (1 - alpha[..., np.newaxis]) * [40, 90, 160]
+    return Image.fromarray(arr.astype(np.uint8)), alpha * 255
+
+
+def test_trimap_erodes_certain_regions():
+    mask = np.zeros((50, 50), dtype=np.uint8)
+    mask[:, 25:] = 255
+    fg, bg = trimap(mask, erode_size=3)
+    assert fg[:, 28:].all() and not fg[:, :28].any()
+    assert bg[:, :22].all() and not bg[:, 22:].any()
+
+
+def test_refine_mask_recovers_soft_edges():
+    img, ideal = soft_edge_image(1600, 1200)
+    # A segmentation from a 320 px network, scaled up: right shape, blurry edges
+    coarse = Image.fromarray(ideal.astype(np.uint8)).resize((320, 240), Image.Resampling.BOX).resize(img.size)
+    coarse_error = np.abs(np.asarray(coarse) - ideal)
+    refined = np.asarray(refine_mask(img, coarse)).astype(float)
+    refined_error = np.abs(refined - ideal)
+
+    band = (ideal > 5) & (ideal < 250)
+    assert refined_error[band].mean() < coarse_error[band].mean() * 0.6
+    # Certain regions keep the mask's value
+    fg, bg = trimap(np.asarray(coarse))
+    assert np.array_equal(refined[fg | bg], np.asarray(coarse)[fg | bg])
+
+
+def test_refine_mask_other_modes_match_rgb():
+    img, ideal = soft_edge_image(400, 300)
+    coarse = Image.fromarray(ideal.astype(np.uint8)).resize((80, 60), Image.Resampling.BOX).resize(img.size)
+    expected = np.asarray(refine_mask(img, coarse))
+    rgba = img.convert('RGBA')
+    rgba.putalpha(128)
+    assert np.array_equal(np.asarray(refine_mask(rgba, coarse)), expected)
+
+
+def test_refine_mask_without_uncertain_band():
+    mask = Image.new('L', (40, 30), 255)
+    assert refine_mask(Image.new('RGB', (40, 30)), mask) is mask
+
+
+def test_refine_edges_stage():
+    img, _ = soft_edge_image(320, 240)
+    coarse = Image.fromarray(np.asarray(img.convert('L')) > 100)
+    get_mask_cache().get_or_compute((image_digest(img), 'u2net'), lambda: coarse.convert('L'))
+    report = []
+    result = remove_background(img, refine_edges=True, report=report)
+    assert [entry['stage'] for entry in report] == ['segment', 'refine', 'composite']
+    alpha = np.asarray(result.getchannel('A'))
+    assert 0 < ((alpha > 0) & (alpha < 255)).sum()
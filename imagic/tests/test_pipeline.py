@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagic.cache import ResultCache, StageCache
+from imagic.enhance import enhance
+from imagic.filters import apply_filter
+from imagic.pipeline import Recipe, execute, plan, process_recipe, run_recipe
+
+
+def make_image(size=(48, 32)):
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8))
+
+
+def test_params_are_filled_and_coerced():
+    recipe = Recipe().add('filter', dict(filter='Sepia', intensity='0.5')).add('remove-bg', dict(bgcolor=[1, 2, 3]))
+    assert recipe.steps[0] == dict(op='filter', params=dict(filter='Sepia', intensity=0.5))
+    assert recipe.steps[1]['params']['bgcolor'] == (1, 2, 3, 255)
+    assert recipe.steps[1]['params']['fast'] is False
+
+
+@pytest.mark.parametrize('op, params', [
+    ('sharpen', {}),
+    ('filter', dict(filter='Oil Paint')),
+    ('filter', dict(radius=2)),
+    ('enhance', dict(color=-1)),
+    ('enhance', dict(portrait='yes')),
+])
+def test_invalid_steps(op, params):
+    with pytest.raises(ValueError):
+        Recipe().add(op, params)
+
+
+def test_json_round_trip(tmp_path):
+    recipe = Recipe(name='Warm').add('enhance', dict(portrait=True)).add('filter', dict(filter='Sepia'))
+    path = tmp_path / 'recipe.json'
+    recipe.save(path)
+    loaded = Recipe.load(path)
+    assert loaded == recipe
+    assert loaded.name == 'Warm'
+    assert loaded.describe() == 'enhance → filter'
+
+
+def test_point_steps_are_fused():
+    recipe = Recipe()
+    for name in ['Sepia', 'Negative', 'Posterize', 'Blur', 'Grayscale']:
+        recipe.add('filter', dict(filter=name, intensity=0.7))
+    recipe.add('enhance')
+    assert [stop for stop, _ in plan(recipe)] == [3, 4, 5, 6]
+
+    img = make_image()
+    expected = img
+    for name in ['Sepia', 'Negative', 'Posterize', 'Blur', 'Grayscale']:
+        expected = apply_filter(expected, name, 0.7)
+    expected = enhance(expected)
+    assert np.array_equal(np.asarray(run_recipe(img, recipe)), np.asarray(expected))
+
+
+def test_shared_prefix_is_reused():
+    cache = ResultCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return make_image()
+
+    first = Recipe().add('enhance').add('filter', dict(filter='Blur'))
+    second = Recipe().add('enhance').add('filter', dict(filter='Sepia'))
+    execute(first, load, cache, 'source')
+    # The second recipe starts from the cached enhance result
+    result = execute(second, load, cache, 'source')
+    assert loads == [1]
+    assert np.array_equal(np.asarray(result), np.asarray(apply_filter(enhance(make_image()), 'Sepia')))
+
+    # Repeating a recipe is a hit; prefix probes are not counted
+    execute(first, load, cache, 'source')
+    assert loads == [1]
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_staged_step_resumes_from_cached_stages():
+    cache, stage_cache = ResultCache(), StageCache()
+    execute(Recipe().add('enhance'), make_image, cache, 'source', stage_cache=stage_cache)
+    assert (stage_cache.hits, stage_cache.misses) == (0, 1)
+
+    recipe = Recipe().add('enhance', dict(sharpness=1.8))
+    result = execute(recipe, make_image, cache, 'source', stage_cache=stage_cache)
+    assert stage_cache.hits == 1
+    assert np.array_equal(np.asarray(result), np.asarray(enhance(make_image(), sharpness=1.8)))
+
+
+def test_process_recipe(tmp_path):
+    path = tmp_path / 'in.png'
+    make_image().save(path)
+    recipe = Recipe().add('filter', dict(filter='Negative'))
+    result = process_recipe(path, recipe, ResultCache())
+    assert np.array_equal(np.asarray(result), 255 - np.asarray(make_image()))
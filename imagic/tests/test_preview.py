@@ -0,0 +1,29 @@
+from PIL import Image
+
+from imagic.cache import ResultCache
+from imagic.pipeline import Recipe
+from imagic.preview import ProxyCache, render_recipe_preview
+
+
+def test_proxy_limits_long_edge(tmp_path):
+    path = tmp_path / 'big.jpg'
+    Image.new('RGB', (3000, 1500), (200, 100, 50)).save(path)
+    cache = ProxyCache(max_size=1024)
+    assert cache.get(path).size == (1024, 512)
+    assert cache.get(path) is cache.get(path)
+
+
+def test_render_recipe_preview_on_proxy(tmp_path):
+    path = tmp_path / 'big.png'
+    Image.new('RGB', (2048, 1024), (200, 100, 50)).save(path)
+    proxies = ProxyCache(max_size=256)
+    cache = ResultCache()
+    recipe = Recipe.single('filter', dict(filter='Grayscale', intensity=1.0))
+
+    result = render_recipe_preview(proxies, path, recipe, cache)
+    assert result.size == (256, 128)
+    r, g, b = result.getpixel((10, 10))
+    assert r == g == b
+    # A repeated request comes from the result cache
+    assert render_recipe_preview(proxies, path, recipe, cache) is result
+    assert cache.stats()['hits'] == 1
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+import pytest
+
+from imagic.scheduler import JobCancelled, ProcessingScheduler, checkpoint
+
+
+def slow_job(started, release, value):
+    started.set()
+    release.wait(2)
+    checkpoint(0.5, 'halfway')
+    return value
+
+
+def test_result_and_progress():
+    progress = []
+
+    def job():
+        checkpoint(0.5, 'halfway')
+        return 42
+
+    async def main():
+        scheduler = ProcessingScheduler(on_progress=lambda f, m: progress.append((f, m)))
+        result = await scheduler.run(job)
+        await asyncio.sleep(0)  # let the queued progress callback run
+        assert not scheduler.busy
+        return result
+
+    assert asyncio.run(main()) == 42
+    assert progress == [(0.5, 'halfway')]
+
+
+def test_new_job_supersedes_running_job():
+    async def main():
+        scheduler = ProcessingScheduler()
+        started, release = threading.Event(), threading.Event()
+        first = asyncio.ensure_future(scheduler.run(slow_job, started, release, 'old'))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+
+        second = asyncio.ensure_future(scheduler.run(lambda: 'new'))
+        release.set()
+        with pytest.raises(JobCancelled):
+            await first
+        assert await second == 'new'
+
+    asyncio.run(main())
+
+
+def test_cancel_stops_job_at_checkpoint():
+    async def main():
+        scheduler = ProcessingScheduler()
+        started, release = threading.Event(), threading.Event()
+        task = asyncio.ensure_future(scheduler.run(slow_job, started, release, 'value'))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        scheduler.cancel()
+        release.set()
+        with pytest.raises(JobCancelled):
+            await task
+        assert not scheduler.busy
+
+    asyncio.run(main())
+
+
+def test_errors_propagate():
+    def broken():
+        raise RuntimeError('boom')
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await ProcessingScheduler().run(broken)
+
+    asyncio.run(main())
+
+
+def test_checkpoint_outside_scheduler_is_noop():
+    checkpoint(0.5, 'ignored')
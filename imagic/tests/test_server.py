@@ -0,0 +1,159 @@
+import asyncio
+import io
+import json
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagic.pipeline import STEPS, Param, StepType
+from imagic.scheduler import checkpoint
+from imagic.server import MAX_BODY_BYTES, ImagicServer, Metrics, parse_params
+
+
+def image_bytes(size=(40, 30)):
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+async def request(port, method, target, body=b'', length=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    length = len(body) if length is None else length
+    writer.write(f'{method} {target} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {length}\r\n\r\n'.encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    lines = head.decode().split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, payload
+
+
+def serve(scenario, **options):
+    async def main():
+        server = ImagicServer(port=0, preload=(), **options)
+        await server.start()
+        try:
+            return await scenario(server)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def slow_step(monkeypatch):
+    def run(img, seconds=0.0):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            checkpoint()
+            time.sleep(0.01)
+        return img
+    monkeypatch.setitem(STEPS, 'slow', StepType('slow', [Param('seconds', float, 0.0)], run))
+
+
+def test_filter_endpoint_returns_encoded_image():
+    async def scenario(server):
+        status, headers, payload = await request(server.port, 'POST', '/filter?filter=Negative&format=webp&lossless=1',
+                                                 image_bytes())
+        assert status == 200
+        assert headers['Content-Type'] == 'image/webp'
+        with Image.open(io.BytesIO(payload)) as result, Image.open(io.BytesIO(image_bytes())) as original:
+            assert np.array_equal(np.asarray(result), 255 - np.asarray(original))
+
+        status, _, payload = await request(server.port, 'GET', '/metrics')
+        metrics = json.loads(payload)
+        assert status == 200
+        assert metrics['completed'] == 1 and metrics['queue_depth'] == 0
+        assert metrics['latency_ms']['p50'] > 0
+    serve(scenario, workers=1)
+
+
+@pytest.mark.parametrize('method, target, body, expected', [
+    ('POST', '/sharpen', b'x', 404),
+    ('GET', '/filter', b'', 405),
+    ('POST', '/filter?filter=Oil', b'x', 400),
+    ('POST', '/filter?radius=2', b'x', 400),
+    ('POST', '/filter?format=jpeg&quality=500', b'x', 400),
+    ('POST', '/filter?compress_level=10', b'x', 400),
+    ('POST', '/filter', b'not an image', 400),
+    ('POST', '/filter', b'', 400),
+])
+def test_bad_requests(method, target, body, expected):
+    async def scenario(server):
+        status, _, payload = await request(server.port, method, target, body)
+        assert status == expected
+        assert 'error' in json.loads(payload)
+    serve(scenario, workers=1)
+
+
+@pytest.mark.parametrize('length, expected', [
+    ('abc', 400),
+    ('-5', 400),
+    (str(MAX_BODY_BYTES + 1), 413),
+])
+def test_bad_content_length(length, expected):
+    async def scenario(server):
+        status, _, payload = await request(server.port, 'POST', '/filter', length=length)
+        assert status == expected
+        assert 'error' in json.loads(payload)
+    serve(scenario, workers=1)
+
+
+def test_full_queue_is_rejected(slow_step):
+    async def scenario(server):
+        # One request running, one waiting in the queue
+        slow = []
+        for _ in range(2):
+            slow.append(asyncio.create_task(request(server.port, 'POST', '/slow?seconds=0.5', image_bytes())))
+            await asyncio.sleep(0.1)
+        assert (server.in_flight, server._queue.qsize()) == (1, 1)
+        status, headers, _ = await request(server.port, 'POST', '/slow', image_bytes())
+        assert status == 503
+        assert headers['Retry-After'] == '1'
+        assert [result[0] for result in await asyncio.gather(*slow)] == [200, 200]
+        assert server.metrics.rejected == 1
+    serve(scenario, workers=1, queue_size=1)
+
+
+def test_timeout_cancels_job(slow_step):
+    async def scenario(server):
+        status, _, _ = await request(server.port, 'POST', '/slow?seconds=5', image_bytes())
+        assert status == 504
+        assert server.metrics.timed_out == 1
+        # The worker is freed at the job's next checkpoint
+        status, _, _ = await request(server.port, 'POST', '/slow', image_bytes())
+        assert status == 200
+    start = time.monotonic()
+    serve(scenario, workers=1, timeout=0.3)
+    assert time.monotonic() - start < 3
+
+
+def test_parse_params():
+    params, output = parse_params('remove-bg', [('bgcolor', '255,0,0'), ('fast', 'true'), ('format', 'jpg')])
+    assert params['bgcolor'] == (255, 0, 0, 255)
+    assert params['fast'] is True
+    assert output['format'] == 'JPEG'
+
+
+@pytest.mark.parametrize('query', [
+    [('format', 'jpeg'), ('quality', '500')],
+    [('quality', '0')],
+    [('compress_level', '10')],
+    [('compress_level', '-1')],
+])
+def test_parse_params_checks_output_ranges(query):
+    with pytest.raises(ValueError):
+        parse_params('filter', query)
+
+
+def test_metrics_percentiles():
+    metrics = Metrics()
+    for ms in range(1, 101):
+        metrics.record(ms / 1000)
+    snapshot = metrics.snapshot(3, 1, 2)
+    assert snapshot['latency_ms'] == dict(p50=51.0, p90=91.0, p99=100.0)
+    assert snapshot['queue_depth'] == 3
+    assert snapshot['throughput_per_s'] > 0
@@ -0,0 +1,56 @@
+import sys
+import threading
+from types import SimpleNamespace
+
+from imagic.sessions import SessionPool
+
+
+class CountingPool(SessionPool):
+    """Pool that builds cheap placeholder sessions and counts them"""
+
+    def __init__(self):
+        super().__init__(num_threads=2)
+        self.created = []
+        self.barrier = threading.Event()
+
+    def _create(self, model):
+        self.barrier.wait(1)
+        self.created.append(model)
+        return object()
+
+
+def test_session_created_once_per_model():
+    pool = CountingPool()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.get('isnet'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    pool.barrier.set()
+    for thread in threads:
+        thread.join()
+
+    assert pool.created == ['isnet-general-use']
+    assert len({id(session) for session in results}) == 1
+    assert pool.is_loaded('isnet')
+    assert not pool.is_loaded('u2net')
+
+
+def test_preload_runs_in_background():
+    pool = CountingPool()
+    pool.barrier.set()
+    pool.preload(['u2net', 'silueta']).join()
+    assert pool.created == ['u2net', 'silueta']
+
+
+def test_sessions_use_only_intra_op_threads(monkeypatch):
+    created = []
+    options = lambda: SimpleNamespace(intra_op_num_threads=0, inter_op_num_threads=0)
+    monkeypatch.setitem(sys.modules, 'onnxruntime', SimpleNamespace(SessionOptions=options))
+    monkeypatch.setitem(sys.modules, 'rembg', SimpleNamespace(
+        new_session=lambda model, sess_opts: created.append((model, sess_opts)) or object()))
+
+    SessionPool(num_threads=3).get('isnet')
+    [(model, sess_opts)] = created
+    assert model == 'isnet-general-use'
+    assert sess_opts.intra_op_num_threads == 3
+    assert sess_opts.inter_op_num_threads == 0
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+from PIL import ExifTags, Image
+
+from imagic.pipeline import Recipe, process_recipe
+from imagic.sources import ImageSource, SourceCache, open_image, oriented
+from imagic.thumbnails import ThumbnailCache
+
+
+def save_rotated(path, size=(400, 200)):
+    """A JPEG stored sideways: upright it is size[1] wide, with red at the top"""
+    img = Image.new('RGB', size, 'blue')
+    img.paste('red', (0, 0, size[0] // 4, size[1]))
+    exif = Image.Exif()
+    # Orientation 6: rotate 90 degrees clockwise to display
+    exif[ExifTags.Base.Orientation] = 6
+    img.save(path, quality=95, exif=exif)
+    return path
+
+
+def test_open_image_is_upright(tmp_path):
+    path = save_rotated(tmp_path / 'photo.jpg')
+    img = open_image(path)
+    assert img.size == (200, 400)
+    assert img.getexif().get(ExifTags.Base.Orientation, 1) == 1
+    r, g, b = img.getpixel((100, 10))
+    assert r > 200 and b < 50
+
+    reduced = open_image(path, max_size=100)
+    assert reduced.size == (50, 100)
+    assert reduced.getpixel((25, 2))[0] > 200
+
+
+def test_oriented_keeps_upright_images():
+    img = Image.new('RGB', (4, 4))
+    assert oriented(img) is img
+
+
+def test_source_decodes_once(tmp_path):
+    path = tmp_path / 'big.jpg'
+    Image.new('RGB', (2000, 1000), 'green').save(path)
+    source = ImageSource(path)
+
+    # Before the full decode, reduced copies come from a reduced decode
+    small = source.reduced(250)
+    assert small.size == (250, 125)
+    assert not source.decoded
+    assert source.reduced(250) is small
+
+    full = source.image()
+    assert full.size == (2000, 1000)
+    assert source.image() is full
+    assert source.reduced(500).size == (500, 250)
+
+
+def test_source_cache_invalidation_and_size(tmp_path):
+    cache = SourceCache(max_entries=2)
+    paths = []
+    for index in range(3):
+        paths.append(tmp_path / f'img{index}.png')
+        Image.new('RGB', (20, 10), (index, 0, 0)).save(paths[-1])
+    first = cache.get(paths[0])
+    assert cache.get(paths[0]) is first
+    cache.get(paths[1])
+    cache.get(paths[2])
+    assert len(cache) == 2
+    assert cache.get(paths[0]) is not first
+
+    Image.new('RGB', (20, 20)).save(paths[2])
+    os.utime(paths[2], ns=(0, 10 ** 9))
+    assert cache.get(paths[2]).image().size == (20, 20)
+
+
+def test_processing_shares_upright_decode(tmp_path):
+    path = save_rotated(tmp_path / 'photo.jpg')
+    sources = SourceCache()
+    recipe = Recipe().add('filter', dict(filter='Negative'))
+    result = process_recipe(path, recipe, sources=sources)
+    assert result.size == (200, 400)
+    decoded = sources.get(path).image()
+    assert np.array_equal(np.asarray(result), 255 - np.asarray(decoded))
+    # Without a source cache the file is decoded upright too
+    assert np.array_equal(np.asarray(process_recipe(path, recipe)), np.asarray(result))
+
+
+def test_thumbnails_are_upright(tmp_path):
+    path = save_rotated(tmp_path / 'photo.jpg')
+    assert ThumbnailCache(max_size=100).get(path).size == (50, 100)
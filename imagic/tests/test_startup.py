@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from imagic.startup import import_times, parse_importtime
+
+SRC = os.path.join(os.path.dirname(__file__), '..', 'src')
+
+
+def test_parse_importtime():
+    text = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |   _io',
+        'import time:       300 |       5000 | numpy',
+        'some other stderr line',
+    ])
+    assert parse_importtime(text) == [(5000, 300, 'numpy'), (120, 120, '_io')]
+
+
+def test_import_times_measures_module():
+    names = [name for _, _, name in import_times('imagic.formats')]
+    assert 'imagic.formats' in names
+
+
+@pytest.mark.parametrize('module', ['imagic.startup', 'imagic.formats', 'imagic.scheduler', 'imagic.sessions', 'imagic.instrument'])
+def test_light_modules_do_not_import_heavy_dependencies(module):
+    code = (
+        f'import sys, {module}; '
+        'heavy = {"numpy", "cv2", "PIL", "rembg", "onnxruntime", "tkinter"} & set(sys.modules); '
+        'assert not heavy, heavy'
+    )
+    subprocess.run([sys.executable, '-c', code], check=True, env=dict(os.environ, PYTHONPATH=SRC))
@@ -0,0 +1,41 @@
+import os
+
+from PIL import Image
+
+from imagic.thumbnails import ThumbnailCache, make_thumbnail
+
+
+def test_make_thumbnail_bounds_size_and_mode(tmp_path):
+    path = tmp_path / 'big.jpg'
+    Image.new('RGB', (4000, 3000), (10, 120, 200)).save(path)
+    with Image.open(path) as img:
+        thumbnail = make_thumbnail(img, 300)
+    assert thumbnail.size == (300, 225)
+    assert thumbnail.mode == 'RGB'
+
+    palette = Image.new('P', (800, 400))
+    palette.info['transparency'] = 0
+    assert make_thumbnail(palette, 300).mode == 'RGBA'
+
+
+def test_cache_hits_and_invalidation(tmp_path):
+    path = tmp_path / 'img.png'
+    Image.new('RGB', (1000, 500), 'red').save(path)
+    cache = ThumbnailCache(max_size=100)
+    first = cache.get(path)
+    assert cache.get(path) is first
+
+    # A changed file gets a new thumbnail
+    Image.new('RGB', (1000, 1000), 'blue').save(path)
+    os.utime(path, ns=(0, 10 ** 9))
+    assert cache.get(path).size == (100, 100)
+
+
+def test_cache_memory_cap(tmp_path):
+    cache = ThumbnailCache(max_size=100, max_bytes=100 * 100 * 3 * 2)
+    for index in range(5):
+        path = tmp_path / f'img{index}.png'
+        Image.new('RGB', (400, 400), (index, 0, 0)).save(path)
+        cache.get(path)
+    assert len(cache) == 2
+    assert cache.current_bytes <= cache.max_bytes
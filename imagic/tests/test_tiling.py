@@ -0,0 +1,82 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagic.enhance import enhance, enhance_tiled, image_contrast_mean
+from imagic.filters import FILTERS, apply_filter
+from imagic.processing import artistic_filter_tiled, run_operation
+from imagic.tiling import gaussian_halo, needs_tiling, process_tiled, tile_boxes
+
+EXAMPLE = Path(__file__).parent.parent / 'examples' / 'Taylor-Swift.jpg'
+
+
+@pytest.fixture(scope='module')
+def photo():
+    with Image.open(EXAMPLE) as img:
+        img.thumbnail((400, 400))
+        return img.convert('RGB')
+
+
+def test_tile_boxes_cover_image():
+    boxes = list(tile_boxes(250, 130, 100))
+    assert len(boxes) == 6
+    assert boxes[-1] == (200, 100, 250, 130)
+    assert sum((r - l) * (b - t) for l, t, r, b in boxes) == 250 * 130
+
+
+def test_gaussian_halo():
+    # Radius 2 is a 5-tap box, three passes
+    assert gaussian_halo(2) == 6
+    assert gaussian_halo(10) > gaussian_halo(2)
+
+
+def test_needs_tiling(monkeypatch):
+    img = Image.new('RGB', (1000, 1000))
+    assert not needs_tiling(img)
+    monkeypatch.setenv('IMAGIC_MEMORY_BUDGET_MB', '1')
+    assert needs_tiling(img)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_process_tiled_is_seamless(photo, workers):
+    func = lambda tile: apply_filter(tile, 'Blur', 1.5)
+    expected = np.asarray(func(photo))
+    result = process_tiled(photo, func, gaussian_halo(3), tile_size=64, workers=workers)
+    np.testing.assert_array_equal(np.asarray(result), expected)
+
+
+@pytest.mark.parametrize('name', FILTERS)
+def test_filters_tiled(photo, name):
+    expected = np.asarray(apply_filter(photo, name, 0.8))
+    result = artistic_filter_tiled(photo, name, 0.8, tile_size=96)
+    np.testing.assert_array_equal(np.asarray(result), expected)
+
+
+@pytest.mark.parametrize('params', [
+    dict(),
+    dict(sharpness=1.8),
+    dict(portrait=True, contrast=1.5),
+])
+def test_enhance_tiled(photo, params):
+    expected = np.asarray(enhance(photo, **params))
+    result = enhance_tiled(photo, tile_size=96, **params)
+    np.testing.assert_array_equal(np.asarray(result), expected)
+
+
+def test_image_contrast_mean_matches(photo):
+    # Measured band by band, the mean is the one enhance() measures itself
+    for portrait in (False, True):
+        mean = image_contrast_mean(photo, 1.2, 1.1, portrait, band_rows=50)
+        forced = enhance(photo, portrait=portrait, contrast=1.8, mean=mean)
+        np.testing.assert_array_equal(np.asarray(forced), np.asarray(enhance(photo, portrait=portrait, contrast=1.8)))
+
+
+def test_run_operation_tiles_over_budget(photo, monkeypatch):
+    rgba = photo.convert('RGBA')
+    expected = np.asarray(run_operation(rgba, 'filter', filter='Emboss', intensity=1.0))
+    monkeypatch.setenv('IMAGIC_MEMORY_BUDGET_MB', '0.1')
+    result = run_operation(rgba, 'filter', filter='Emboss', intensity=1.0)
+    assert result.mode == 'RGBA'
+    np.testing.assert_array_equal(np.asarray(result), expected)